@@ -1,26 +1,26 @@
 import argparse
+import atexit
 from fileinput import filename
-import io
 import logging
-from pprint import pformat
 from collections import Counter
 from typing import Any
 import coloredlogs
 import os
 from proxyUdpServer import ProxyUdpServer
+from asyncUdpServer import AsyncUdpServer
 
-from udpserver import UdpServer
+from udpserver import GET_PROG_INTERVAL, UdpServer
+from packettrace import tracer
 from restapi import app
-from database import Database
+from database import PROFILES, Database
+from datalog import DatalogWriter
+from downlink import DownlinkScheduler
+from ingest import DEADBAND, HEARTBEAT, TemperatureFilter
+from capture import CaptureFile, CaptureWriter
 from proxyMiddleware import ProxyMiddleware
+from mqttbridge import COALESCE_WINDOW, MAX_QUEUE, MqttBridge, connect
 from urllib.parse import ParseResult, urlparse
 
-from ha_mqtt_discoverable.climate import (
-    Climate,
-    ClimateInfo,
-    ClimateSetting,
-)
-
 
 def mqtt_url(arg):  # -> Any | ParseResult:
     url: ParseResult = urlparse(arg)
@@ -29,6 +29,13 @@ def mqtt_url(arg):  # -> Any | ParseResult:
     raise argparse.ArgumentTypeError("Invalid URL")
 
 
+def pragma(arg_value):
+    name, sep, value = arg_value.partition("=")
+    if not sep or not name.isidentifier() or not value.lstrip("-").isalnum():
+        raise argparse.ArgumentTypeError("Invalid pragma, expected name=value")
+    return name, value
+
+
 if __name__ == "__main__":
 
     # Get the arguments from the command-line except the filename
@@ -106,6 +113,22 @@ if __name__ == "__main__":
         help="MQTT server url in format mqtt(s)://[<user>:<passwors>@]<server>:<port>",
     )
 
+    ap.add_argument(
+        "--mqtt-coalesce",
+        required=False,
+        default=COALESCE_WINDOW,
+        type=float,
+        help="Seconds of room changes published in one MQTT message per room",
+    )
+
+    ap.add_argument(
+        "--mqtt-queue",
+        required=False,
+        default=MAX_QUEUE,
+        type=int,
+        help="MQTT messages kept while the broker is unreachable, the oldest are dropped",
+    )
+
     ap.add_argument(
         "--datalog-udp-path",
         required=False,
@@ -122,11 +145,134 @@ if __name__ == "__main__":
         help="Dump file for all TCP comunication - only for develop",
     )
 
+    ap.add_argument(
+        "--datalog-format",
+        required=False,
+        default="csv",
+        choices=["csv", "binary"],
+        help="Datalog files as CSV of hex dumps or as binary captures (see capture.py)",
+    )
+
+    ap.add_argument(
+        "--datalog-rotate-bytes",
+        required=False,
+        default=0,
+        type=int,
+        help="Rotate binary datalogs at this size (0 = never)",
+    )
+
+    ap.add_argument(
+        "--datalog-rotate-interval",
+        required=False,
+        default=0,
+        type=float,
+        help="Rotate binary datalogs every N seconds (0 = never)",
+    )
+
+    ap.add_argument(
+        "--datalog-compress",
+        action=argparse.BooleanOptionalAction,
+        required=False,
+        default=True,
+        help="gzip the rotated binary datalog segments",
+    )
+
+    ap.add_argument(
+        "--datalog-queue",
+        required=False,
+        default=10000,
+        type=int,
+        help="Max datalog records waiting to be written, more are dropped",
+    )
+
+    ap.add_argument(
+        "--datalog-fsync-interval",
+        required=False,
+        default=1.0,
+        type=float,
+        help="Max seconds between two fsync of the datalog files",
+    )
+
+    ap.add_argument(
+        "--datalog-fsync-bytes",
+        required=False,
+        default=64 * 1024,
+        type=int,
+        help="Bytes written to a datalog file that trigger an fsync",
+    )
+
+    ap.add_argument(
+        "--udp-engine",
+        required=False,
+        default="thread",
+        choices=["thread", "asyncio"],
+        help="Engine serving the UDP socket: blocking thread (default) or asyncio",
+    )
+
+    ap.add_argument(
+        "--udp-workers",
+        required=False,
+        default=0,
+        type=int,
+        help="Worker threads handling UDP messages, one ordered queue per device (0 = handle in the receive loop)",
+    )
+
+    ap.add_argument(
+        "--downlink-gap",
+        required=False,
+        default=GET_PROG_INTERVAL,
+        type=float,
+        help="Min seconds between two downlink commands sent to the same device",
+    )
+
+    ap.add_argument(
+        "--downlink-workers",
+        required=False,
+        default=0,
+        type=int,
+        help="Max worker threads sending the queued downlink commands (0 = one per device with a command running)",
+    )
+
+    ap.add_argument(
+        "--temperature-deadband",
+        required=False,
+        default=DEADBAND,
+        type=float,
+        help="Log a room temperature when it moved by this many degC (0 = log every STATUS)",
+    )
+
+    ap.add_argument(
+        "--temperature-heartbeat",
+        required=False,
+        default=HEARTBEAT,
+        type=float,
+        help="Max seconds between two logged temperatures of a room",
+    )
+
+    ap.add_argument(
+        "--db-profile",
+        required=False,
+        default=os.getenv("BESIM_DB_PROFILE", "performance"),
+        choices=list(PROFILES),
+        help="SQLite tuning: performance (WAL, synchronous=NORMAL, mmap, cache) or the SQLite defaults",
+    )
+
+    ap.add_argument(
+        "--db-pragma",
+        required=False,
+        action="append",
+        default=[],
+        type=pragma,
+        help="Override a pragma of the database profile, name=value (repeatable)",
+    )
+
     args: dict[str, Any] = vars(ap.parse_args())
 
     fmt = "[%(asctime)s %(filename)s->%(funcName)s():%(lineno)d] %(levelname)s: %(message)s"
     if args["log_level"] == "TRACE":
         args["log_level"] = logging.DEBUG
+        # Trace every packet, otherwise enabled per device/MsgId on /api/v1.0/udp/trace
+        tracer.configure(all=True)
     logging.basicConfig(format=fmt, level=args["log_level"])
     coloredlogs.install(
         isatty=True,
@@ -150,48 +296,54 @@ if __name__ == "__main__":
         "BESIM_DATABASE", os.path.join(args["config_path"], "besim.db")
     )
     database = Database(name=database_name)
+    database.configure(args["db_profile"], dict(args["db_pragma"]))
     if not database.check_migrations():
+        database.close_connections()
         os.remove(database_name)
         database.create_tables()
 
     database.purge(365 * 2)  # @todo currently only purging old records at startup
+    db_settings = database.get_settings()
+    logging.info(f"Database {args['db_profile']} profile: {db_settings}")
+    journal_mode = str(database.pragmas.get("journal_mode", "")).lower()
+    if journal_mode and db_settings["journal_mode"] != journal_mode:
+        # e.g. WAL is not available on network file systems
+        logging.warning(f"Database journal_mode is {db_settings['journal_mode']}")
 
     app.template_folder = args["template_dir"]
     app.static_folder = args["static_dir"]
 
-    # MQTT connection and config
-    if args["mqtt_url"]:
-        mqtt_params: ParseResult = args["mqtt_url"]
-        assert mqtt_params.hostname
-        mqtt_settings = ClimateSetting.MQTT(
-            host=mqtt_params.hostname,
-            port=mqtt_params.port,
-            username=mqtt_params.username,
-            password=mqtt_params.password,
-            use_tls=mqtt_params.scheme == "mqtts",
-        )
-        logging.debug(("MQTT Settings", pformat(mqtt_settings)))
-    """    
-    climate_info = ClimateInfo(
-        name=request.param["name"], temperature_unit="C", preset_modes=["eco", "boost"]
-    )
-    settings = ClimateSetting(
-        mqtt=mqtt_settings,
-        entity=climate_info,
-        manual_availability=request.param["manual_availability"],
-        capability=request.param["capability"],
-    )
-    """
     # logging.info(pformat(app.config), app.static_folder, app.template_folder)
 
     # Datalog Files
-    if args["datalog_udp_path"] is not None:
-        datalog_udp: io.TextIOWrapper = open(args["datalog_udp_path"], "at")
+    def datalog(path: str) -> DatalogWriter:
+        options = dict(
+            maxQueue=args["datalog_queue"],
+            fsyncInterval=args["datalog_fsync_interval"],
+            fsyncBytes=args["datalog_fsync_bytes"],
+        )
+        if args["datalog_format"] == "binary":
+            capture = CaptureFile(
+                path,
+                rotateBytes=args["datalog_rotate_bytes"],
+                rotateInterval=args["datalog_rotate_interval"],
+                compress=args["datalog_compress"],
+            )
+            writer: DatalogWriter = CaptureWriter(capture, **options)
+        else:
+            writer = DatalogWriter(open(path, "at"), **options)
+        writer.start()
+        atexit.register(writer.close)
+        return writer
+
+    datalog_udp: DatalogWriter | None = None
+    datalog_tcp: DatalogWriter | None = None
+    if args["datalog_udp_path"]:
+        datalog_udp = datalog(args["datalog_udp_path"])
         # datalog_udp.write('"DIRECTION","ADDRESS","HEX_DATA_DUMP"\r\n')
-        # datalog_udp.flush()
-        # os.fsync(datalog_udp)
-    if args["datalog_tcp_path"] is not None:
-        datalog_tcp: io.TextIOWrapper = open(args["datalog_tcp_path"], "at")
+    if args["datalog_tcp_path"]:
+        datalog_tcp = datalog(args["datalog_tcp_path"])
+    app.config["datalogs"] = {"udp": datalog_udp, "tcp": datalog_tcp}
 
     if args["weather_location"] is not None:
         # logging.(pformat(args["weather_location"]))
@@ -200,17 +352,51 @@ if __name__ == "__main__":
         app.config["weather_location_latitude"] = [None, None]
 
     # udpServer = UdpServer(("", 6199))
+    downlink = DownlinkScheduler(args["downlink_gap"], args["downlink_workers"])
+    temperatureFilter = TemperatureFilter(
+        args["temperature_deadband"], args["temperature_heartbeat"]
+    )
     if args["proxy_mode"] is not None:
         udpServer = ProxyUdpServer(
             ("", 6199),
             args["proxy_mode"],
             debugmode=args["devmode"],
             datalog=datalog_udp,
+            workers=args["udp_workers"],
+            downlink=downlink,
+            temperatureFilter=temperatureFilter,
+        )
+    else:
+        udpServer = UdpServer(
+            ("", 6199),
+            datalog=datalog_udp,
+            workers=args["udp_workers"],
+            downlink=downlink,
+            temperatureFilter=temperatureFilter,
         )
+    udpServer.boosts.restore()
+    if args["udp_engine"] == "asyncio":
+        AsyncUdpServer(udpServer).start()
     else:
-        udpServer = UdpServer(("", 6199), datalog=datalog_udp)
-    udpServer.start()
+        udpServer.start()
     app.config["udpServer"] = udpServer
+
+    # MQTT connection and config
+    if args["mqtt_url"]:
+        mqtt_params: ParseResult = args["mqtt_url"]
+        assert mqtt_params.hostname
+        mqtt_client = connect(mqtt_params)
+        mqtt_bridge = MqttBridge(
+            mqtt_client,
+            window=args["mqtt_coalesce"],
+            maxQueue=args["mqtt_queue"],
+            server=udpServer,
+        )
+        mqtt_bridge.start()
+        mqtt_client.loop_start()
+        atexit.register(mqtt_bridge.shutdown)
+        app.config["mqttBridge"] = mqtt_bridge
+        logging.debug(("MQTT Settings", mqtt_params.hostname, mqtt_params.port))
     # app.config["SERVER_NAME"] = "api.besmart-home.com:80"
     logging.debug(app.url_map)
 
@@ -0,0 +1,97 @@
+#
+# asyncio engine for UdpServer/ProxyUdpServer
+#
+# The receive path runs on an event loop (asyncio.DatagramProtocol) and never
+# blocks: every datagram is handed over to the wrapped server dispatcher, which
+# runs handleMsg() on worker threads, so a slow handler only delays its device.
+#
+# Downlinks waiting for the device answer are not awaited on the loop: they
+# run on the downlink scheduler workers (see downlink.py) and wait on the
+# concurrent.futures.Future of their cseq, resolved by the UDP handler or the
+# timer wheel. Nothing blocking ever runs on the loop, so there is no
+# awaitable wait.
+#
+import asyncio
+import logging
+import threading
+
+from dispatcher import DeviceDispatcher
+from packettrace import tracer
+from udpserver import UdpServer, peekDeviceId, peekMsgType
+
+logger = logging.getLogger(__name__)
+
+
+class TransportSocket:
+    # Socket like adapter so UdpServer.sendto() can be called from any thread
+    def __init__(self, loop: asyncio.AbstractEventLoop, transport) -> None:
+        self.loop = loop
+        self.transport = transport
+
+    def sendto(self, data, address) -> int:
+        self.loop.call_soon_threadsafe(self.transport.sendto, data, address)
+        return len(data)
+
+    def close(self) -> None:
+        self.loop.call_soon_threadsafe(self.transport.close)
+
+
+class UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, engine: "AsyncUdpServer") -> None:
+        self.engine = engine
+
+    def connection_made(self, transport) -> None:
+        self.engine.connection_made(transport)
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.engine.datagram_received(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        logger.warning(f"UDP error {exc!r}")
+
+    def connection_lost(self, exc) -> None:
+        if exc is not None:
+            logger.warning(f"UDP connection lost {exc!r}")
+
+
+class AsyncUdpServer(threading.Thread):
+
+    def __init__(self, server: UdpServer) -> None:
+        threading.Thread.__init__(self)
+        self.server: UdpServer = server
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.transport = None
+        if server.dispatcher is None:
+            # Never handle on the loop: at least one worker, still one message at a time
+            server.dispatcher = DeviceDispatcher(server.handle, 1)
+        server.engine = self
+
+    def run(self) -> None:
+        logger.info(f"UDP server ({type(self.server).__name__}) is running on asyncio")
+        asyncio.run(self.serve())
+
+    async def serve(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: UdpProtocol(self),
+            local_addr=self.server.addr,
+        )
+        try:
+            while not self.server.stop:
+                await asyncio.sleep(1)
+        finally:
+            transport.close()
+            self.server.dispatcher.shutdown(wait=False)  # type: ignore
+
+    def connection_made(self, transport) -> None:
+        assert self.loop is not None
+        self.transport = transport
+        self.server.sock = TransportSocket(self.loop, transport)  # type: ignore
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if tracer.active:
+            tracer.packet("From", addr, data, peekDeviceId(data), peekMsgType(data))
+        self.server.dispatch(data, addr)
+
+    def shutdown(self) -> None:
+        self.server.stop = True
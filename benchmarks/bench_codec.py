@@ -0,0 +1,124 @@
+#
+# Microbenchmark: per-message decode cost of the uplink payloads
+#
+# "legacy" is the field by field decode handleMsg() used before the schema
+# registry (struct.unpack_from + struct.calcsize on a format string for every
+# group of fields), "schema" is codec.UPLINK.
+#
+# Usage: python benchmarks/bench_codec.py [iterations]
+#
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from codec import UPLINK, MsgId  # noqa: E402
+
+DEVICEID = 596505258
+
+
+class LegacyUnpacker:
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.offset = offset
+
+    def __call__(self, fmt):
+        rc = struct.unpack_from(fmt, self.buffer, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return rc
+
+
+def legacy_status(payload):
+    unpack = LegacyUnpacker(payload)
+    header = unpack("<BBHI")
+    rooms = []
+    for _ in range(8):
+        room = unpack("<IBBhhhhhhh")
+        byte3, byte4, unk13, tempcurve, heatingsetp = unpack("<BBHBB")
+        rooms.append(
+            (
+                room,
+                (byte3 >> 3) & 0xF,
+                (byte3 >> 2) & 0x1,
+                (byte3 >> 1) & 0x1,
+                (byte4 >> 2) & 0x1,
+                (byte4 >> 1) & 0x1,
+                byte4 & 0x1,
+            )
+        )
+    ot = unpack("<BB"), unpack("<hhhhhhhhhh")
+    other = unpack("<BBHHHH")
+    return header, rooms, ot, other
+
+
+def legacy_program(payload):
+    unpack = LegacyUnpacker(payload)
+    header = unpack("<BBHIIH")
+    prog = []
+    for _ in range(24):
+        (p,) = unpack("<B")
+        prog.append(p)
+    return header, prog
+
+
+def legacy_fixed(fmt):
+    def decode(payload):
+        return LegacyUnpacker(payload)(fmt)
+
+    return decode
+
+
+def status_payload():
+    p = struct.pack("<BBHI", 0xFF, 2, 4, DEVICEID)
+    for room in range(8):
+        p += struct.pack(
+            "<IBBhhhhhhh", room + 1, 0x8F, 0x10, 205, 200, 210, 180, 160, 300, 50
+        )
+        p += struct.pack("<BBHBB", 0x30, 0x1, 0, 15, 40)
+    p += struct.pack("<BB", 0x20, 0) + struct.pack("<10h", *range(10))
+    p += struct.pack("<BBHHHH", 70, 0, 0, 0, 0, 0)
+    return p
+
+
+CASES = [
+    (MsgId.STATUS, status_payload(), legacy_status),
+    (
+        MsgId.PROGRAM,
+        struct.pack("<BBHIIH24B", 0xFF, 2, 1, DEVICEID, 1, 3, *range(24)),
+        legacy_program,
+    ),
+    (
+        MsgId.PING,
+        struct.pack("<BBHIH", 0xFF, 2, 4, DEVICEID, 1),
+        legacy_fixed("<BBHIH"),
+    ),
+    (
+        MsgId.SET_T1,
+        struct.pack("<BBHIIH", 3, 0, 1, DEVICEID, 1, 190),
+        lambda p: (LegacyUnpacker(p)("<BBHII"), LegacyUnpacker(p, 12)("<H")),
+    ),
+]
+
+
+def main(iterations: int) -> None:
+    print(f"{'message':<10} {'legacy ns':>10} {'schema ns':>10} {'speedup':>8}")
+    for msgId, payload, legacy in CASES:
+        schema = UPLINK.get(msgId)
+        assert schema is not None and schema.size == len(payload)
+        t_legacy = min(
+            timeit.repeat(lambda: legacy(payload), number=iterations, repeat=5)
+        )
+        t_schema = min(
+            timeit.repeat(lambda: schema.decode(payload), number=iterations, repeat=5)
+        )
+        ns_legacy = t_legacy / iterations * 1e9
+        ns_schema = t_schema / iterations * 1e9
+        print(
+            f"{msgId.name:<10} {ns_legacy:>10.0f} {ns_schema:>10.0f} {ns_legacy / ns_schema:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,72 @@
+#
+# Benchmark: SQLite throughput of the database profiles under concurrent load
+#
+# One writer thread logs batches of room temperatures, like the UDP server
+# does for a STATUS, while reader threads query the temperature history, like
+# the REST API. Each profile of database.PROFILES runs for the same time on a
+# fresh database file, the rows inserted and the queries answered per second
+# are printed with the effective pragmas.
+#
+# Usage: python benchmarks/bench_database.py [seconds] [readers]
+#
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from database import PROFILES, Database  # noqa: E402
+
+ROOMS = 8
+
+
+def run(database, seconds, readers):
+    stop = threading.Event()
+    counts = {"rows": 0, "reads": 0}
+
+    def write():
+        n = 0
+        while not stop.is_set():
+            ts = f"2024-01-01T00:{n // 60 % 60:02}:{n % 60:02}.{n:06}"
+            rows = [(ts, room, 20.0 + room, 21.0, n % 2) for room in range(ROOMS)]
+            database.log_temperatures(rows)
+            counts["rows"] += ROOMS
+            n += 1
+
+    def read(room):
+        reads = 0
+        while not stop.is_set():
+            database.get_temperature(room, "2024-01-01", "2024-01-02")
+            reads += 1
+        with lock:
+            counts["reads"] += reads
+
+    lock = threading.Lock()
+    threads = [threading.Thread(target=write)]
+    threads += [threading.Thread(target=read, args=(r,)) for r in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counts["rows"] / seconds, counts["reads"] / seconds
+
+
+def main(seconds=5.0, readers=4):
+    database = Database()
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in PROFILES:
+            database.name = os.path.join(tmp, f"{profile}.db")
+            database.configure(profile)
+            database.check_migrations()
+            settings = database.get_settings()
+            inserts, reads = run(database, seconds, readers)
+            print(f"{profile}: {settings}")
+            print(f"  {inserts:>10.0f} rows/s inserted  {reads:>10.0f} queries/s")
+
+
+if __name__ == "__main__":
+    main(*(float(a) if i == 0 else int(a) for i, a in enumerate(sys.argv[1:])))
@@ -0,0 +1,113 @@
+#
+# Benchmark: Frame decode/encode over a corpus of captured frames
+#
+# The corpus is the raw frames documented in API_REVERSE.md plus, when given,
+# the "I"/"O"/"C" records of UDP datalogs written with --datalog-udp-path.
+# "legacy" is the Frame implementation before the zero-copy rewrite (payload
+# copies, bytes concatenation and crccheck), "table" is a pure python
+# 256-entry table CRC for reference, "frame" is udpserver.Frame.
+#
+# Usage: python benchmarks/bench_frame.py [datalog.csv ...]
+#
+import csv
+import os
+import re
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from crccheck.crc import Crc16Xmodem  # noqa: E402
+from udpserver import MAGIC_FOOTER, MAGIC_HEADER, Frame  # noqa: E402
+
+
+def _table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+
+TABLE = _table()
+
+
+def table_crc(data) -> int:
+    crc = 0
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ TABLE[(crc >> 8) ^ b]
+    return crc
+
+
+def legacy_decode(data):
+    hdr, length, seq = struct.unpack_from("<HHI", data, 0)
+    if hdr != MAGIC_HEADER or len(data) != length + 12:
+        return None
+    payload = data[8 : 8 + length]
+    crc, ftr = struct.unpack_from("<HH", data, 8 + length)
+    if Crc16Xmodem.calc(payload) != crc or ftr != MAGIC_FOOTER:
+        return None
+    return payload
+
+
+def legacy_encode(payload, seq=0xFFFFFFFF):
+    buf = struct.pack("<HHI", MAGIC_HEADER, len(payload), seq)
+    buf += payload
+    buf += struct.pack("<HH", Crc16Xmodem.calc(payload), MAGIC_FOOTER)
+    return buf
+
+
+def synthetic_status(deviceid=596505258):
+    p = struct.pack("<BBHBBHI", 0x24, 0x04, 248 - 8, 0xFF, 2, 4, deviceid)
+    p += bytes(248 - 8)
+    return legacy_encode(p, seq=1)
+
+
+def load_corpus(paths):
+    corpus = []
+    with open(os.path.join(os.path.dirname(__file__), "..", "API_REVERSE.md")) as f:
+        corpus += [bytes.fromhex(h) for h in re.findall(r"Raw: ([0-9A-F]+)", f.read())]
+    for path in paths:
+        with open(path, newline="") as f:
+            for row in csv.reader(f):
+                if len(row) == 3 and row[0] in ("I", "O", "C"):
+                    corpus.append(bytes.fromhex(row[2]))
+    corpus += [synthetic_status()] * 8  # STATUS is most of the real traffic
+    return [data for data in corpus if legacy_decode(data) is not None]
+
+
+def bench(fn, corpus, number):
+    def run():
+        for data in corpus:
+            fn(data)
+
+    return min(timeit.repeat(run, number=number, repeat=5)) / (number * len(corpus))
+
+
+def main(paths):
+    corpus = load_corpus(paths)
+    payloads = [legacy_decode(data) for data in corpus]
+    for data, payload in zip(corpus, payloads):
+        assert bytes(Frame().decode(data)) == payload
+        assert table_crc(payload) == Crc16Xmodem.calc(payload)
+        assert bytes(Frame(payload=payload).encode()) == legacy_encode(payload)
+
+    number = 2000
+    print(f"corpus: {len(corpus)} frames, {sum(map(len, corpus))} bytes")
+    results = [
+        ("crc crccheck", bench(Crc16Xmodem.calc, payloads, number)),
+        ("crc table (py)", bench(table_crc, payloads, number)),
+        ("decode legacy", bench(legacy_decode, corpus, number)),
+        ("decode frame", bench(lambda d: Frame().decode(d), corpus, number)),
+        ("encode legacy", bench(legacy_encode, payloads, number)),
+        ("encode frame", bench(lambda p: Frame(payload=p).encode(), payloads, number)),
+    ]
+    for name, seconds in results:
+        print(f"{name:<16} {seconds * 1e9:>10.0f} ns/frame")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,334 @@
+#
+# Binary capture format for the datalogs
+#
+# A capture is a sequence of segments, each one starts with MAGIC followed by
+# length prefixed records:
+#
+#   size(4) time(8, double) direction(1) peerLen(1) peer(peerLen) data
+#
+# size is the whole record, header included. The active segment is <path>,
+# rotated segments are <path>.<YYYYmmdd-HHMMSS> and, once compressed,
+# <path>.<YYYYmmdd-HHMMSS>.gz. Every segment has a <segment>.idx sidecar of
+# (time, offset) entries, at most one every indexInterval seconds, so readers
+# can start close to a time window instead of scanning the whole segment. In
+# compressed segments every index entry starts a new gzip member and the
+# offset is the one of the member in the .gz file.
+#
+# Usage:
+#   python capture.py convert datalog.csv capture.bin [--start EPOCH] [--interval S]
+#   python capture.py dump capture.bin [--from TIME] [--to TIME]
+#
+import argparse
+import csv
+import glob
+import gzip
+import io
+import logging
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from typing import IO, Iterable, Iterator, NamedTuple
+
+from datalog import DatalogWriter
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BSCAP001"
+RECORD = struct.Struct("<IdcB")
+INDEX = struct.Struct("<dQ")
+
+
+class Record(NamedTuple):
+    time: float
+    direction: str
+    peer: str
+    data: bytes
+
+
+def encodeRecord(ts: float, direction: str, peer, data) -> bytes:
+    p = str(peer).encode()[:255]
+    return (
+        RECORD.pack(RECORD.size + len(p) + len(data), ts, direction.encode(), len(p))
+        + p
+        + data
+    )
+
+
+def iterRecords(f: IO[bytes]) -> Iterator[Record]:
+    read = f.read
+    while len(header := read(RECORD.size)) == RECORD.size:
+        size, ts, direction, peerLen = RECORD.unpack(header)
+        body = read(size - RECORD.size)
+        if len(body) != size - RECORD.size:
+            logger.warn("Truncated capture record")
+            return
+        yield Record(ts, direction.decode(), body[:peerLen].decode(), body[peerLen:])
+
+
+def readIndex(path: str) -> list[tuple[float, int]]:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+    n = len(data) // INDEX.size
+    return list(INDEX.iter_unpack(data[: n * INDEX.size]))
+
+
+def compressSegment(path: str) -> str:
+    # One gzip member per index block, the index is rewritten with the offsets
+    # of the members
+    index = readIndex(path + ".idx")
+    with open(path, "rb") as f:
+        data = f.read()
+    gzPath = path + ".gz"
+    bounds = [offset for _, offset in index] + [len(data)]
+    newIndex = []
+    with open(gzPath + ".tmp", "wb") as out:
+        if bounds[0] > 0:
+            out.write(gzip.compress(data[: bounds[0]]))
+        for (ts, start), end in zip(index, bounds[1:]):
+            newIndex.append(INDEX.pack(ts, out.tell()))
+            out.write(gzip.compress(data[start:end]))
+        out.flush()
+        os.fsync(out.fileno())
+    with open(gzPath + ".idx", "wb") as out:
+        out.write(b"".join(newIndex))
+    os.replace(gzPath + ".tmp", gzPath)
+    os.remove(path)
+    os.remove(path + ".idx")
+    return gzPath
+
+
+class CaptureFile:
+    def __init__(
+        self,
+        path: str,
+        rotateBytes: int = 0,
+        rotateInterval: float = 0,
+        compress: bool = True,
+        indexInterval: float = 1.0,
+    ) -> None:
+        self.path = path
+        self.rotateBytes = rotateBytes  # 0 = never
+        self.rotateInterval = rotateInterval  # 0 = never
+        self.compress = compress
+        self.indexInterval = indexInterval
+        self.compressors: list[threading.Thread] = []
+        self.open()
+
+    def open(self) -> None:
+        self.file = open(self.path, "ab")
+        self.index = open(self.path + ".idx", "ab")
+        self.size = self.file.tell()
+        if self.size == 0:
+            self.file.write(MAGIC)
+            self.size = len(MAGIC)
+        entries = readIndex(self.path + ".idx")
+        self.lastIndex = entries[-1][0] if entries else float("-inf")
+        self.opened = time.time()
+
+    def write(self, records: Iterable[tuple]) -> int:
+        # records are (time, direction, peer, data), returns the bytes written
+        written = 0
+        buf = bytearray()
+        for ts, direction, peer, data in records:
+            if self.size > len(MAGIC) and (
+                (self.rotateBytes and self.size >= self.rotateBytes)
+                or (self.rotateInterval and ts - self.opened >= self.rotateInterval)
+            ):
+                self.file.write(buf)
+                written += len(buf)
+                buf.clear()
+                self.rotate()
+            if ts - self.lastIndex >= self.indexInterval:
+                self.index.write(INDEX.pack(ts, self.size))
+                self.lastIndex = ts
+            record = encodeRecord(ts, direction, peer, data)
+            buf += record
+            self.size += len(record)
+        self.file.write(buf)
+        return written + len(buf)
+
+    def flush(self) -> None:
+        self.file.flush()
+        self.index.flush()
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def rotate(self) -> str:
+        self.close()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(self.opened))
+        segment = f"{self.path}.{stamp}"
+        n = 0
+        while glob.glob(glob.escape(segment) + "*"):
+            n += 1
+            segment = f"{self.path}.{stamp}-{n:03d}"
+        os.replace(self.path + ".idx", segment + ".idx")
+        os.replace(self.path, segment)
+        if self.compress:
+            compressor = threading.Thread(
+                target=self._compress, args=(segment,), name="capture-compress"
+            )
+            compressor.start()
+            self.compressors = [t for t in self.compressors if t.is_alive()]
+            self.compressors.append(compressor)
+        self.open()
+        return segment
+
+    def _compress(self, segment: str) -> None:
+        try:
+            compressSegment(segment)
+        except Exception:
+            logger.error(traceback.format_exc())
+
+    def close(self) -> None:
+        self.flush()
+        os.fsync(self.file.fileno())
+        os.fsync(self.index.fileno())
+        self.file.close()
+        self.index.close()
+
+
+class CaptureWriter(DatalogWriter):
+    binary = True
+
+    def __init__(self, file: CaptureFile, **kwargs) -> None:
+        super().__init__(file, **kwargs)  # type: ignore
+
+    def encode(self, records: list) -> list:
+        # CaptureFile encodes, indexes and rotates
+        return records
+
+
+def segments(path: str) -> list[str]:
+    # Rotated segments in time order, then the active one
+    found = {}
+    for name in glob.glob(glob.escape(path) + ".*"):
+        if name.endswith((".idx", ".tmp")):
+            continue
+        base = name[:-3] if name.endswith(".gz") else name
+        # Both exist only if the removal of the raw segment was interrupted
+        if base not in found or name.endswith(".gz"):
+            found[base] = name
+    return [found[base] for base in sorted(found)] + (
+        [path] if os.path.exists(path) else []
+    )
+
+
+def readCapture(
+    path: str, start: float | None = None, end: float | None = None
+) -> Iterator[Record]:
+    paths = segments(path)
+    indexes = [readIndex(p + ".idx") for p in paths]
+    for n, (segment, index) in enumerate(zip(paths, indexes)):
+        if start is not None and any(i and i[0][0] <= start for i in indexes[n + 1 :]):
+            continue  # a later segment already starts before start
+        offset = None
+        if start is not None:
+            for ts, entry in index:
+                if ts > start:
+                    break
+                offset = entry
+        with open(segment, "rb") as raw:
+            if segment.endswith(".gz"):
+                raw.seek(offset or 0)
+                f: IO[bytes] = gzip.GzipFile(fileobj=raw)  # type: ignore
+            else:
+                f = raw
+                f.seek(offset or 0)
+            if not offset and f.read(len(MAGIC)) != MAGIC:
+                logger.error(f"{segment} isn't a capture")
+                continue
+            for record in iterRecords(f):
+                if start is not None and record.time < start:
+                    continue
+                if end is not None and record.time > end:
+                    return
+                yield record
+
+
+def convertCsv(
+    csvPath: str, capture: CaptureFile, start: float | None = None, interval=0.0
+) -> int:
+    # The CSV datalogs have no timestamps: records are given start (the csv
+    # file mtime by default) + n * interval
+    ts = os.path.getmtime(csvPath) if start is None else start
+    n = 0
+    with open(csvPath, newline="") as f:
+        for row in csv.reader(f):
+            if not row:
+                continue
+            direction = row[0]
+            if len(row) == 3 and row[1].startswith("("):
+                # UDP: direction, addr, frame
+                capture.write([(ts, direction, row[1], bytes.fromhex(row[2]))])
+            elif len(row) == 3 and direction == "I":
+                # TCP request: pickled env, body
+                env = pickle.loads(bytes.fromhex(row[1]))
+                data = pickle.dumps((env, bytes.fromhex(row[2])))
+                capture.write([(ts, direction, env.get("REMOTE_ADDR", ""), data)])
+            elif len(row) == 5 and direction == "O":
+                # TCP response: status, pickled env, pickled headers, body
+                env = pickle.loads(bytes.fromhex(row[2]))
+                headers = pickle.loads(bytes.fromhex(row[3]))
+                data = pickle.dumps((env, headers, bytes.fromhex(row[4])))
+                capture.write([(ts, direction, row[1], data)])
+            else:
+                logger.warn(f"Skipping unknown datalog row {row[:2]}")
+                continue
+            n += 1
+            ts += interval
+    capture.flush()
+    return n
+
+
+def parseTime(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="BeSIM binary datalog captures")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    conv = sub.add_parser("convert", help="Convert a CSV datalog to a capture")
+    conv.add_argument("csv")
+    conv.add_argument("capture")
+    conv.add_argument("--start", type=parseTime, default=None)
+    conv.add_argument("--interval", type=float, default=0.0)
+
+    dump = sub.add_parser("dump", help="Print the records of a capture")
+    dump.add_argument("capture")
+    dump.add_argument("--from", dest="start", type=parseTime, default=None)
+    dump.add_argument("--to", dest="end", type=parseTime, default=None)
+
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "convert":
+        capture = CaptureFile(args.capture)
+        n = convertCsv(args.csv, capture, args.start, args.interval)
+        capture.close()
+        print(f"{n} records written to {args.capture}")
+    else:
+        out = io.TextIOWrapper(sys.stdout.buffer, newline="")
+        writer = csv.writer(out)
+        for record in readCapture(args.capture, args.start, args.end):
+            writer.writerow(
+                [
+                    datetime.fromtimestamp(record.time).isoformat(),
+                    record.direction,
+                    record.peer,
+                    record.data.hex().upper(),
+                ]
+            )
+        out.flush()
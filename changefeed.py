@@ -0,0 +1,104 @@
+#
+# Change feed of the device and room states
+#
+# Every publish of a device or room (see status.py) appends the fields that
+# changed, with the store version it got, to a bounded log. Clients read it
+# from a cursor: changes after `since`, optionally of a device and some
+# fields only, waiting for the next ones if there are none yet (long-poll,
+# server-sent events). A cursor older than the log gets reset=True: the
+# client missed changes and must reload the state first, as it does when it
+# starts (since=0 gives reset=False only if nothing was dropped yet).
+#
+import threading
+import time
+from collections import deque
+from typing import Any, Iterable, NamedTuple
+
+FEED_SIZE = 4096  # changes kept
+
+
+class Change(NamedTuple):
+    version: int
+    deviceid: Any
+    room: Any  # None for the device itself
+    values: dict[str, Any]
+
+    def asdict(self, fields: Iterable[str] | None = None) -> dict[str, Any]:
+        values = self.values
+        if fields is not None:
+            values = {k: v for k, v in values.items() if k in fields}
+        return {
+            "version": self.version,
+            "deviceid": self.deviceid,
+            "room": self.room,
+            "values": values,
+        }
+
+
+class ChangeFeed:
+    def __init__(self, size: int = FEED_SIZE) -> None:
+        self.changes: deque[Change] = deque(maxlen=size)
+        self.cond = threading.Condition()
+        self.version = 0  # of the last change
+        self.dropped = 0  # version of the last change pushed out of the log
+
+    def append(self, version: int, deviceid, room, values: dict[str, Any]) -> None:
+        with self.cond:
+            if len(self.changes) == self.changes.maxlen:
+                self.dropped = self.changes[0].version
+            self.changes.append(Change(version, deviceid, room, values))
+            self.version = version
+            self.cond.notify_all()
+
+    def since(
+        self, since: int, deviceid=None, fields: Iterable[str] | None = None
+    ) -> tuple[list[dict[str, Any]], int, bool]:
+        # (changes after since, version to resume from, reset)
+        fields = set(fields) if fields else None
+        with self.cond:
+            # a cursor ahead of the log is from before a restart
+            reset = since < self.dropped or since > self.version
+            version = self.version
+            # newest first, stop at the cursor
+            matched = []
+            for change in reversed(self.changes):
+                if change.version <= since:
+                    break
+                if deviceid is not None and change.deviceid != deviceid:
+                    continue
+                if fields is not None and fields.isdisjoint(change.values):
+                    continue
+                matched.append(change)
+        return [c.asdict(fields) for c in reversed(matched)], version, reset
+
+    def wait(
+        self,
+        since: int,
+        timeout: float,
+        deviceid=None,
+        fields: Iterable[str] | None = None,
+    ) -> tuple[list[dict[str, Any]], int, bool]:
+        # since(), blocking up to timeout seconds for a matching change
+        deadline = time.monotonic() + timeout
+        changes, version, reset = self.since(since, deviceid, fields)
+        while not changes and not reset:
+            with self.cond:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if self.version == version:
+                    self.cond.wait(remaining)
+            # unmatched changes move the cursor too
+            changes, version, reset = self.since(version, deviceid, fields)
+        return changes, version, reset
+
+    def getStats(self) -> dict[str, int]:
+        with self.cond:
+            return {
+                "version": self.version,
+                "size": len(self.changes),
+                "oldest": self.changes[0].version if self.changes else 0,
+            }
+
+
+feed = ChangeFeed()
@@ -0,0 +1,590 @@
+#
+# Message definitions of the BeSMART UDP protocol
+#
+# Every message payload (the contents of the Wrapper, see udpserver.py) is
+# described once by a Schema: a precompiled struct.Struct plus the typed record
+# it decodes to. The same schema is used to decode received messages and to
+# encode the ones we send, UPLINK and DOWNLINK are the registries keyed by MsgId.
+#
+import struct
+from enum import IntEnum
+from typing import Any, Callable, Iterable, NamedTuple
+
+
+class HeatingMode(IntEnum):
+    AUTO = 0
+    MANUAL = 1
+    HOLIDAY = 2
+    PARTY = 3
+    OFF = 4
+    DHW = 5
+
+
+#
+# Note:
+#    Downlink (DL) is from cloud server to Besmart device.
+#    Uplink (UL) is from Besmart device to cloud server.
+#
+
+
+class MsgId(IntEnum):
+    #
+    # Set the thermostat mode: auto/holiday/party/off etc.
+    # DL initiated
+    #
+    SET_MODE = 0x02
+
+    # 0x03    Unknown (from test probe: deviceid) (invalid)
+    # 0x04    Unknown (from test probe: deviceid) (invalid)
+    # 0x05    Unknown (from test probe: deviceid) (invalid)
+    # 0x06    Unknown (from test probe: deviceid) (invalid)
+    # 0x07    Unknown (from test probe: deviceid) (invalid)
+    # 0x08    Unknown (from test probe: deviceid) (invalid)
+    # 0x09    Unknown (from test probe: deviceid) (invalid)
+
+    #
+    # The thermostat daily program (one message per day)
+    # UL/DL initiated
+    #
+    PROGRAM = 0x0A
+
+    #
+    # Set the T1/T2/T3 temperatures
+    # Values in degC * 10
+    # DL initiated
+    #
+    SET_T3 = 0x0B
+    SET_T2 = 0x0C
+    SET_T1 = 0x0D
+
+    # 0x0e    Unknown (from test probe: deviceid, roomid) (invalid)
+    # 0x0f    Unknown (from test probe: deviceid, long message with lots of 0x0
+    #   followed by lots of 0xff) Could this be OpenTherm parameters?
+    # 0x10    Unknown (from test probe: deviceid) (invalid)
+    # 0x11    Unknown (from test probe: deviceid,byte=0xff)
+
+    #
+    # Enable/Disable advance on the thermostat
+    # 1 = Advance
+    # DL initiated
+    #
+    SET_ADVANCE = 0x12
+
+    # 0x13    Unknown (from test probe: deviceid) (invalid)
+    # 0x14    Unknown (from test probe: deviceid, 4 bytes = 0x0)
+
+    #
+    # Get the device software version
+    # UL/DL initiated
+    #
+    SWVERSION = 0x15
+
+    #
+    # Set the Temperature Curve (OpenTherm only)
+    # Values in degC * 10
+    # DL initiated
+    #
+    SET_CURVE = 0x16
+
+    #
+    # Set the thermostat min/max heating setpoints (OpenTherm only)
+    # Values in degC * 10
+    # DL initiated
+    #
+    SET_MIN_HEAT_SETP = 0x17
+    SET_MAX_HEAT_SETP = 0x18
+
+    #
+    # Set the units degC/degF
+    # 0 = degC 1 = degF
+    # DL initiated
+    #
+    SET_UNITS = 0x19
+
+    #
+    # Set the season heating/cooling
+    # 1 = Winter
+    # DL initiated
+    #
+    SET_SEASON = 0x1A
+
+    #
+    # Set the sensor influence (OpenTherm only)
+    # Values in degC
+    # DL initiated
+    #
+    SET_SENSOR_INFLUENCE = 0x1B
+
+    # 0x1c    Unknown (from test probe: deviceid, roomid, byte=85)
+
+    #
+    # No idea what this message is!!
+    # DL initiated
+    #
+    REFRESH = 0x1D
+
+    # 0x1e    Unknown (from test probe: deviceid) (invalid)
+    # 0x1f    Unknown (from test probe: deviceid) (invalid)
+
+    #
+    # Where to obtain the outside temperature: web/boiler/none (OpenTherm only)
+    # 0 = none, 1 = boiler, 2 = web
+    # DL initiated
+    #
+    OUTSIDE_TEMP = 0x20
+
+    # 0x21    Unknown (from test probe: deviceid) (invalid)
+
+    #
+    # No idea what this message is!!!
+    # UL initiated
+    #
+    PING = 0x22
+
+    # 0x23    Unknown (from test probe: deviceid) (invalid)
+
+    #
+    # Periodic (every 40s) status from the device
+    # UL initiated
+    #
+    STATUS = 0x24
+
+    # 0x25    Unknown (from test probe: deviceid, byte=0x1)
+    # 0x26    Unknown (from test probe: deviceid) (invalid)
+    # 0x27    Unknown (from test probe: deviceid) (invalid)
+    # 0x28    Unknown (from test probe: deviceid) (invalid)
+
+    #
+    # Set the time on the device
+    # Looks like it only sets daylight savings time.
+    # No idea how the device gets the actual time.
+    # 1 = DST
+    # DL initiated
+    #
+    DEVICE_TIME = 0x29
+
+    #
+    # No idea what this message is!!!
+    # Sent by the device after it has sent all the daily programs
+    # UL initiated
+    #
+    PROG_END = 0x2A
+
+    #
+    # Not sure what this message is!!!
+    # But it triggers the device to send all the daily programs for the specified thermostat
+    # DL initiated
+    #
+    GET_PROG = 0x2B
+
+    # 0x2c    Unknown (from test probe: deviceid, short=0x1c2)
+    # 0x2d    Unknown (from test probe: deviceid) (invalid)
+    # 0x2e    Unknown (from test probe: deviceid) (invalid)
+    # 0x30    Unknown (from test probe: deviceid) (invalid)
+
+    #
+    #  Fake ID for unknown ids
+    #
+    UNKNOWN_ID = 0xFF
+
+    @classmethod
+    def _missing_(cls, number):
+        return cls(cls.UNKNOWN_ID)
+
+
+#
+# Typed records
+#
+# All messages start with the same header:
+#   cseq      control plane sequence number (see NextCSeq)
+#   unk1      0x0 in DL, 0x2 in UL (flags on SET_* messages)
+#   unk2      0x0 in DL, 0x1/0x4 in UL
+#   deviceid  id of the wifi box
+#
+
+
+class HeaderMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+
+
+class PingMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    unk3: int
+
+
+class GetProgMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    room: int
+    unk3: int
+
+
+class ProgEndMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    room: int
+    unk3: int
+
+
+class ProgramMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    room: int
+    day: int
+    prog: tuple[int, ...]
+
+
+class SwVersionMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    version: bytes
+
+
+class OutsideTempMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    val: int
+
+
+class DeviceTimeMsg(NamedTuple):
+    # UL: only val looks meaningful (0 = no dst 1 = dst ?), the rest appears to be garbage
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    val: int
+    unk3: int
+    unk4: int
+    unk5: int
+
+
+class DeviceTimeDLMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    val: int
+    unk4: int
+
+
+class StatusReplyMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    lastseen: int
+
+
+class SetMsg(NamedTuple):
+    cseq: int
+    flags: int
+    unk2: int
+    deviceid: int
+    room: int
+    value: int
+
+
+class RoomRecord(NamedTuple):
+    room: int
+    byte1: int
+    byte2: int
+    temp: int
+    settemp: int
+    t3: int
+    t2: int
+    t1: int
+    maxsetp: int
+    minsetp: int
+    byte3: int
+    byte4: int
+    unk13: int
+    tempcurve: int
+    heatingsetp: int
+
+    @property
+    def connected(self) -> bool:
+        # Assume that if room is zero, 0xffffffff or byte1 is zero, then no thermostat is connected for that room
+        return self.room != 0 and self.room != 0xFFFFFFFF and self.byte1 != 0
+
+    @property
+    def heating(self) -> int | None:
+        if self.byte1 == 0x8F:
+            return 1
+        elif self.byte1 == 0x83:
+            return 0
+        return None
+
+    @property
+    def mode(self) -> int:
+        return self.byte2 >> 4
+
+    @property
+    def unk9(self) -> int:
+        return self.byte2 & 0xF
+
+    @property
+    def sensorinfluence(self) -> int:
+        return (self.byte3 >> 3) & 0xF
+
+    @property
+    def units(self) -> int:
+        return (self.byte3 >> 2) & 0x1
+
+    @property
+    def advance(self) -> int:
+        return (self.byte3 >> 1) & 0x1
+
+    @property
+    def boost(self) -> int:
+        return (self.byte4 >> 2) & 0x1
+
+    @property
+    def cmdissued(self) -> int:
+        return (self.byte4 >> 1) & 0x1
+
+    @property
+    def winter(self) -> int:
+        return self.byte4 & 0x1
+
+
+class StatusMsg(NamedTuple):
+    cseq: int
+    unk1: int
+    unk2: int
+    deviceid: int
+    rooms: tuple[RoomRecord, ...]
+    # OpenTherm parameters
+    otFlags1: int
+    otFlags2: int
+    ot: tuple[int, ...]  # otUnk1, otUnk2, tFLO, otUnk4, tdH, tESt, otUnk7..otUnk10
+    # Other params
+    wifisignal: int
+    unk16: int
+    unk17: int
+    unk18: int
+    unk19: int
+    unk20: int
+
+    @property
+    def boilerHeating(self) -> int:
+        return (self.otFlags1 >> 5) & 0x1
+
+    @property
+    def dhwMode(self) -> int:
+        return (self.otFlags1 >> 6) & 0x1
+
+    @property
+    def tFLO(self) -> int:
+        return self.ot[2]
+
+    @property
+    def tdH(self) -> int:
+        return self.ot[4]
+
+    @property
+    def tESt(self) -> int:
+        return self.ot[5]
+
+
+#
+# Schemas
+#
+
+
+class Schema:
+    __slots__ = ("msgId", "struct", "size", "record", "make", "flatten")
+
+    def __init__(
+        self,
+        msgId: int,
+        fmt: str,
+        record: Any,
+        make: Callable[[tuple], Any] | None = None,
+        flatten: Callable[[Any], Iterable] | None = None,
+    ) -> None:
+        self.msgId = msgId
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+        self.record = record
+        # make/flatten map the flat struct tuple to/from records with nested fields
+        self.make = make if make is not None else record._make
+        self.flatten = flatten
+
+    def decode(self, buffer, offset=0):
+        return self.make(self.struct.unpack_from(buffer, offset))
+
+    def encode(self, msg) -> bytes:
+        return self.struct.pack(*(self.flatten(msg) if self.flatten else msg))
+
+    def __repr__(self) -> str:
+        return f"Schema({MsgId(self.msgId).name}, {self.struct.format!r}, {self.record.__name__})"
+
+
+class SchemaTable:
+    def __init__(self, *schemas: Schema) -> None:
+        self.schemas: dict[int, tuple[Schema, ...]] = {}
+        for schema in schemas:
+            self.schemas[schema.msgId] = self.schemas.get(schema.msgId, ()) + (schema,)
+
+    def get(self, msgId, length: int | None = None) -> Schema | None:
+        # With length, only returns the variant with exactly that payload size
+        variants = self.schemas.get(msgId)
+        if variants is None:
+            return None
+        if length is None:
+            return variants[0]
+        for schema in variants:
+            if schema.size == length:
+                return schema
+        return None
+
+    def __contains__(self, msgId) -> bool:
+        return msgId in self.schemas
+
+
+HEADER = "<BBHI"
+ROOM = "IBBhhhhhhhBBHBB"
+ROOM_FIELDS = len(RoomRecord._fields)
+MAX_ROOMS = 8
+
+
+def _makeProgram(values: tuple) -> ProgramMsg:
+    return ProgramMsg(*values[:6], values[6:])
+
+
+def _flattenProgram(msg: ProgramMsg) -> tuple:
+    return (*msg[:6], *msg.prog)
+
+
+_ROOM_SLICES = tuple(
+    slice(i, i + ROOM_FIELDS)
+    for i in range(4, 4 + MAX_ROOMS * ROOM_FIELDS, ROOM_FIELDS)
+)
+_STATUS_END = 4 + MAX_ROOMS * ROOM_FIELDS
+_new = tuple.__new__  # NamedTuple without the argument checks of _make()
+
+
+def _makeStatus(values: tuple) -> StatusMsg:
+    end = _STATUS_END
+    return _new(
+        StatusMsg,
+        (
+            *values[:4],
+            tuple([_new(RoomRecord, values[s]) for s in _ROOM_SLICES]),
+            values[end],
+            values[end + 1],
+            values[end + 2 : end + 12],
+            *values[end + 12 :],
+        ),
+    )
+
+
+def _flattenStatus(msg: StatusMsg) -> tuple:
+    return (
+        *msg[:4],
+        *(v for room in msg.rooms for v in room),
+        msg.otFlags1,
+        msg.otFlags2,
+        *msg.ot,
+        *msg[8:],
+    )
+
+
+# Size of the value of the generic MsgId.SET_* messages
+SET_PAYLOAD_SIZE = {
+    MsgId.SET_T3: 2,
+    MsgId.SET_T2: 2,
+    MsgId.SET_T1: 2,
+    MsgId.SET_MIN_HEAT_SETP: 2,
+    MsgId.SET_MAX_HEAT_SETP: 2,
+    MsgId.SET_UNITS: 1,
+    MsgId.SET_SEASON: 1,
+    MsgId.SET_SENSOR_INFLUENCE: 1,
+    MsgId.SET_CURVE: 1,
+    MsgId.SET_ADVANCE: 1,
+    MsgId.SET_MODE: 1,
+}
+
+SET_VALUE_FORMAT = {1: "B", 2: "H", 4: "I"}
+
+
+def setSchema(msgId, numBytes: int) -> Schema:
+    # @todo can any of the MsgId.SET_* values be negative?
+    if numBytes not in SET_VALUE_FORMAT:
+        raise ValueError("InternalError")
+    return Schema(msgId, f"{HEADER}I{SET_VALUE_FORMAT[numBytes]}", SetMsg)
+
+
+_SET_SCHEMAS = [setSchema(msgId, size) for msgId, size in SET_PAYLOAD_SIZE.items()]
+
+#
+# Uplink (from the device)
+#
+UPLINK = SchemaTable(
+    Schema(
+        MsgId.STATUS,
+        f"{HEADER}{ROOM * MAX_ROOMS}BB10hBBHHHH",
+        StatusMsg,
+        _makeStatus,
+        _flattenStatus,
+    ),
+    Schema(MsgId.GET_PROG, f"{HEADER}II", GetProgMsg),
+    Schema(MsgId.PING, f"{HEADER}H", PingMsg),
+    Schema(MsgId.REFRESH, HEADER, HeaderMsg),
+    Schema(MsgId.DEVICE_TIME, f"{HEADER}BBHI", DeviceTimeMsg),
+    Schema(MsgId.OUTSIDE_TEMP, f"{HEADER}B", OutsideTempMsg),
+    Schema(MsgId.PROG_END, f"{HEADER}IH", ProgEndMsg),
+    Schema(MsgId.SWVERSION, f"{HEADER}13s", SwVersionMsg),
+    Schema(MsgId.PROGRAM, f"{HEADER}IH24B", ProgramMsg, _makeProgram, _flattenProgram),
+    *_SET_SCHEMAS,
+)
+
+#
+# Downlink (to the device, also what the cloud sends when proxying)
+#
+DOWNLINK = SchemaTable(
+    Schema(MsgId.STATUS, f"{HEADER}I", StatusReplyMsg),
+    Schema(MsgId.GET_PROG, f"{HEADER}II", GetProgMsg),
+    Schema(MsgId.PING, f"{HEADER}H", PingMsg),
+    Schema(MsgId.REFRESH, HEADER, HeaderMsg),
+    Schema(MsgId.DEVICE_TIME, f"{HEADER}II", DeviceTimeDLMsg),
+    Schema(MsgId.DEVICE_TIME, HEADER, HeaderMsg),  # read request from the cloud
+    Schema(MsgId.OUTSIDE_TEMP, f"{HEADER}B", OutsideTempMsg),
+    Schema(MsgId.PROG_END, f"{HEADER}IH", ProgEndMsg),
+    Schema(MsgId.SWVERSION, HEADER, HeaderMsg),
+    Schema(MsgId.PROGRAM, f"{HEADER}IH24B", ProgramMsg, _makeProgram, _flattenProgram),
+    *_SET_SCHEMAS,
+)
+
+# Header only, to peek at messages without a known schema
+HEADER_SCHEMA = Schema(MsgId.UNKNOWN_ID, HEADER, HeaderMsg)
+
+# Downlink messages decoded by ProxyUdpServer.handleCloudMsg(), any other is logged as unknown
+CLOUD_HANDLED = frozenset(
+    {
+        MsgId.STATUS,
+        MsgId.DEVICE_TIME,
+        MsgId.GET_PROG,
+        MsgId.REFRESH,
+        MsgId.SWVERSION,
+        MsgId.PROGRAM,
+        MsgId.PROG_END,
+        MsgId.PING,
+    }
+)
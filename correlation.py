@@ -0,0 +1,249 @@
+#
+# Control plane sequence numbers (cseq) correlation
+#
+# Every device has a CSeqTable: downlinks waiting for an answer get a cseq and
+# a Future, the answer received by the UDP thread resolves the Future of its
+# cseq. Allocation and resolution are atomic (REST request threads, the
+# downlink workers and the UDP thread all use the table). Waits time out on
+# the shared timer wheel, which resolves the Future with None and frees the
+# cseq; an answer coming after that is counted as late.
+#
+# Timeouts adapt to the device: the round trip times of the answers feed an
+# RFC 6298 estimator (smoothed RTT and variance, samples of retransmitted
+# requests ignored) and a request waits for RTO = SRTT + 4 * RTTVAR before
+# being sent again with the same cseq, at most `retries` times with the
+# timeout doubled every time. Until the first answer the first attempt gets
+# its share of the caller's wait. All the attempts together never take more
+# than the caller's wait.
+#
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any
+
+from timerwheel import Timer, TimerWheel, wheel
+
+logger = logging.getLogger(__name__)
+
+UNUSED_CSEQ = 0xFF
+MAX_CSEQ = 0xFD
+
+RETRIES = 3  # retransmissions of a request before giving up
+MIN_RTO = 0.2  # seconds
+MAX_RTO = 2.0  # seconds, unless the caller asked for a longer wait
+
+
+class RttEstimator:
+    __slots__ = ("srtt", "rttvar", "samples")
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self) -> None:
+        self.srtt = 0.0
+        self.rttvar = 0.0
+        self.samples = 0
+
+    def update(self, rtt: float) -> None:
+        if self.samples == 0:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.samples += 1
+
+    def rto(self, default: float) -> float:
+        if self.samples == 0:
+            return default
+        return min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+
+class Pending:
+    __slots__ = (
+        "future",
+        "timer",
+        "timeout",
+        "limit",
+        "sent",
+        "deadline",
+        "retransmits",
+        "resend",
+    )
+
+    def __init__(self, timeout: float, limit: float) -> None:
+        self.future: Future = Future()
+        self.timer: Timer | None = None
+        self.timeout = timeout  # of the current attempt
+        self.limit = limit  # the caller's wait, of all the attempts together
+        self.sent = time.monotonic()
+        self.deadline = self.sent + limit  # no retransmission after that
+        self.retransmits = 0
+        self.resend: tuple | None = None  # (fn, args) sending the request again
+
+
+class CSeqTable:
+    def __init__(self, wheel: TimerWheel = wheel, retries: int = RETRIES) -> None:
+        self.wheel = wheel
+        self.retries = retries
+        self.rtt = RttEstimator()
+        self.lock = threading.Lock()
+        self.next = 0
+        self.last = MAX_CSEQ
+        self.pending: dict[int, Pending] = {}
+        self.done: dict[int, Pending] = {}  # resolved, wait() not called yet
+        self.expired: set[int] = set()  # timed out, an answer may still come
+
+        self.completed = 0
+        self.timedOut = 0
+        self.late = 0
+        self.unmatched = 0
+        self.retransmits = 0
+
+    def allocate(self, wait: float = 0) -> int:
+        evicted = None
+        with self.lock:
+            cseq = self.next
+            # Skip the cseqs still waiting for their answer
+            for _ in range(MAX_CSEQ + 1):
+                if cseq not in self.pending:
+                    break
+                cseq = 0 if cseq >= MAX_CSEQ else cseq + 1
+            else:
+                # All of them are: the oldest one is given up
+                evicted = self.pending[cseq]
+                self._drop(cseq)
+            self.next = 0 if cseq >= MAX_CSEQ else cseq + 1
+            self.last = cseq
+            self.done.pop(cseq, None)
+            self.expired.discard(cseq)
+            if wait:
+                timeout = min(self.rtt.rto(wait / (self.retries + 1)), wait)
+                pending = self.pending[cseq] = Pending(timeout, wait)
+                pending.timer = self.wheel.schedule(
+                    timeout, self._timeout, cseq, pending
+                )
+        if evicted is not None:
+            evicted.timer.cancel()  # type: ignore
+            evicted.future.set_result(None)
+        return cseq
+
+    def _drop(self, cseq: int) -> None:
+        # Called with the lock held
+        self.done[cseq] = self.pending.pop(cseq)
+        self.expired.add(cseq)
+        self.timedOut += 1
+
+    def setResend(self, cseq: int, fn, *args) -> None:
+        # fn(*args) sends the request of cseq again on timeout
+        with self.lock:
+            pending = self.pending.get(cseq)
+            if pending is not None:
+                pending.resend = (fn, args)
+
+    def _timeout(self, cseq: int, pending: Pending) -> None:
+        # Timer wheel callback
+        with self.lock:
+            if self.pending.get(cseq) is not pending:
+                return  # answered meanwhile
+            resend = pending.resend
+            remaining = pending.deadline - time.monotonic()
+            if pending.retransmits >= self.retries or remaining < self.wheel.tick:
+                self._drop(cseq)
+                resend = None
+            elif resend is None:
+                # Nothing to send again, wait for the rest of the caller's wait
+                pending.timer = self.wheel.schedule(
+                    remaining, self._timeout, cseq, pending
+                )
+                return
+            else:
+                pending.retransmits += 1
+                self.retransmits += 1
+                pending.timeout = min(
+                    pending.timeout * 2, max(MAX_RTO, pending.timeout), remaining
+                )
+                pending.timer = self.wheel.schedule(
+                    pending.timeout, self._timeout, cseq, pending
+                )
+        if resend is None:
+            pending.future.set_result(None)
+            return
+        fn, args = resend
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception(f"Retransmission of {cseq=} failed")
+
+    def _get(self, cseq: int) -> Pending | None:
+        with self.lock:
+            return self.pending.get(cseq) or self.done.get(cseq)
+
+    def _collect(self, cseq: int, pending: Pending) -> None:
+        with self.lock:
+            if self.done.get(cseq) is pending:
+                del self.done[cseq]
+
+    def wait(self, cseq: int) -> Any:
+        # Answer of cseq, None if it timed out or nothing waits for it
+        pending = self._get(cseq)
+        if pending is None:
+            return None
+        try:
+            # The wheel resolves the future on time, the timeout is a safety net
+            return pending.future.result(pending.limit + 1.0)
+        except FutureTimeoutError:
+            return None
+        finally:
+            self._collect(cseq, pending)
+
+    def signal(self, cseq: int, val) -> bool:
+        with self.lock:
+            pending = self.pending.pop(cseq, None)
+            if pending is None:
+                if cseq in self.expired:
+                    self.expired.discard(cseq)
+                    self.late += 1
+                else:
+                    self.unmatched += 1
+                return False
+            self.done[cseq] = pending
+            self.completed += 1
+            if pending.retransmits == 0:
+                # Karn: the answer of a retransmitted request may be to any copy
+                self.rtt.update(time.monotonic() - pending.sent)
+        if pending.timer is not None:
+            pending.timer.cancel()
+        pending.future.set_result(val)
+        return True
+
+    def revision(self) -> tuple[int, ...]:
+        # Changes whenever asdict() does
+        return (
+            self.last,
+            len(self.pending),
+            self.completed,
+            self.timedOut,
+            self.late,
+            self.unmatched,
+            self.retransmits,
+            self.rtt.samples,
+        )
+
+    def asdict(self) -> dict[str, Any]:
+        return {
+            "last": self.last,
+            "in_flight": len(self.pending),
+            "completed": self.completed,
+            "timed_out": self.timedOut,
+            "late": self.late,
+            "unmatched": self.unmatched,
+            "retransmits": self.retransmits,
+            "srtt_ms": round(self.rtt.srtt * 1000.0, 3),
+            "rttvar_ms": round(self.rtt.rttvar * 1000.0, 3),
+            "rto_ms": round(self.rtt.rto(0) * 1000.0, 3),
+        }
+
+    def __repr__(self) -> str:
+        return f"CSeqTable({self.asdict()})"
@@ -1,12 +1,30 @@
 import logging
+import threading
 
 from numpy import byte
-from databaseConnection import DatabaseType, DatabaseConnection
+from databaseConnection import ConnectionPool, DatabaseType, DatabaseConnection
 from datetime import datetime, timezone, timedelta
 
 logger = logging.getLogger(__name__)
 
 
+# Pragmas of the new connections, see Database.configure(). "default" keeps
+# the SQLite defaults: rollback journal, readers and the writer serialized on
+# the database lock, a full fsync on every commit.
+PROFILES = {
+    "default": {},
+    "performance": {
+        "journal_mode": "WAL",  # readers don't block the writer
+        "synchronous": "NORMAL",  # fsync at checkpoints only in WAL mode
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16 * 1024,  # KiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,  # ms
+    },
+}
+SETTINGS = tuple(PROFILES["performance"])  # reported by get_settings()
+
+
 class Singleton(type):
     _instances = {}
 
@@ -23,6 +41,10 @@ class Database(metaclass=Singleton):
     def __init__(self, name: str = __name__, log=False) -> None:
         self.name: str = name
         self.log: bool = log
+        self.pragmas: dict = {}  # of the new connections
+        self.pools: dict[str, ConnectionPool] = {}  # by database name
+        self.poolsLock = threading.Lock()
+        self.opened = 0
 
     def create_tables(self, conn=None):
         if not conn:
@@ -40,6 +62,8 @@ class Database(metaclass=Singleton):
         conn.run_sql(sql, log=self.log)
         sql = "create table if not exists unknown_api(ts DATETIME, source TEXT, host TEXT, method TEXT, uri TEXT, headers TEXT, body BLOB, rm_resp_code TEXT, rm_res_body TEXT)"
         conn.run_sql(sql, log=self.log)
+        sql = "create table if not exists fakeboost(deviceid INTEGER, room INTEGER, deadline NUMERIC, primary key(deviceid, room))"
+        conn.run_sql(sql, log=self.log)
         if closeit:
             conn.close(commit=True)
 
@@ -76,6 +100,9 @@ class Database(metaclass=Singleton):
                     "Migration not yet implemented :(. Drop all database and restart!"
                 )
                 success = False
+            else:
+                # Tables added since, all "if not exists"
+                self.create_tables(conn=conn)
         else:
             logger.error("Failed to get database version")
             success = False
@@ -85,11 +112,52 @@ class Database(metaclass=Singleton):
 
         return success
 
+    def configure(self, profile="default", overrides=None):
+        # Pragmas of the connections opened from now on, a profile of
+        # PROFILES with some of its values overridden
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown database profile {profile}")
+        self.pragmas = {**PROFILES[profile], **(overrides or {})}
+        self.close_connections()
+
+    def get_settings(self, conn=None):
+        # Effective value of the tuning pragmas
+        if not conn:
+            conn = self.get_connection()
+            closeit = True
+        else:
+            closeit = False
+        rc = {}
+        for name in SETTINGS:
+            row = conn.fetchone(f"pragma {name}", log=self.log)
+            rc[name] = next(iter(row.values())) if row else None
+        if closeit:
+            conn.close(commit=True)
+        return rc
+
     def get_connection(self):
-        dbConnection = DatabaseConnection(DatabaseType.SQLITE3, self.name)
+        # An idle connection from the pool or a new one, close() gives it back
+        with self.poolsLock:
+            pool = self.pools.get(self.name)
+            if pool is None:
+                pool = self.pools[self.name] = ConnectionPool()
+        dbConnection = pool.get()
+        if dbConnection is None:
+            dbConnection = DatabaseConnection(
+                DatabaseType.SQLITE3, self.name, pragmas=self.pragmas, pool=pool
+            )
+            with self.poolsLock:
+                self.opened += 1
         dbConnection.connect()
         return dbConnection
 
+    def close_connections(self):
+        # Really close the idle connections, before removing the database file
+        with self.poolsLock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            pool.close()
+
     def log_outside_temperature(self, temp, conn=None):
         if not conn:
             conn = self.get_connection()
@@ -103,19 +171,31 @@ class Database(metaclass=Singleton):
         if closeit:
             conn.close(commit=True)
 
-    def log_temperature(self, thermostat, temp, settemp, heating, conn=None):
+    def log_temperature(self, thermostat, temp, settemp, heating, conn=None, ts=None):
         if not conn:
             conn = self.get_connection()
             closeit = True
         else:
             closeit = False
-        now = datetime.now(timezone.utc).astimezone().isoformat()
+        now = ts or datetime.now(timezone.utc).astimezone().isoformat()
         sql = "insert into besim_temperature(ts, thermostat, temp, settemp, heating) values (?,?,?,?,?)"
         values = (now, thermostat, temp, settemp, heating)
         conn.run_sql(sql, values, log=self.log)
         if closeit:
             conn.close(commit=True)
 
+    def log_temperatures(self, rows, conn=None, commit=True):
+        # rows of (ts, thermostat, temp, settemp, heating), one transaction
+        if not conn:
+            conn = self.get_connection()
+            closeit = True
+        else:
+            closeit = False
+        sql = "insert into besim_temperature(ts, thermostat, temp, settemp, heating) values (?,?,?,?,?)"
+        conn.executemany(sql, rows, log=self.log, commit=commit)
+        if closeit:
+            conn.close(commit=True)
+
     def log_traces(
         self,
         source: str,
@@ -217,6 +297,44 @@ class Database(metaclass=Singleton):
         if closeit:
             conn.close(commit=True)
 
+    def save_fakeboost(self, deviceid, room, deadline, conn=None):
+        if not conn:
+            conn = self.get_connection()
+            closeit = True
+        else:
+            closeit = False
+        sql = (
+            "insert or replace into fakeboost(deviceid, room, deadline) values (?,?,?)"
+        )
+        values = (deviceid, room, deadline)
+        conn.run_sql(sql, values, log=self.log)
+        if closeit:
+            conn.close(commit=True)
+
+    def delete_fakeboost(self, deviceid, room, conn=None):
+        if not conn:
+            conn = self.get_connection()
+            closeit = True
+        else:
+            closeit = False
+        sql = "delete from fakeboost where deviceid = ? and room = ?"
+        values = (deviceid, room)
+        conn.run_sql(sql, values, log=self.log)
+        if closeit:
+            conn.close(commit=True)
+
+    def get_fakeboosts(self, conn=None):
+        if not conn:
+            conn = self.get_connection()
+            closeit = True
+        else:
+            closeit = False
+        sql = "select deviceid,room,deadline from fakeboost"
+        rc = conn.run_sql(sql, log=self.log)
+        if closeit:
+            conn.close(commit=True)
+        return rc
+
     def get_outside_temperature(self, date_from=None, date_to=None, conn=None):
         if date_from is None:
             date_from = (
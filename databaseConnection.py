@@ -1,6 +1,7 @@
 import sqlite3
 import logging
 import contextlib
+import threading
 from enum import Enum
 
 from typing import List
@@ -8,31 +9,88 @@ from typing import Union
 
 logger = logging.getLogger(__name__)
 
+CACHED_STATEMENTS = 256  # prepared statements kept by each connection
+POOL_SIZE = 8  # idle connections kept for the whole process
+
 
 class DatabaseType(Enum):
     SQLITE3 = 1
     UNSET = 2
 
 
+class ConnectionPool:
+    # Idle connections shared by every thread (Flask starts a thread per
+    # request), a connection is handed out to one caller at a time
+    def __init__(self, size: int = POOL_SIZE) -> None:
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle: list["DatabaseConnection"] = []
+
+    def get(self) -> "DatabaseConnection | None":
+        with self.lock:
+            return self.idle.pop() if self.idle else None
+
+    def put(self, dbConnection: "DatabaseConnection") -> bool:
+        # False when the pool is full, the caller closes the connection
+        with self.lock:
+            if dbConnection in self.idle:
+                return True
+            if len(self.idle) >= self.size:
+                return False
+            self.idle.append(dbConnection)
+            return True
+
+    def close(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for dbConnection in idle:
+            dbConnection.pool = None
+            dbConnection.close()
+
+
 class DatabaseConnection:
     conn: sqlite3.Connection | None
 
-    def __init__(self, databaseType=None, databaseName=None) -> None:
+    def __init__(
+        self, databaseType=None, databaseName=None, pragmas=None, pool=None
+    ) -> None:
         self.databaseType = databaseType
         self.databaseName = databaseName
         self.conn = None
+        self.pragmas: dict = pragmas or {}  # applied once, when connecting
+        # close() goes back to the pool, pooled connections move between
+        # threads
+        self.pool: ConnectionPool | None = pool
 
     def connect(self):
         if self.databaseName is not None and self.conn is None:
-            self.conn = sqlite3.connect(
-                self.databaseName, autocommit=False
-            )  # PEP 249 compliant Python3.12+
+            conn = sqlite3.connect(
+                self.databaseName,
+                autocommit=True,
+                cached_statements=CACHED_STATEMENTS,
+                check_same_thread=self.pool is None,
+            )
+            # Some pragmas (journal_mode) can't be changed in a transaction
+            for name, value in self.pragmas.items():
+                conn.execute(f"pragma {name} = {value}")
+            conn.autocommit = False  # PEP 249 compliant Python3.12+
+            self.conn = conn
         return self.conn
 
     def close(self, commit=False):
-        if self.conn is not None:
-            self.conn.close()
-            self.conn = None
+        if self.conn is None:
+            return
+        if self.pool is not None:
+            # Pooled: end the transaction, keep the connection for the next
+            # caller
+            if commit:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+            if self.pool.put(self):
+                return
+        self.conn.close()
+        self.conn = None
 
     def getConn(self) -> sqlite3.Connection:
         if self.conn is None:
@@ -47,7 +105,8 @@ class DatabaseConnection:
         if self.getConn() is not None:
             self.getConn().rollback()
 
-    def run_sql(self, sql, values=None, log=False) -> List:
+    def run_sql(self, sql, values=None, log=False, commit=True) -> List:
+        # commit=False leaves the transaction open, the caller commits
         if values is None:
             values = ()
         if log:
@@ -64,13 +123,24 @@ class DatabaseConnection:
                 else:
                     cols = [x[0] for x in cursor.description]
                     result = [dict(zip(cols, row)) for row in cursor.fetchall()]
-            self.getConn().commit()
+            if commit:
+                self.getConn().commit()
             if log:
                 logger.info(result)
             return result
         else:
             return None
 
+    def executemany(self, sql, values, log=False, commit=True) -> None:
+        # One statement for every tuple of values, in the same transaction
+        if log:
+            logger.info(sql)
+        if self.getConn() is not None:
+            with contextlib.closing(self.getConn().cursor()) as cursor:
+                cursor.executemany(sql, values)
+            if commit:
+                self.getConn().commit()
+
     def fetchmany(self, sql, values=None, log=False) -> List:
         return self.run_sql(sql, values, log)
 
@@ -0,0 +1,140 @@
+#
+# Background writer for the UDP/TCP datalog files
+#
+# Records are queued by the receive/request threads and written by a single
+# thread in batches (group commit): the file is flushed after every batch and
+# fsync'ed when fsyncInterval seconds or fsyncBytes bytes have gone by since
+# the last one. The queue is bounded, when the disk can't keep up records are
+# dropped and counted instead of blocking the caller.
+#
+import logging
+import os
+import queue
+import threading
+import time
+import traceback
+from typing import IO, Any
+
+import hexdump
+
+logger = logging.getLogger(__name__)
+
+
+def formatRecord(record) -> str:
+    if isinstance(record, str):
+        return record
+    # (time, direction, addr, data) from record(), hexdump done here, off the hot path
+    _, direction, addr, data = record
+    return f'"{direction}","{addr}","{hexdump.dump(data, sep='')}"\r\n'
+
+
+class DatalogWriter(threading.Thread):
+    # Max records written between two checks of the fsync thresholds
+    BATCH = 512
+    # CSV lines, see capture.CaptureWriter for the binary format
+    binary = False
+
+    def __init__(
+        self,
+        file: IO[str],
+        maxQueue: int = 10000,
+        fsyncInterval: float = 1.0,
+        fsyncBytes: int = 64 * 1024,
+    ) -> None:
+        super().__init__(name="datalog-writer", daemon=True)
+        self.file = file
+        self.queue: queue.Queue = queue.Queue(maxsize=maxQueue)
+        self.fsyncInterval = fsyncInterval
+        self.fsyncBytes = fsyncBytes
+        self.stop = False
+        self.lock = threading.Lock()
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.pending = 0  # bytes written since the last fsync
+        self.lastFsync = time.monotonic()
+
+    def write(self, line: str) -> bool:
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def record(self, direction: str, addr, data) -> bool:
+        # data is copied: the caller may reuse its buffer
+        return self.write((time.time(), direction, addr, bytes(data)))  # type: ignore
+
+    def run(self) -> None:
+        while not self.stop or not self.queue.empty():
+            # Nothing to fsync: sleep until the next record (or close())
+            timeout = (
+                max(self.lastFsync + self.fsyncInterval - time.monotonic(), 0)
+                if self.pending
+                else None
+            )
+            try:
+                batch = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            try:
+                while len(batch) < self.BATCH:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self.commit(batch)
+            except Exception:
+                logger.error(traceback.format_exc())
+
+    def commit(self, batch: list) -> None:
+        records = [r for r in batch if r is not None]
+        if records:
+            self.pending += self.file.write(self.encode(records))  # type: ignore
+            self.file.flush()
+            self.written += len(records)
+            self.batches += 1
+        if self.pending and (
+            self.pending >= self.fsyncBytes
+            or time.monotonic() - self.lastFsync >= self.fsyncInterval
+        ):
+            os.fsync(self.file.fileno())
+            self.fsyncs += 1
+            self.pending = 0
+        if self.pending == 0:
+            self.lastFsync = time.monotonic()
+
+    def encode(self, records: list):
+        return "".join(map(formatRecord, records))
+
+    def close(self) -> None:
+        # Write everything still queued and fsync it
+        self.stop = True
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+        else:
+            self.commit(list(iter(self._getNowait, None)))
+        if self.pending:
+            os.fsync(self.file.fileno())
+            self.fsyncs += 1
+            self.pending = 0
+
+    def _getNowait(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def getStats(self) -> dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "fsyncs": self.fsyncs,
+        }
@@ -0,0 +1,109 @@
+#
+# Per-device ordered dispatch of received datagrams
+#
+# Every key (the deviceid of the message) owns a FIFO queue. A queue is served
+# by at most one worker of the pool at a time, so messages of the same device
+# are handled in order while different devices are handled in parallel.
+#
+import logging
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class QueueStats:
+    __slots__ = ("depth", "processed", "wait_last", "wait_total", "wait_max")
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.processed = 0
+        self.wait_last = 0.0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def asdict(self) -> dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "processed": self.processed,
+            "wait_last_ms": round(self.wait_last * 1000.0, 3),
+            "wait_avg_ms": (
+                round(self.wait_total * 1000.0 / self.processed, 3)
+                if self.processed
+                else 0.0
+            ),
+            "wait_max_ms": round(self.wait_max * 1000.0, 3),
+        }
+
+
+class DeviceDispatcher:
+    # Max messages handled for one key before giving the worker back to the pool
+    BATCH = 8
+
+    def __init__(
+        self,
+        handler: Callable[..., Any],
+        workers: int = 4,
+        name: str = "udp-worker",
+        initializer: Callable[[], None] | None = None,
+    ) -> None:
+        self.handler = handler
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=name, initializer=initializer
+        )
+        self.lock = threading.Lock()
+        self.queues: dict[Hashable, deque] = {}
+        self.stats: dict[Hashable, QueueStats] = {}
+
+    def dispatch(self, key: Hashable, *args) -> None:
+        with self.lock:
+            queue = self.queues.get(key)
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = QueueStats()
+            stats.depth += 1
+            if queue is not None:
+                # A worker is already serving this key, it will pick this up
+                queue.append((time.monotonic(), args))
+                return
+            self.queues[key] = deque([(time.monotonic(), args)])
+        self.executor.submit(self._drain, key)
+
+    def _drain(self, key: Hashable) -> None:
+        for _ in range(self.BATCH):
+            with self.lock:
+                queue = self.queues[key]
+                if not queue:
+                    del self.queues[key]
+                    return
+                queued, args = queue.popleft()
+                stats = self.stats[key]
+                stats.depth -= 1
+                wait = time.monotonic() - queued
+                stats.processed += 1
+                stats.wait_last = wait
+                stats.wait_total += wait
+                if wait > stats.wait_max:
+                    stats.wait_max = wait
+            try:
+                self.handler(*args)
+            except Exception:
+                logger.error(traceback.format_exc())
+        # Still work for this key: requeue behind the other devices
+        try:
+            self.executor.submit(self._drain, key)
+        except RuntimeError:
+            # Shutting down, finish the queue on this worker
+            self._drain(key)
+
+    def getStats(self) -> dict[str, dict[str, Any]]:
+        with self.lock:
+            return {str(key): stats.asdict() for key, stats in self.stats.items()}
+
+    def shutdown(self, wait=True) -> None:
+        self.executor.shutdown(wait=wait)
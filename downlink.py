@@ -0,0 +1,252 @@
+#
+# Per-device downlink command scheduler
+#
+# The embedded device cannot take many messages in a short time, so the
+# downlinks it didn't ask for (REST writes, GET_PROG refreshes, fake boost
+# expiry) are queued per device and paced: a command starts once the previous
+# command of the device has completed and at least gap seconds after it
+# started. Queues are ordered by priority (lower first) then by submission, so
+# user writes go ahead of the background GET_PROG refreshes. Commands run on a
+# worker pool and block their worker while they wait for the device answer;
+# as a device has at most one command running, the pool grows up to one
+# worker per device with a running command (workers=0, threads are only
+# started when none is idle), so a silent device only holds its own queue.
+# Callers get a concurrent.futures.Future with the command result.
+#
+# Replies to uplinks (response=1) are not scheduled, they are sent right away.
+#
+import heapq
+import itertools
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_USER = 0  # REST writes
+PRIORITY_TIMER = 5  # fake boost expiry
+PRIORITY_BACKGROUND = 10  # GET_PROG refreshes
+MAX_WORKERS = 256  # pool size limit with workers=0
+
+
+class Command:
+    __slots__ = (
+        "priority",
+        "order",
+        "name",
+        "tag",
+        "fn",
+        "args",
+        "kwargs",
+        "future",
+        "queued",
+    )
+
+    def __init__(self, priority, order, name, tag, fn, args, kwargs) -> None:
+        self.priority = priority
+        self.order = order
+        self.name = name
+        self.tag = tag
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.queued = time.monotonic()
+
+    def __lt__(self, other: "Command") -> bool:
+        return (self.priority, self.order) < (other.priority, other.order)
+
+    def asdict(self, now: float) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "priority": self.priority,
+            "age_ms": round((now - self.queued) * 1000.0, 3),
+        }
+
+
+class DeviceQueue:
+    __slots__ = (
+        "commands",
+        "running",
+        "scheduled",
+        "started",
+        "sent",
+        "failed",
+        "wait_max",
+    )
+
+    def __init__(self) -> None:
+        self.commands: list[Command] = []  # heap
+        self.running: Command | None = None
+        self.scheduled = False  # in the scheduler timer heap
+        self.started = float("-inf")  # last command start, monotonic
+        self.sent = 0
+        self.failed = 0
+        self.wait_max = 0.0
+
+
+class DownlinkScheduler(threading.Thread):
+    def __init__(self, gap: float = 1.0, workers: int = 0) -> None:
+        super().__init__(name="downlink-scheduler", daemon=True)
+        self.gap = gap
+        # 0: a worker per device with a running command
+        self.workers = workers or MAX_WORKERS
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="downlink"
+        )
+        self.cond = threading.Condition()
+        self.queues: dict[Hashable, DeviceQueue] = {}
+        self.timers: list[tuple[float, int, Hashable]] = []  # (due, order, key) heap
+        self.order = itertools.count()
+        self.stop = False
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(
+        self,
+        key: Hashable,
+        priority: int,
+        fn: Callable[..., Any],
+        *args,
+        name: str | None = None,
+        tag: Hashable | None = None,
+        replace: bool = False,
+        **kwargs,
+    ) -> Future:
+        # A command with the same tag still queued for the device is not
+        # queued again, its future is returned instead. With replace it runs
+        # fn(*args, **kwargs) of this call, the latest value wins.
+        with self.cond:
+            if self.stop:
+                raise RuntimeError("Downlink scheduler is shut down")
+            if self.ident is None:
+                self.start()
+            queue = self.queues.get(key)
+            if queue is None:
+                queue = self.queues[key] = DeviceQueue()
+            if tag is not None:
+                for command in queue.commands:
+                    if command.tag == tag:
+                        self.coalesced += 1
+                        if replace:
+                            command.fn, command.args = fn, args
+                            command.kwargs = kwargs
+                        if priority < command.priority:
+                            command.priority = priority
+                            heapq.heapify(queue.commands)
+                        return command.future
+            command = Command(
+                priority,
+                next(self.order),
+                name or getattr(fn, "__name__", repr(fn)),
+                tag,
+                fn,
+                args,
+                kwargs,
+            )
+            heapq.heappush(queue.commands, command)
+            self.submitted += 1
+            self._schedule(key, queue)
+            return command.future
+
+    def _schedule(self, key: Hashable, queue: DeviceQueue) -> None:
+        # Called with the lock held
+        if queue.running is None and not queue.scheduled and queue.commands:
+            queue.scheduled = True
+            due = queue.started + self.gap
+            heapq.heappush(self.timers, (due, next(self.order), key))
+            self.cond.notify()
+
+    def run(self) -> None:
+        with self.cond:
+            while not self.stop:
+                if not self.timers:
+                    self.cond.wait()
+                    continue
+                delay = self.timers[0][0] - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                _, _, key = heapq.heappop(self.timers)
+                queue = self.queues[key]
+                queue.scheduled = False
+                if not queue.commands:
+                    continue
+                command = heapq.heappop(queue.commands)
+                if not command.future.set_running_or_notify_cancel():
+                    self._schedule(key, queue)
+                    continue
+                queue.running = command
+                queue.started = time.monotonic()
+                wait = queue.started - command.queued
+                if wait > queue.wait_max:
+                    queue.wait_max = wait
+                try:
+                    self.executor.submit(self._execute, key, queue, command)
+                except RuntimeError as e:
+                    # Interpreter exiting
+                    command.future.set_exception(e)
+                    return
+
+    def _execute(self, key: Hashable, queue: DeviceQueue, command: Command) -> None:
+        try:
+            result = command.fn(*command.args, **command.kwargs)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            command.future.set_exception(e)
+            ok = False
+        else:
+            command.future.set_result(result)
+            ok = True
+        with self.cond:
+            queue.running = None
+            queue.sent += 1
+            if ok:
+                self.completed += 1
+            else:
+                queue.failed += 1
+                self.failed += 1
+            self._schedule(key, queue)
+
+    def getStats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        with self.cond:
+            devices = {
+                str(key): {
+                    "queued": [c.asdict(now) for c in sorted(queue.commands)],
+                    "running": (
+                        queue.running.asdict(now) if queue.running is not None else None
+                    ),
+                    "sent": queue.sent,
+                    "failed": queue.failed,
+                    "wait_max_ms": round(queue.wait_max * 1000.0, 3),
+                }
+                for key, queue in self.queues.items()
+            }
+            return {
+                "gap_s": self.gap,
+                "workers": self.workers,
+                "running": sum(q.running is not None for q in self.queues.values()),
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "completed": self.completed,
+                "failed": self.failed,
+                "devices": devices,
+            }
+
+    def shutdown(self, wait=True) -> None:
+        # Queued commands are cancelled, running ones complete
+        with self.cond:
+            self.stop = True
+            for queue in self.queues.values():
+                for command in queue.commands:
+                    command.future.cancel()
+                queue.commands.clear()
+            self.cond.notify()
+        self.executor.shutdown(wait=wait)
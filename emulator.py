@@ -0,0 +1,467 @@
+#
+# Simulated fleet of BeSMART wifi boxes for load tests
+#
+# Every box has its own UDP socket and 8 rooms. It sends a STATUS every
+# statusInterval seconds (divided by timeScale), answers the downlink
+# messages handled by UdpServer (PING, GET_PROG, PROGRAM, SET_*, DEVICE_TIME,
+# OUTSIDE_TEMP, REFRESH, SWVERSION) after a random delay, and loses
+# datagrams in both directions with the configured probability.
+#
+# The report has the STATUS round trip and throughput, the datagrams dropped
+# by the emulated network and the STATUS the server never answered, and,
+# with --rest-url, the round trip of REST PUTs that end up in send_SET.
+#
+# Usage:
+#   python emulator.py [--target 127.0.0.1:6199] [--devices N] [--duration S]
+#                      [--time-scale X] [--loss P] [--jitter MIN MAX]
+#                      [--rest-url http://127.0.0.1:80] [--set-interval S]
+#
+import argparse
+import asyncio
+import json
+import logging
+import random
+import resource
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from codec import (
+    DOWNLINK,
+    MAX_ROOMS,
+    UPLINK,
+    DeviceTimeMsg,
+    GetProgMsg,
+    HeaderMsg,
+    MsgId,
+    OutsideTempMsg,
+    PingMsg,
+    ProgEndMsg,
+    ProgramMsg,
+    RoomRecord,
+    SetMsg,
+    StatusMsg,
+    SwVersionMsg,
+)
+from replay import percentile
+from udpserver import SET_PARAMS, UNUSED_CSEQ, Frame, Wrapper
+
+logger = logging.getLogger(__name__)
+
+STATUS_INTERVAL = 40.0  # seconds, as the real boxes
+BASE_DEVICEID = 100000000
+
+
+def encodeUL(msgType, payload: bytes, response: int, write: int, seq: int) -> bytes:
+    # Wrapper flags as sent by the boxes: valid, write and response bits
+    flags = 0x4 | (write & 0x1) << 1 | (response & 0x1)
+    payload = struct.pack("<BBH", msgType, flags, len(payload) - 8) + payload
+    return bytes(Frame(payload=payload).encode(seq))
+
+
+class FleetStats:
+    def __init__(self) -> None:
+        self.statusSent = 0
+        self.statusAcked = 0
+        self.statusLost = 0  # not answered within the STATUS interval
+        self.statusRtt: list[float] = []
+        self.received: dict[str, int] = {}
+        self.sent = 0
+        self.droppedIn = 0  # emulated loss
+        self.droppedOut = 0
+        self.setRtt: list[float] = []
+        self.setFailed = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def asdict(self) -> dict[str, Any]:
+        def ms(values: list[float]) -> dict[str, float]:
+            values = sorted(values)
+            return {
+                f"p{p}_ms": round(percentile(values, p) * 1000.0, 2)
+                for p in (50, 90, 99)
+            } | {"max_ms": round(values[-1] * 1000.0, 2) if values else 0.0}
+
+        return {
+            "elapsed_s": round(self.elapsed, 1),
+            "status_sent": self.statusSent,
+            "status_acked": self.statusAcked,
+            "status_lost": self.statusLost,
+            "status_per_s": (
+                round(self.statusAcked / self.elapsed, 1) if self.elapsed else 0.0
+            ),
+            "status_rtt": ms(self.statusRtt),
+            "sent": self.sent,
+            "received": dict(sorted(self.received.items())),
+            "dropped_in": self.droppedIn,
+            "dropped_out": self.droppedOut,
+            "set_count": len(self.setRtt),
+            "set_failed": self.setFailed,
+            "set_rtt": ms(self.setRtt),
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+
+class EmulatedDevice(asyncio.DatagramProtocol):
+    def __init__(self, fleet: "Fleet", deviceid: int) -> None:
+        self.fleet = fleet
+        self.stats = fleet.stats
+        self.rng = fleet.rng
+        self.deviceid = deviceid
+        self.transport: asyncio.DatagramTransport | None = None
+        self.seq = 0
+        self.pending: list[float] = []  # send time of the unanswered STATUS
+        self.known = False  # the server answered a STATUS
+        self.rooms = [
+            {
+                "room": (deviceid % 100000) * 10 + n + 1,
+                "temp": self.rng.randint(160, 230),
+                "settemp": 200,
+                "t3": 210,
+                "t2": 190,
+                "t1": 160,
+                "maxsetp": 350,
+                "minsetp": 50,
+                "mode": 0,
+                "units": 0,
+                "winter": 1,
+                "advance": 0,
+                "sensorinfluence": 0,
+                "tempcurve": 15,
+                "days": {day: [0x11] * 24 for day in range(7)},
+            }
+            for n in range(MAX_ROOMS)
+        ]
+        self.roomsById = {room["room"]: room for room in self.rooms}
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def error_received(self, exc) -> None:
+        logger.debug(f"{self.deviceid}: {exc}")
+
+    def send(self, msgType, payload: bytes, response=0, write=0) -> None:
+        if self.transport is None or self.transport.is_closing():
+            return
+        if self.rng.random() < self.fleet.loss:
+            self.stats.droppedOut += 1
+            return
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        frame = encodeUL(msgType, payload, response, write, self.seq)
+        self.transport.sendto(frame, self.fleet.target)  # type: ignore
+        self.stats.sent += 1
+
+    def sendStatus(self) -> None:
+        rooms = tuple(
+            RoomRecord(
+                room=r["room"],
+                byte1=0x8F if r["temp"] < r["settemp"] else 0x83,
+                byte2=r["mode"] << 4,
+                temp=r["temp"],
+                settemp=r["settemp"],
+                t3=r["t3"],
+                t2=r["t2"],
+                t1=r["t1"],
+                maxsetp=r["maxsetp"],
+                minsetp=r["minsetp"],
+                byte3=(r["sensorinfluence"] & 0xF) << 3
+                | (r["units"] & 0x1) << 2
+                | (r["advance"] & 0x1) << 1,
+                byte4=r["winter"] & 0x1,
+                unk13=0,
+                tempcurve=r["tempcurve"],
+                heatingsetp=40,
+            )
+            for r in self.rooms
+        )
+        msg = StatusMsg(
+            cseq=UNUSED_CSEQ,
+            unk1=0x2,
+            unk2=0x4,
+            deviceid=self.deviceid,
+            rooms=rooms,
+            otFlags1=0x20,
+            otFlags2=0,
+            ot=(0, 0, 450, 0, 480, 120, 0, 0, 0, 0),
+            wifisignal=self.rng.randint(40, 90),
+            unk16=0,
+            unk17=0,
+            unk18=0,
+            unk19=0,
+            unk20=0,
+        )
+        self.pending.append(time.monotonic())
+        self.stats.statusSent += 1
+        self.send(MsgId.STATUS, UPLINK.get(MsgId.STATUS).encode(msg))  # type: ignore
+
+    def sendPing(self) -> None:
+        msg = PingMsg(UNUSED_CSEQ, 0x2, 0x4, self.deviceid, 1)
+        self.send(MsgId.PING, UPLINK.get(MsgId.PING).encode(msg))  # type: ignore
+
+    async def run(self, stop: asyncio.Event) -> None:
+        interval = self.fleet.statusInterval
+        # Spread the boxes over the interval
+        await asyncio.sleep(self.rng.uniform(0, interval))
+        self.sendPing()
+        while not stop.is_set():
+            now = time.monotonic()
+            while self.pending and now - self.pending[0] > interval:
+                self.pending.pop(0)
+                self.stats.statusLost += 1
+            self.sendStatus()
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if self.rng.random() < self.fleet.loss:
+            self.stats.droppedIn += 1
+            return
+        delay = self.rng.uniform(*self.fleet.jitter)
+        asyncio.get_running_loop().call_later(delay, self.handle, data)
+
+    def handle(self, data: bytes) -> None:
+        payload = Frame().decode(data)
+        if payload is None:
+            return
+        wrapper = Wrapper(from_cloud=True)
+        payload = wrapper.decodeUL(payload)
+        msgType = wrapper.msgType
+        name = MsgId(msgType).name
+        self.stats.received[name] = self.stats.received.get(name, 0) + 1
+        schema = DOWNLINK.get(msgType, len(payload))
+        if schema is None:
+            return
+        msg = schema.decode(payload)
+        handler = getattr(self, f"on_{name}", None)
+        if handler is None and msgType in SET_PARAMS:
+            handler = self.on_SET
+        if handler is not None:
+            handler(msgType, msg, wrapper)
+
+    def on_STATUS(self, msgType, msg, wrapper) -> None:
+        self.known = True
+        if self.pending:
+            self.stats.statusRtt.append(time.monotonic() - self.pending.pop(0))
+            self.stats.statusAcked += 1
+
+    def on_PING(self, msgType, msg, wrapper) -> None:
+        if not wrapper.response:
+            self.sendPing()
+
+    def on_GET_PROG(self, msgType, msg, wrapper) -> None:
+        reply = GetProgMsg(msg.cseq, 0x2, 0x1, self.deviceid, msg.room, 0x800FE0)
+        self.send(msgType, UPLINK.get(msgType).encode(reply), response=1)  # type: ignore
+        room = self.roomsById.get(msg.room)
+        if room is None:
+            return
+        for day, prog in room["days"].items():
+            program = ProgramMsg(
+                UNUSED_CSEQ, 0x2, 0x1, self.deviceid, msg.room, day, tuple(prog)
+            )
+            self.send(MsgId.PROGRAM, UPLINK.get(MsgId.PROGRAM).encode(program))  # type: ignore
+        end = ProgEndMsg(UNUSED_CSEQ, 0x2, 0x1, self.deviceid, msg.room, 0xA14)
+        self.send(MsgId.PROG_END, UPLINK.get(MsgId.PROG_END).encode(end))  # type: ignore
+
+    def on_PROGRAM(self, msgType, msg, wrapper) -> None:
+        room = self.roomsById.get(msg.room)
+        if room is not None and wrapper.write:
+            room["days"][msg.day] = list(msg.prog)
+        if not wrapper.response:
+            reply = msg._replace(unk1=0x2, unk2=0x1)
+            self.send(msgType, UPLINK.get(msgType).encode(reply), response=1)  # type: ignore
+
+    def on_SET(self, msgType, msg, wrapper) -> None:
+        room = self.roomsById.get(msg.room)
+        value = msg.value
+        if room is not None:
+            field = SET_PARAMS[msgType]
+            if wrapper.write:
+                room[field] = value
+            value = room[field]
+        if not wrapper.response:
+            reply = SetMsg(msg.cseq, 0x0, 0x1, self.deviceid, msg.room, value)
+            self.send(msgType, UPLINK.get(msgType).encode(reply), response=1, write=wrapper.write)  # type: ignore
+
+    def on_DEVICE_TIME(self, msgType, msg, wrapper) -> None:
+        val = getattr(msg, "val", 0)
+        reply = DeviceTimeMsg(msg.cseq, 0x2, 0x1, self.deviceid, val, 0, 0, 0)
+        self.send(msgType, UPLINK.get(msgType).encode(reply), response=1)  # type: ignore
+
+    def on_OUTSIDE_TEMP(self, msgType, msg, wrapper) -> None:
+        reply = OutsideTempMsg(msg.cseq, 0x2, 0x1, self.deviceid, msg.val)
+        self.send(msgType, UPLINK.get(msgType).encode(reply), response=1)  # type: ignore
+
+    def on_REFRESH(self, msgType, msg, wrapper) -> None:
+        reply = HeaderMsg(msg.cseq, 0x2, 0x1, self.deviceid)
+        self.send(msgType, UPLINK.get(msgType).encode(reply), response=1)  # type: ignore
+
+    def on_SWVERSION(self, msgType, msg, wrapper) -> None:
+        reply = SwVersionMsg(msg.cseq, 0x2, 0x1, self.deviceid, b"0654918011102")
+        self.send(msgType, UPLINK.get(msgType).encode(reply), response=1)  # type: ignore
+
+
+class Fleet:
+    def __init__(
+        self,
+        target: tuple[str, int],
+        devices: int,
+        statusInterval: float = STATUS_INTERVAL,
+        timeScale: float = 1.0,
+        loss: float = 0.0,
+        jitter: tuple[float, float] = (0.005, 0.05),
+        baseDeviceId: int = BASE_DEVICEID,
+        seed: int | None = None,
+    ) -> None:
+        self.target = target
+        self.count = devices
+        self.statusInterval = statusInterval / timeScale
+        self.loss = loss
+        self.jitter = jitter
+        self.baseDeviceId = baseDeviceId
+        self.rng = random.Random(seed)
+        self.stats = FleetStats()
+        self.devices: list[EmulatedDevice] = []
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        for n in range(self.count):
+            device = EmulatedDevice(self, self.baseDeviceId + n)
+            await loop.create_datagram_endpoint(
+                lambda: device, local_addr=("0.0.0.0", 0)
+            )
+            self.devices.append(device)
+
+    async def run(
+        self,
+        duration: float,
+        setter: Callable[[EmulatedDevice, dict], bool] | None = None,
+        setInterval: float = 1.0,
+    ) -> FleetStats:
+        # setter is called on a thread, every setInterval seconds, with a random
+        # device and room; it returns True if the SET was applied
+        if not self.devices:
+            await self.start()
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(device.run(stop)) for device in self.devices]
+        if setter is not None:
+            tasks.append(asyncio.create_task(self._sets(stop, setter, setInterval)))
+        self.stats.started = time.monotonic()
+        await asyncio.sleep(duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        self.stats.elapsed = time.monotonic() - self.stats.started
+        # Give the last STATUS their answer, what is still missing is lost
+        deadline = time.monotonic() + min(self.statusInterval, 1.0)
+        while any(d.pending for d in self.devices) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        self.stats.statusLost += sum(len(d.pending) for d in self.devices)
+        self.close()
+        return self.stats
+
+    async def _sets(self, stop: asyncio.Event, setter, setInterval: float) -> None:
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix="fleet-set") as pool:
+            pending = set()
+            while not stop.is_set():
+                # Only the boxes the server already knows about
+                known = [device for device in self.devices if device.known]
+                if known:
+                    device = self.rng.choice(known)
+                    room = self.rng.choice(device.rooms)
+                    pending.add(
+                        loop.run_in_executor(pool, self._timedSet, setter, device, room)
+                    )
+                pending = {f for f in pending if not f.done()}
+                try:
+                    await asyncio.wait_for(stop.wait(), setInterval)
+                except asyncio.TimeoutError:
+                    pass
+            if pending:
+                await asyncio.wait(pending)
+
+    def _timedSet(self, setter, device: EmulatedDevice, room: dict) -> None:
+        t = time.monotonic()
+        try:
+            ok = setter(device, room)
+        except Exception as e:
+            logger.debug(e)
+            ok = False
+        if ok:
+            self.stats.setRtt.append(time.monotonic() - t)
+        else:
+            self.stats.setFailed += 1
+
+    def close(self) -> None:
+        for device in self.devices:
+            if device.transport is not None:
+                device.transport.close()
+
+
+def restSetter(url: str) -> Callable[[EmulatedDevice, dict], bool]:
+    import requests
+
+    session = requests.Session()
+
+    def setter(device: EmulatedDevice, room: dict) -> bool:
+        value = 200 + device.rng.randint(0, 40)
+        r = session.put(
+            f"{url}/api/v1.0/devices/{device.deviceid}/rooms/{room['room']}/t3",
+            json=value,
+            timeout=30,
+        )
+        return r.status_code == 200
+
+    return setter
+
+
+def raiseFileLimit() -> None:
+    # One socket per box
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Simulated BeSMART device fleet")
+    ap.add_argument("--target", default="127.0.0.1:6199", help="UdpServer host:port")
+    ap.add_argument("--devices", type=int, default=100)
+    ap.add_argument("--duration", type=float, default=60.0, help="Seconds")
+    ap.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="Divides the 40 s STATUS interval",
+    )
+    ap.add_argument("--loss", type=float, default=0.0, help="Datagram loss 0..1")
+    ap.add_argument(
+        "--jitter",
+        type=float,
+        nargs=2,
+        default=[0.005, 0.05],
+        help="Reply delay range in seconds",
+    )
+    ap.add_argument("--base-deviceid", type=int, default=BASE_DEVICEID)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--rest-url", default=None, help="BeSIM REST API for SET RTT")
+    ap.add_argument("--set-interval", type=float, default=1.0, help="Seconds")
+    ap.add_argument("-l", "--log_level", default="WARNING")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    raiseFileLimit()
+    host, port = args.target.rsplit(":", 1)
+    fleet = Fleet(
+        (host, int(port)),
+        args.devices,
+        timeScale=args.time_scale,
+        loss=args.loss,
+        jitter=tuple(args.jitter),
+        baseDeviceId=args.base_deviceid,
+        seed=args.seed,
+    )
+    setter = restSetter(args.rest_url) if args.rest_url else None
+    stats = asyncio.run(fleet.run(args.duration, setter, args.set_interval))
+    print(json.dumps(stats.asdict(), indent=2))
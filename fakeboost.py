@@ -0,0 +1,104 @@
+#
+# Fake boost expiry
+#
+# A fake boost (see UdpServer.send_FAKE_BOOST) ends FAKEBOOST_DURATION
+# seconds after it started. Its deadline is armed once on the shared timer
+# wheel, which calls expire(deviceid, room) when it is due: one revert per
+# room, instead of a check on every STATUS of the room. Re-arming a room
+# replaces its timer.
+#
+# The deadlines are saved in the database, restore() re-arms them after a
+# restart (the overdue ones fire right away).
+#
+import logging
+import threading
+import time
+from typing import Any, Callable
+
+from database import Database
+from timerwheel import Timer, TimerWheel, wheel
+
+logger = logging.getLogger(__name__)
+
+
+class BoostTimers:
+    def __init__(
+        self,
+        expire: Callable[[Any, Any], Any],
+        db: Database | None = None,
+        wheel: TimerWheel = wheel,
+    ) -> None:
+        self.expire = expire  # runs on the wheel thread, must be quick
+        self.db = db  # None keeps the deadlines in memory only
+        self.wheel = wheel
+        self.lock = threading.Lock()
+        self.timers: dict[tuple, tuple[float, Timer]] = {}  # (deviceid, room)
+        self.fired = 0
+
+    def arm(self, deviceid, room, deadline: float, persist: bool = True) -> None:
+        # deadline is a time.time() timestamp
+        key = (deviceid, room)
+        with self.lock:
+            old = self.timers.get(key)
+            if old is not None:
+                old[1].cancel()
+            timer = self.wheel.schedule(
+                deadline - time.time(), self._fire, key, deadline
+            )
+            self.timers[key] = (deadline, timer)
+        if persist and self.db is not None:
+            self.db.save_fakeboost(deviceid, room, deadline)
+
+    def cancel(self, deviceid, room) -> bool:
+        # The boost is over, False if it had no timer
+        with self.lock:
+            old = self.timers.pop((deviceid, room), None)
+            if old is not None:
+                old[1].cancel()
+        if self.db is not None:
+            self.db.delete_fakeboost(deviceid, room)
+        return old is not None
+
+    def deadline(self, deviceid, room) -> float | None:
+        entry = self.timers.get((deviceid, room))
+        return entry[0] if entry is not None else None
+
+    def restore(self) -> int:
+        # Re-arm the saved deadlines, returns how many
+        if self.db is None:
+            return 0
+        rows = self.db.get_fakeboosts() or []
+        for row in rows:
+            self.arm(row["deviceid"], row["room"], row["deadline"], persist=False)
+        if rows:
+            logger.info(f"Restored {len(rows)} fake boost timers")
+        return len(rows)
+
+    def _fire(self, key: tuple, deadline: float) -> None:
+        with self.lock:
+            entry = self.timers.get(key)
+            # A timer replaced meanwhile is cancelled but may be due already
+            if entry is None or entry[0] != deadline:
+                return
+            del self.timers[key]
+            self.fired += 1
+        # The saved deadline goes once the revert is done, see cancel()
+        self.expire(*key)
+
+    def getStats(self) -> dict[str, Any]:
+        now = time.time()
+        with self.lock:
+            pending = [
+                {
+                    "deviceid": deviceid,
+                    "room": room,
+                    "deadline": deadline,
+                    "remaining": max(deadline - now, 0),
+                }
+                for (deviceid, room), (deadline, _) in self.timers.items()
+            ]
+        return {
+            "pending": sorted(pending, key=lambda t: t["deadline"]),
+            "fired": self.fired,
+            "wheel": self.wheel.getStats(),
+        }
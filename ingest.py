@@ -0,0 +1,75 @@
+#
+# Change detection for the temperature log
+#
+# Every STATUS reports the temperatures of every room, mostly unchanged. A
+# room is only logged when its temp or settemp moved by at least `deadband`
+# degC since the last logged row, when the heating state changed, or when
+# nothing was logged for `heartbeat` seconds (graphs stay continuous). When a
+# change comes after suppressed samples the last of them is logged too, so
+# graphs keep the step instead of a slope from the last logged row.
+#
+import time
+from datetime import datetime, timezone
+from typing import Hashable, NamedTuple
+
+DEADBAND = 0.2  # degC
+HEARTBEAT = 900.0  # seconds
+EPSILON = 1e-9  # temperatures are tenths of degC divided by 10.0
+
+
+class Sample(NamedTuple):
+    time: float
+    temp: float
+    settemp: float
+    heating: int
+
+    @property
+    def ts(self) -> str:
+        # Same format as Database.log_temperature
+        return datetime.fromtimestamp(self.time, timezone.utc).astimezone().isoformat()
+
+
+class TemperatureFilter:
+    def __init__(
+        self, deadband: float = DEADBAND, heartbeat: float = HEARTBEAT
+    ) -> None:
+        self.deadband = deadband  # 0 logs every sample
+        self.heartbeat = heartbeat
+        self.logged: dict[Hashable, Sample] = {}
+        self.skipped: dict[Hashable, Sample] = {}  # last sample not logged
+        self.rows = 0
+        self.suppressed = 0
+
+    def filter(
+        self, thermostat: Hashable, temp, settemp, heating, now: float | None = None
+    ) -> list[Sample]:
+        # Samples of thermostat to log, oldest first
+        sample = Sample(time.time() if now is None else now, temp, settemp, heating)
+        last = self.logged.get(thermostat)
+        changed = (
+            last is None
+            or self.deadband <= 0
+            or abs(temp - last.temp) >= self.deadband - EPSILON
+            or abs(settemp - last.settemp) >= self.deadband - EPSILON
+            or heating != last.heating
+        )
+        if not changed and sample.time - last.time < self.heartbeat:  # type: ignore
+            self.skipped[thermostat] = sample
+            self.suppressed += 1
+            return []
+        samples = [sample]
+        previous = self.skipped.pop(thermostat, None)
+        if changed and previous is not None:
+            samples.insert(0, previous)
+            self.suppressed -= 1
+        self.logged[thermostat] = sample
+        self.rows += len(samples)
+        return samples
+
+    def getStats(self) -> dict[str, float]:
+        return {
+            "deadband": self.deadband,
+            "heartbeat_s": self.heartbeat,
+            "rows": self.rows,
+            "suppressed": self.suppressed,
+        }
@@ -0,0 +1,461 @@
+#
+# MQTT bridge to Home Assistant
+#
+# Every room is a HA climate entity, announced with a retained discovery
+# config and a retained JSON state. The bridge follows the change feed (see
+# changefeed.py) on its own thread: the rooms changed within `window`
+# seconds are published once, and only when their HA state differs from the
+# last one published (lastseen alone, a new STATUS with the same values,
+# publishes nothing). handleMsg never waits for the broker: messages go to
+# an outbox, one per topic (a newer state replaces the queued one), bounded
+# to `maxQueue` topics, and are handed to the client while it is connected.
+# After a reconnect everything is published again.
+#
+# With a UdpServer the entities take commands: besim/<deviceid>/<room>/set/
+# temperature|mode|preset go straight to the downlink queue of the device
+# (send_SET, send_FAKE_BOOST). A command still queued for the same room and
+# field is replaced by the newer one (a dragged slider sends one SET), a
+# repeated value already on its way is dropped. The new value is published
+# right away; when the device acks it, it is written to the room state and
+# shown until the next STATUS, else the published state is rolled back. The
+# time from the MQTT message to the device ack goes to a latency histogram.
+#
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from urllib.parse import ParseResult
+
+from changefeed import ChangeFeed, feed
+from codec import HeatingMode, MsgId
+from downlink import PRIORITY_USER
+from status import getRoomStatus, getStatus
+
+logger = logging.getLogger(__name__)
+
+TOPIC_PREFIX = "besim"
+DISCOVERY_PREFIX = "homeassistant"
+COALESCE_WINDOW = 0.5  # seconds
+MAX_QUEUE = 1024  # topics waiting for the broker
+MISSING = object()
+IDLE_WAIT = 1.0  # seconds between outbox checks without changes
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # ms
+
+HA_MODES = {
+    HeatingMode.AUTO: "auto",
+    HeatingMode.MANUAL: "heat",
+    HeatingMode.HOLIDAY: "auto",
+    HeatingMode.PARTY: "auto",
+    HeatingMode.OFF: "off",
+    HeatingMode.DHW: "off",
+}
+MODE_COMMANDS = {
+    "auto": HeatingMode.AUTO,
+    "heat": HeatingMode.MANUAL,
+    "off": HeatingMode.OFF,
+}
+
+
+def entityState(room: dict[str, Any]) -> dict[str, Any] | None:
+    # HA climate state of a room snapshot, None until its first STATUS
+    if any(key not in room for key in ("temp", "settemp", "t1", "t2", "t3")):
+        return None
+    mode = room.get("mode")
+    if room.get("fakeboost"):
+        preset = "boost"
+    elif mode == HeatingMode.HOLIDAY:
+        preset = "away"
+    else:
+        preset = "none"
+    return {
+        "current_temperature": room["temp"] / 10.0,
+        "temperature": room["settemp"] / 10.0,
+        "mode": HA_MODES.get(mode, "auto"),
+        "action": "heating" if room.get("heating") else "idle",
+        "preset": preset,
+        "t1": room["t1"] / 10.0,
+        "t2": room["t2"] / 10.0,
+        "t3": room["t3"] / 10.0,
+        "heating_mode": mode,
+    }
+
+
+class LatencyHistogram:
+    # Cumulative counts of the samples <= each bucket, in ms
+    def __init__(self, buckets: tuple[int, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, ms: float) -> None:
+        with self.lock:
+            for n, bucket in enumerate(self.buckets):
+                if ms <= bucket:
+                    break
+            else:
+                n = len(self.buckets)
+            self.counts[n] += 1
+            self.count += 1
+            self.sum += ms
+
+    def asdict(self) -> dict[str, Any]:
+        with self.lock:
+            le: dict[str, int] = {}
+            total = 0
+            for bucket, count in zip((*self.buckets, "+Inf"), self.counts):
+                total += count
+                le[str(bucket)] = total
+            return {"count": self.count, "sum_ms": round(self.sum, 3), "le_ms": le}
+
+
+class MqttBridge(threading.Thread):
+    def __init__(
+        self,
+        client,
+        prefix: str = TOPIC_PREFIX,
+        discovery: str = DISCOVERY_PREFIX,
+        window: float = COALESCE_WINDOW,
+        maxQueue: int = MAX_QUEUE,
+        changes: ChangeFeed = feed,
+        server=None,
+    ) -> None:
+        threading.Thread.__init__(self, name="mqtt", daemon=True)
+        # paho-mqtt Client, or anything with publish() and the callbacks
+        self.client = client
+        client.on_connect = self.onConnect
+        client.on_disconnect = self.onDisconnect
+        client.on_message = self.onMessage
+        self.server = server  # UdpServer taking the commands, None: read only
+        self.prefix = prefix
+        self.discovery = discovery
+        self.window = window
+        self.maxQueue = maxQueue
+        self.feed = changes
+        self.stop = False
+        self.connected = False
+        self.resync = True  # publish all the rooms
+        self.lock = threading.RLock()
+        self.outbox: OrderedDict[str, tuple[str, bool]] = OrderedDict()
+        self.configured: set[tuple] = set()
+        self.published: dict[tuple, dict[str, Any]] = {}
+        self.messages = 0
+        self.coalesced = 0
+        self.dropped = 0
+        # commands by (deviceid, room, field): the value on its way, the
+        # values shown until the ack (None) or until the room version moves
+        self.pending: dict[tuple, Any] = {}
+        self.optimistic: dict[tuple, tuple[dict[str, Any], int | None]] = {}
+        self.commands = 0
+        self.deduped = 0
+        self.confirmed = 0
+        self.rolledBack = 0
+        self.unknown = 0  # commands to a device or room never seen
+        self.latency = LatencyHistogram()
+
+    def onConnect(self, client, userdata, flags, *args) -> None:
+        # paho 1.x passes rc, 2.x reason_code and properties
+        logger.info("MQTT connected")
+        self.connected = True
+        self.resync = True
+        if self.server is not None:
+            client.subscribe(f"{self.prefix}/+/+/set/+", qos=1)
+
+    def onDisconnect(self, client, userdata, *args) -> None:
+        logger.warning("MQTT disconnected")
+        self.connected = False
+
+    def stateTopic(self, deviceid, room) -> str:
+        return f"{self.prefix}/{deviceid}/{room}/state"
+
+    def commandTopic(self, deviceid, room, field) -> str:
+        return f"{self.prefix}/{deviceid}/{room}/set/{field}"
+
+    def uniqueId(self, deviceid, room) -> str:
+        return f"besim_{deviceid}_{room}"
+
+    def config(self, deviceid, room) -> dict[str, Any]:
+        state = self.stateTopic(deviceid, room)
+        commands = {}
+        if self.server is not None:
+            commands = {
+                f"{field}_command_topic": self.commandTopic(deviceid, room, name)
+                for field, name in (
+                    ("temperature", "temperature"),
+                    ("mode", "mode"),
+                    ("preset_mode", "preset"),
+                )
+            }
+        return {
+            **commands,
+            "name": f"Room {room}",
+            "unique_id": self.uniqueId(deviceid, room),
+            "temperature_unit": "C",
+            "precision": 0.1,
+            "modes": ["auto", "heat", "off"],
+            "preset_modes": ["boost", "away"],
+            "current_temperature_topic": state,
+            "current_temperature_template": "{{ value_json.current_temperature }}",
+            "temperature_state_topic": state,
+            "temperature_state_template": "{{ value_json.temperature }}",
+            "mode_state_topic": state,
+            "mode_state_template": "{{ value_json.mode }}",
+            "action_topic": state,
+            "action_template": "{{ value_json.action }}",
+            "preset_mode_state_topic": state,
+            "preset_mode_value_template": "{{ value_json.preset }}",
+            "json_attributes_topic": state,
+            "device": {
+                "identifiers": [f"besim_{deviceid}"],
+                "name": f"BeSmart {deviceid}",
+                "manufacturer": "Riello",
+                "model": "BeSmart",
+            },
+        }
+
+    def enqueue(self, topic: str, payload: dict[str, Any], retain=True) -> None:
+        with self.lock:
+            if topic in self.outbox:
+                self.coalesced += 1
+                del self.outbox[topic]
+            self.outbox[topic] = (json.dumps(payload), retain)
+            while len(self.outbox) > self.maxQueue:
+                self.outbox.popitem(last=False)
+                self.dropped += 1
+
+    def drain(self) -> None:
+        # Hands the outbox to the client, oldest first, while connected
+        while self.connected:
+            with self.lock:
+                if not self.outbox:
+                    return
+                topic, (payload, retain) = self.outbox.popitem(last=False)
+            self.client.publish(topic, payload, qos=1, retain=retain)
+            self.messages += 1
+
+    def rooms(self) -> set[tuple]:
+        return {
+            (deviceid, room)
+            for deviceid, device in getStatus()["devices"].items()
+            for room in device.rooms
+        }
+
+    def flush(self, rooms: set[tuple]) -> None:
+        # One config (the first time) and one state per changed room
+        for key in sorted(rooms):
+            self.publishRoom(key)
+            # the outbox only fills up while the broker is away
+            self.drain()
+
+    def publishRoom(self, key: tuple) -> None:
+        # Called by the bridge thread and the commands
+        device = getStatus()["devices"].get(key[0])
+        roomState = device.rooms.get(key[1]) if device is not None else None
+        if roomState is None:
+            return
+        with self.lock:
+            state = entityState(roomState.asdict())
+            if state is None:
+                return
+            for (deviceid, room, field), (values, version) in list(
+                self.optimistic.items()
+            ):
+                if (deviceid, room) != key:
+                    continue
+                if version is not None and roomState.version > version:
+                    # the next STATUS shows what the device did
+                    del self.optimistic[(deviceid, room, field)]
+                else:
+                    state.update(values)
+            if key not in self.configured:
+                topic = f"{self.discovery}/climate/{self.uniqueId(*key)}/config"
+                self.enqueue(topic, self.config(*key))
+                self.configured.add(key)
+            if self.published.get(key) != state:
+                self.enqueue(self.stateTopic(*key), state)
+                self.published[key] = state
+
+    def onMessage(self, client, userdata, message) -> None:
+        # Runs on the paho network thread
+        received = time.monotonic()
+        try:
+            prefix, deviceid, room, _, field = message.topic.split("/")
+            payload = message.payload.decode()
+            self.command(int(deviceid), int(room), field, payload, received)
+        except Exception:
+            logger.exception(f"MQTT command {message.topic}")
+
+    def command(self, deviceid, room, field, payload: str, received=None):
+        # Queues the downlink of an MQTT command, returns its Future or None
+        # when the same value is already on its way
+        received = time.monotonic() if received is None else received
+        # Never creates a device or room, the topic may be a typo or a stale
+        # retained command
+        device = getStatus()["devices"].get(deviceid)
+        roomState = device.rooms.get(room) if device is not None else None
+        if roomState is None or "addr" not in device:
+            logger.warning(f"MQTT command to unknown room {deviceid}/{room}")
+            with self.lock:
+                self.unknown += 1
+            return None
+        addr = device["addr"]
+        param = None  # room field written on the ack
+        if field == "temperature":
+            value = round(float(payload) * 10)
+            shown = {"temperature": value / 10.0, "t3": value / 10.0}
+            param = "t3"
+            send = (self.server.send_SET, MsgId.SET_T3, value)
+        elif field == "mode":
+            value = MODE_COMMANDS[payload]
+            shown = {"mode": payload, "heating_mode": value}
+            param = "mode"
+            send = (self.server.send_SET, MsgId.SET_MODE, value)
+        elif field == "preset" and payload == "away":
+            value = HeatingMode.HOLIDAY
+            shown = {"preset": payload, "heating_mode": value}
+            param = "mode"
+            send = (self.server.send_SET, MsgId.SET_MODE, value)
+        elif (
+            field == "preset"
+            and payload == "none"
+            and (roomState.get("mode") == HeatingMode.HOLIDAY)
+        ):
+            value = HeatingMode.AUTO
+            shown = {"preset": payload, "heating_mode": value}
+            param = "mode"
+            send = (self.server.send_SET, MsgId.SET_MODE, value)
+        elif field == "preset" and payload in ("boost", "none"):
+            value = int(payload == "boost")
+            shown = {"preset": payload}
+            send = (self.server.send_FAKE_BOOST, value)
+        else:
+            raise ValueError(f"Unknown command {field}={payload}")
+        key = (deviceid, room, field)
+        with self.lock:
+            if self.pending.get(key, MISSING) == value:
+                self.deduped += 1
+                return None
+            self.pending[key] = value
+            self.optimistic[key] = (shown, None)
+            self.commands += 1
+        self.publishRoom((deviceid, room))
+        self.drain()
+        fn, *args = send
+        kwargs = {"response": 0, "write": 1, "wait": 1} if param else {}
+        future = self.server.schedule(
+            deviceid,
+            fn,
+            addr,
+            device,
+            deviceid,
+            room,
+            *args,
+            priority=PRIORITY_USER,
+            tag=("mqtt", room, field),
+            replace=True,
+            **kwargs,
+        )
+        future.add_done_callback(
+            lambda f: self.commandDone(key, value, param, received, f)
+        )
+        return future
+
+    def commandDone(self, key: tuple, value, param, received: float, future) -> None:
+        with self.lock:
+            if self.pending.get(key, MISSING) != value:
+                return  # replaced by a newer value, its callback reports
+            del self.pending[key]
+        deviceid, room, field = key
+        ok = future.exception() is None and future.result() == value
+        if ok:
+            self.latency.add((time.monotonic() - received) * 1000.0)
+            self.confirmed += 1
+            roomState = getRoomStatus(deviceid, room)
+            if param is not None:
+                roomState[param] = value
+            with self.lock:
+                shown, _ = self.optimistic.get(key, ({}, None))
+                self.optimistic[key] = (shown, roomState.version)
+        else:
+            logger.warning(f"MQTT command {key}={value} failed")
+            self.rolledBack += 1
+            with self.lock:
+                self.optimistic.pop(key, None)
+        self.publishRoom((deviceid, room))
+        self.drain()
+
+    def run(self) -> None:
+        since = self.feed.version
+        dirty: set[tuple] = set()
+        flushAt: float | None = None
+        while not self.stop:
+            timeout = IDLE_WAIT
+            if flushAt is not None:
+                timeout = max(0.0, flushAt - time.monotonic())
+            elif self.resync:
+                timeout = 0.0
+            changes, since, reset = self.feed.wait(since, timeout)
+            if reset or self.resync:
+                self.resync = False
+                with self.lock:
+                    self.configured.clear()
+                    self.published.clear()
+                dirty |= self.rooms()
+            dirty |= {
+                (c["deviceid"], c["room"]) for c in changes if c["room"] is not None
+            }
+            if dirty and flushAt is None:
+                flushAt = time.monotonic() + self.window
+            if flushAt is not None and time.monotonic() >= flushAt:
+                try:
+                    self.flush(dirty)
+                except Exception:
+                    logger.exception("MQTT flush")
+                dirty, flushAt = set(), None
+            self.drain()
+
+    def shutdown(self) -> None:
+        self.stop = True
+
+    def getStats(self) -> dict[str, Any]:
+        with self.lock:
+            queued = len(self.outbox)
+        return {
+            "connected": self.connected,
+            "entities": len(self.configured),
+            "messages": self.messages,
+            "queued": queued,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "commands": {
+                "received": self.commands,
+                "deduped": self.deduped,
+                "confirmed": self.confirmed,
+                "rolled_back": self.rolledBack,
+                "unknown": self.unknown,
+                "latency": self.latency.asdict(),
+            },
+        }
+
+
+def connect(url: ParseResult, clientId: str = "besim"):
+    # paho-mqtt client for mqtt(s)://url, its network loop is started with
+    # loop_start() once the bridge set the callbacks
+    import paho.mqtt.client as mqtt  # installed with ha-mqtt-discoverable
+
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=clientId)
+    else:
+        client = mqtt.Client(client_id=clientId)
+    if url.username:
+        client.username_pw_set(url.username, url.password)
+    if url.scheme == "mqtts":
+        client.tls_set()
+    client.reconnect_delay_set(1, 30)
+    client.connect_async(
+        url.hostname, url.port or (8883 if url.scheme == "mqtts" else 1883)
+    )
+    return client
@@ -0,0 +1,102 @@
+#
+# Packet tracing
+#
+# Hexdumps of the datagrams and the decoded contents of every message are only
+# formatted when the trace is enabled for the packet: for all of them, for the
+# deviceid or for the MsgId. The selection can be changed at runtime (see
+# restapi.py) and the records go to the "packettrace" logger at INFO level.
+#
+import logging
+import threading
+from typing import Any, Iterable
+
+import hexdump
+from codec import MsgId
+
+logger = logging.getLogger("packettrace")
+
+
+class HexDump:
+    # Formats data only if the log record is emitted
+    __slots__ = ("data",)
+
+    def __init__(self, data) -> None:
+        self.data = data
+
+    def __str__(self) -> str:
+        return hexdump.dump(bytes(self.data))
+
+
+class PacketTracer:
+    def __init__(self, logger: logging.Logger = logger) -> None:
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.all = False
+        # Replaced, never modified in place, so readers don't need the lock
+        self.deviceids: frozenset[int] = frozenset()
+        self.msgIds: frozenset[int] = frozenset()
+        self.selected = False
+
+    @property
+    def active(self) -> bool:
+        # Cheap check for the hot path: may any packet be traced?
+        return self.selected and self.logger.isEnabledFor(logging.INFO)
+
+    def enabled(self, deviceid: int | None = None, msgType: int | None = None) -> bool:
+        return self.active and (
+            self.all or deviceid in self.deviceids or msgType in self.msgIds
+        )
+
+    def log(self, msg: str, *args: Any) -> None:
+        self.logger.info(msg, *args, stacklevel=2)
+
+    def packet(self, direction, addr, data, deviceid=None, msgType=None) -> None:
+        if self.enabled(deviceid, msgType):
+            self.logger.info(
+                "%s %s %d bytes : %s",
+                direction,
+                addr,
+                len(data),
+                HexDump(data),
+                stacklevel=2,
+            )
+
+    def configure(
+        self,
+        all: bool | None = None,
+        deviceids: Iterable[int] | None = None,
+        msgIds: Iterable[int] | None = None,
+    ) -> None:
+        with self.lock:
+            if all is not None:
+                self.all = all
+            if deviceids is not None:
+                self.deviceids = frozenset(deviceids)
+            if msgIds is not None:
+                self.msgIds = frozenset(msgIds)
+            self.selected = bool(self.all or self.deviceids or self.msgIds)
+
+    def add(self, deviceid: int | None = None, msgType: int | None = None) -> None:
+        with self.lock:
+            if deviceid is not None:
+                self.deviceids = self.deviceids | {deviceid}
+            if msgType is not None:
+                self.msgIds = self.msgIds | {msgType}
+            self.selected = bool(self.all or self.deviceids or self.msgIds)
+
+    def remove(self, deviceid: int | None = None, msgType: int | None = None) -> None:
+        with self.lock:
+            self.deviceids = self.deviceids - {deviceid}
+            self.msgIds = self.msgIds - {msgType}
+            self.selected = bool(self.all or self.deviceids or self.msgIds)
+
+    def asdict(self) -> dict[str, Any]:
+        return {
+            "all": self.all,
+            "deviceids": sorted(self.deviceids),
+            "msgids": [MsgId(msgId).name for msgId in sorted(self.msgIds)],
+            "active": self.active,
+        }
+
+
+tracer = PacketTracer()
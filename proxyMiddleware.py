@@ -1,9 +1,7 @@
 import binascii
 from enum import Enum
 from io import BytesIO
-import io
 import itertools
-import os
 import pickle
 from pprint import pformat
 import logging
@@ -17,6 +15,7 @@ import typing as t
 import hexdump
 
 from database import Database
+from datalog import DatalogWriter
 import time
 
 BEHAVIOUR = Enum(
@@ -40,6 +39,13 @@ PROXY_URL_BEHAVIOUR = {
 }
 
 
+def datalog_environ(env: WSGIEnvironment) -> dict:
+    # Only the plain values: streams and server objects in env can't be pickled
+    return {
+        k: v for k, v in env.items() if isinstance(v, (str, int, float, bool, tuple))
+    }
+
+
 def timing(f):
     def wrap(*args, **kwargs):
         time1: float = time.time()
@@ -88,7 +94,7 @@ class ProxyMiddleware(object):
     http_connection: dict[str, http.client.HTTPConnection] = {}
 
     def __init__(
-        self, app: Flask, upstream: str, datalog: t.Optional[io.TextIOWrapper]
+        self, app: Flask, upstream: str, datalog: t.Optional[DatalogWriter]
     ) -> None:
         self._app = app.wsgi_app
         self.app: Flask = app
@@ -104,7 +110,7 @@ class ProxyMiddleware(object):
         )
         # for answer in self.upstream_resolver.query('google.com', "A"):
         #    logging.info(answer.to_text())
-        self.datalog: io.TextIOWrapper | None = datalog
+        self.datalog: DatalogWriter | None = datalog
 
     def check_path_exists(self, env: WSGIEnvironment) -> bool:
         path = env["PATH_INFO"]
@@ -201,11 +207,16 @@ class ProxyMiddleware(object):
         proxy_body: bytes = body.read(length)
         body.seek(0)
         
-        if self.datalog:
+        if self.datalog and self.datalog.binary:
+            self.datalog.record(
+                "I",
+                env.get("REMOTE_ADDR", ""),
+                pickle.dumps((datalog_environ(env), proxy_body)),
+            )
+        elif self.datalog:
             self.datalog.write(f'"I","{hexdump.dump(pickle.dumps(env), sep='')}","{hexdump.dump(proxy_body, sep='')}"\r\n')
-            self.datalog.flush()
-            os.fsync(self.datalog)
 
+        body_org = ""  # No upstream call for ONLY_LOCAL
         if behaviour != BEHAVIOUR.ONLY_LOCAL:
             logging.debug(
                 pformat(
@@ -239,12 +250,16 @@ class ProxyMiddleware(object):
         def intercept_response(
             status: str, headers, *args
         ):  # -> Callable[..., object]:
-            if self.datalog:
+            if self.datalog and self.datalog.binary:
+                self.datalog.record(
+                    "O",
+                    status,
+                    pickle.dumps((datalog_environ(env), headers, body_org.encode("latin-1"))),
+                )
+            elif self.datalog:
                 self.datalog.write(
                     f'"O","{status}","{hexdump.dump(pickle.dumps(env), sep='')}","{hexdump.dump(pickle.dumps(headers), sep='')}","{hexdump.dump(body_org, sep='')}"\r\n'
                 )
-                self.datalog.flush()
-                os.fsync(self.datalog)
 
             env["RESPONSE_STATUS"] = status
             if behaviour in [BEHAVIOUR.REMOTE_FIRST, BEHAVIOUR.ONLY_REMOTE]:
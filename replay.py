@@ -0,0 +1,248 @@
+#
+# Replay of UDP datalogs through handleMsg
+#
+# Feeds the "I" records (and the "C" ones with --proxy) of a CSV datalog or of
+# a binary capture to UdpServer/ProxyUdpServer.handleMsg, with a socket stub
+# collecting what is sent back. Records are replayed as fast as possible or,
+# with --pacing, at their original pace (captures only, CSV datalogs have no
+# timestamps). The report has messages/s, latency percentiles per MsgId and
+# the peak memory.
+#
+# Usage:
+#   python replay.py datalog [--proxy] [--pacing] [--speed N] [--loops N]
+#                            [--tracemalloc] [--database PATH] [--json]
+#
+import argparse
+import ast
+import csv
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import traceback
+from typing import Any, Iterable, Iterator
+
+from capture import MAGIC, readCapture
+from codec import MsgId
+from database import Database
+from proxyUdpServer import ProxyUdpServer
+from udpserver import UdpServer, peekMsgType
+
+logger = logging.getLogger(__name__)
+
+# Cloud address given to the replayed ProxyUdpServer, "C" records come from it
+CLOUD_ADDR = ("127.0.0.2", 6199)
+
+
+def parseAddr(addr: str):
+    try:
+        return ast.literal_eval(addr)
+    except (ValueError, SyntaxError):
+        return addr
+
+
+def loadDatalog(path: str) -> Iterator[tuple[float | None, str, Any, bytes]]:
+    # (time, direction, addr, frame) of a CSV datalog or of a capture
+    # Only rotated segments left: a capture
+    binary = not os.path.exists(path)
+    if not binary:
+        with open(path, "rb") as f:
+            binary = f.read(len(MAGIC)) == MAGIC
+    if binary:
+        for record in readCapture(path):
+            yield record.time, record.direction, parseAddr(record.peer), record.data
+        return
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) == 3 and row[1].startswith("("):
+                yield None, row[0], parseAddr(row[1]), bytes.fromhex(row[2])
+
+
+class StubSocket:
+    def __init__(self) -> None:
+        self.sent = 0
+        self.sentBytes = 0
+
+    def sendto(self, data, address) -> int:
+        self.sent += 1
+        self.sentBytes += len(data)
+        return len(data)
+
+
+class ReplayMixin:
+    # The GET_PROG requests are paced by the downlink scheduler to spare the
+    # device, nothing to spare here: sent right away
+    def fetch_programs(self, addr, device, deviceid, rooms) -> None:
+        for room in rooms:
+            self.send_GET_PROG(addr, device, deviceid, room, response=0)  # type: ignore
+
+
+class ReplayUdpServer(ReplayMixin, UdpServer):
+    pass
+
+
+class ReplayProxyUdpServer(ReplayMixin, ProxyUdpServer):
+    pass
+
+
+def percentile(values: list[float], p: float) -> float:
+    # values must be sorted
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+class ReplayStats:
+    def __init__(self) -> None:
+        self.messages = 0
+        self.errors = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+        self.latencies: dict[str, list[float]] = {}
+        self.peakMemory: int | None = None  # tracemalloc, bytes
+        self.maxRss = 0  # kB
+
+    def add(self, name: str, latency: float) -> None:
+        self.messages += 1
+        self.latencies.setdefault(name, []).append(latency)
+
+    def asdict(self) -> dict[str, Any]:
+        msgIds = {}
+        for name, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            msgIds[name] = {
+                "count": len(values),
+                **{
+                    f"p{p}_us": round(percentile(values, p) * 1e6, 1)
+                    for p in (50, 90, 99)
+                },
+                "max_us": round(values[-1] * 1e6, 1),
+            }
+        return {
+            "messages": self.messages,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "elapsed_s": round(self.elapsed, 3),
+            "msgs_per_s": round(self.messages / self.elapsed, 1) if self.elapsed else 0,
+            "peak_memory_bytes": self.peakMemory,
+            "max_rss_kb": self.maxRss,
+            "msgids": msgIds,
+        }
+
+    def __str__(self) -> str:
+        report = self.asdict()
+        lines = [
+            f"{report['messages']} messages in {report['elapsed_s']} s: "
+            f"{report['msgs_per_s']} msgs/s, {report['errors']} errors, "
+            f"{report['skipped']} skipped",
+            f"max rss {report['max_rss_kb']} kB"
+            + (
+                f", traced peak {report['peak_memory_bytes']} bytes"
+                if report["peak_memory_bytes"] is not None
+                else ""
+            ),
+            f"{'msgid':<14} {'count':>8} {'p50 us':>10} {'p90 us':>10} {'p99 us':>10} {'max us':>10}",
+        ]
+        for name, s in report["msgids"].items():
+            lines.append(
+                f"{name:<14} {s['count']:>8} {s['p50_us']:>10} {s['p90_us']:>10} {s['p99_us']:>10} {s['max_us']:>10}"
+            )
+        return "\n".join(lines)
+
+
+def replay(
+    server: UdpServer,
+    records: Iterable[tuple[float | None, str, Any, bytes]],
+    pacing: bool = False,
+    speed: float = 1.0,
+    stats: ReplayStats | None = None,
+) -> ReplayStats:
+    stats = stats or ReplayStats()
+    cloud_addr = getattr(server, "cloud_addr", None)
+    handleMsg = server.handleMsg
+    first = None
+    started = time.perf_counter()
+    for ts, direction, addr, data in records:
+        if direction == "C" and cloud_addr is not None:
+            addr = cloud_addr
+        elif direction != "I":
+            stats.skipped += 1
+            continue
+        if pacing and ts is not None:
+            if first is None:
+                first = ts
+            delay = (ts - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        t = time.perf_counter()
+        try:
+            name = handleMsg(data, addr)
+        except Exception:
+            logger.error(traceback.format_exc())
+            stats.errors += 1
+            name = None
+        latency = time.perf_counter() - t
+        if not name:
+            msgType = peekMsgType(data)
+            name = MsgId(msgType).name if msgType is not None else "INVALID"
+        stats.add(name, latency)
+    stats.elapsed += time.perf_counter() - started
+    stats.maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return stats
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Replay a UDP datalog through handleMsg")
+    ap.add_argument("datalog", help="CSV datalog or binary capture")
+    ap.add_argument("--proxy", action="store_true", help="Replay on ProxyUdpServer")
+    ap.add_argument("--pacing", action="store_true", help="Keep the original pace")
+    ap.add_argument("--speed", type=float, default=1.0, help="Pacing speed factor")
+    ap.add_argument("--loops", type=int, default=1, help="Replay the datalog N times")
+    ap.add_argument("--tracemalloc", action="store_true", help="Trace peak memory")
+    ap.add_argument("--database", default=None, help="Database (default temporary)")
+    ap.add_argument("--json", action="store_true", help="Print the report as JSON")
+    ap.add_argument("-l", "--log_level", default="WARNING")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+
+    tmpdir = None
+    if args.database is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        args.database = os.path.join(tmpdir.name, "replay.db")
+    database = Database(name=args.database)
+    if not database.check_migrations():
+        sys.exit(1)
+
+    if args.proxy:
+        server: UdpServer = ReplayProxyUdpServer(
+            ("", 0), upstream="", debugmode=True, cloud_addr=CLOUD_ADDR
+        )
+    else:
+        server = ReplayUdpServer(("", 0))
+    sock = server.sock = StubSocket()  # type: ignore
+
+    records = list(loadDatalog(args.datalog))
+    if args.pacing and records and records[0][0] is None:
+        logger.warning("No timestamps in the datalog, replaying as fast as possible")
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    stats = ReplayStats()
+    for _ in range(args.loops):
+        replay(server, records, args.pacing, args.speed, stats)
+    if args.tracemalloc:
+        stats.peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    if args.json:
+        print(json.dumps({**stats.asdict(), "sent": sock.sent}, indent=2))
+    else:
+        print(stats)
+        print(f"{sock.sent} frames sent, {sock.sentBytes} bytes")
+    if tmpdir is not None:
+        tmpdir.cleanup()
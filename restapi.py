@@ -2,35 +2,67 @@
 # import queue
 # import token
 # from attr import field
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, send_file, stream_with_context
 from flask_restful import Api, Resource
 from flask_cors import CORS
+from werkzeug.exceptions import GatewayTimeout
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import json
 import time
 import logging
 import os
 import requests
-from cachetools import cached, TTLCache
+from cachetools import cached, LRUCache, TTLCache
 from threading import RLock
 
 from webargs import fields
 from webargs.flaskparser import use_kwargs, use_args
 
-from udpserver import MsgId, UdpServer
-from status import getStatus, getDeviceStatus, getRoomStatus
+from udpserver import SET_PARAMS, MsgId, UdpServer
+from packettrace import tracer
+from changefeed import feed
+from status import State, getStatus, getDeviceStatus, getRoomStatus
+from status import getVersion as storeVersion  # getVersion() is a route
 from database import Database
 from flask import render_template
 
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+DOWNLINK_TIMEOUT = 30.0  # seconds a REST write waits for its downlink
+
 
 class SetEncoder(json.JSONEncoder):
 
     def default(self, o):
+        if isinstance(o, State):
+            return o.asdict()
         return list(o) if isinstance(o, set) else json.JSONEncoder.default(self, o)
 
 
+# JSON bodies of the conditional GETs by path, with their ETag
+bodies: LRUCache = LRUCache(maxsize=4096)
+bodiesLock = RLock()
+
+
+def conditionalJson(etag: str, build):
+    # 304 when the client has etag, else the body build() returns, serialized
+    # once per etag. The status token keeps ETags apart across restarts.
+    etag = f"{getStatus()['token'][:8]}-{etag}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        with bodiesLock:
+            cached = bodies.get(request.path)
+        if cached is None or cached[0] != etag:
+            cached = (etag, json.dumps(build(), cls=SetEncoder).encode() + b"\n")
+            with bodiesLock:
+                bodies[request.path] = cached
+        response = app.response_class(cached[1], mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+
 app = Flask(
     "BeSim",
     subdomain_matching=True,
@@ -47,6 +79,17 @@ def getUdpServer() -> UdpServer:
     return app.config["udpServer"]
 
 
+def sendDownlink(deviceid, send, *args, **kwargs):
+    # Queued and paced with the other downlinks of the device, user writes go
+    # ahead of the background ones. 504 when the device is too slow.
+    future = getUdpServer().schedule(deviceid, send, *args, **kwargs)
+    try:
+        return future.result(DOWNLINK_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()  # not sent late if still queued
+        raise GatewayTimeout(f"No answer from device {deviceid}") from None
+
+
 @cached(cache=TTLCache(maxsize=1, ttl=3600), lock=RLock())
 def getWeather():
     # Uses met.no to get the weather at the servers' latitude, longitude
@@ -165,19 +208,28 @@ def favicon():
 
 class Peers(Resource):
     def get(self):
-        return json.dumps(
-            getStatus()["peers"], cls=SetEncoder
-        )  # @todo need to make flask_restful use the custom encoder
+        # Snapshots of the peers, keyed by "host:port"
+        peers = getStatus()["peers"]
+        return conditionalJson(
+            str(storeVersion()),
+            lambda: {
+                f"{addr[0]}:{addr[1]}": peer.asdict() for addr, peer in peers.items()
+            },
+        )
 
 
 class Devices(Resource):
     def get(self):
-        return list(getStatus()["devices"].keys())
+        devices = getStatus()["devices"]
+        return conditionalJson(str(storeVersion()), lambda: list(devices.keys()))
 
 
 class Device(Resource):
     def get(self, deviceid):
-        return getDeviceStatus(deviceid)
+        device = getDeviceStatus(deviceid)
+        # the cseq counters aren't versioned
+        cseq = hash(device.cseq.revision()) & 0xFFFFFFFF
+        return conditionalJson(f"{device.version}-{cseq:x}", device.asdict)
 
 
 class Rooms(Resource):
@@ -187,16 +239,19 @@ class Rooms(Resource):
             for k, v in getDeviceStatus(deviceid)["rooms"].items()
             if "lastseen" in v and v["lastseen"] > time.time() - 600
         )
-        return [
+        rooms = [
             k
             for k, v in getDeviceStatus(deviceid)["rooms"].items()
             if "lastseen" in v and v["lastseen"] > time.time() - 600
         ]
+        # changes with time too, the ETag is the list itself
+        return conditionalJson(",".join(map(str, rooms)), lambda: rooms)
 
 
 class Room(Resource):
     def get(self, deviceid, roomid):
-        return getRoomStatus(deviceid, roomid)
+        room = getRoomStatus(deviceid, roomid)
+        return conditionalJson(str(room.version), room.asdict)
 
 
 class ReadonlyParamResource(Resource):
@@ -205,9 +260,10 @@ class ReadonlyParamResource(Resource):
 
     def get(self, deviceid, roomid=None):
         if roomid is not None:
-            return getRoomStatus(deviceid, roomid)[self.param]
+            state: State = getRoomStatus(deviceid, roomid)
         else:
-            return getDeviceStatus(deviceid)[self.param]
+            state = getDeviceStatus(deviceid)
+        return conditionalJson(str(state.version), lambda: state[self.param])
 
 
 class WriteableParamResource(Resource):
@@ -216,13 +272,16 @@ class WriteableParamResource(Resource):
         self.msgId = kwargs["msgId"]
 
     def get(self, deviceid, roomid):
-        return getRoomStatus(deviceid, roomid)[self.param]
+        room = getRoomStatus(deviceid, roomid)
+        return conditionalJson(str(room.version), lambda: room[self.param])
 
     def put(self, deviceid, roomid):
         data = request.json
         val = data
         addr = getDeviceStatus(deviceid)["addr"]
-        new_val = getUdpServer().send_SET(
+        new_val = sendDownlink(
+            deviceid,
+            getUdpServer().send_SET,
             addr,
             getDeviceStatus(deviceid),
             deviceid,
@@ -239,6 +298,66 @@ class WriteableParamResource(Resource):
             return {"message": "OK"}, 200
 
 
+# Room parameters written by the batch endpoints
+SET_MSGIDS = {param: msgId for msgId, param in SET_PARAMS.items()}
+
+
+def sendParams(deviceid, rooms: dict) -> tuple[dict, int]:
+    # rooms is {roomid: {param: value}}, the SETs are paced downlink commands
+    # whose answers are awaited together
+    sets = []
+    for roomid, params in rooms.items():
+        if not isinstance(params, dict):
+            return {"message": f"Expected the params of room {roomid}"}, 400
+        for param, val in params.items():
+            if param not in SET_MSGIDS:
+                return {"message": f"Unknown param {param}"}, 400
+            sets.append((roomid, param, val))
+    if not sets:
+        return {"message": "No params"}, 400
+
+    device = getDeviceStatus(deviceid)
+    try:
+        new_vals = getUdpServer().send_SETS(
+            device["addr"],
+            device,
+            deviceid,
+            [(roomid, SET_MSGIDS[param], val) for roomid, param, val in sets],
+            timeout=DOWNLINK_TIMEOUT,
+        )
+    except FutureTimeoutError:
+        raise GatewayTimeout(f"No answer from device {deviceid}") from None
+    results: dict[str, dict[str, str]] = {}
+    for (roomid, param, val), new_val in zip(sets, new_vals):
+        results.setdefault(str(roomid), {})[param] = (
+            "OK" if new_val == val else "ERROR"
+        )
+    if all(new_val == val for (_, _, val), new_val in zip(sets, new_vals)):
+        return {"message": "OK", "results": results}, 200
+    else:
+        return {"message": "ERROR", "results": results}, 500
+
+
+class RoomParams(Resource):
+    def put(self, deviceid, roomid):
+        data = request.json
+        if not isinstance(data, dict):
+            return {"message": "Expected a dict of params"}, 400
+        return sendParams(deviceid, {roomid: data})
+
+
+class DeviceParams(Resource):
+    def put(self, deviceid):
+        data = request.json
+        if not isinstance(data, dict):
+            return {"message": "Expected a dict of rooms"}, 400
+        try:
+            rooms = {int(roomid): params for roomid, params in data.items()}
+        except ValueError:
+            return {"message": "Rooms must be numbers"}, 400
+        return sendParams(deviceid, rooms)
+
+
 class FakeBoostResource(Resource):
     def get(self, deviceid, roomid):
         roomStatus = getRoomStatus(deviceid, roomid)
@@ -248,8 +367,14 @@ class FakeBoostResource(Resource):
         data = request.json
         val = data
         addr = getDeviceStatus(deviceid)["addr"]
-        new_val = getUdpServer().send_FAKE_BOOST(
-            addr, getDeviceStatus(deviceid), deviceid, roomid, val
+        new_val = sendDownlink(
+            deviceid,
+            getUdpServer().send_FAKE_BOOST,
+            addr,
+            getDeviceStatus(deviceid),
+            deviceid,
+            roomid,
+            val,
         )
         if new_val != val:
             return {"message": "ERROR"}, 500
@@ -259,18 +384,22 @@ class FakeBoostResource(Resource):
 
 class Days(Resource):
     def get(self, deviceid, roomid):
-        return list(getRoomStatus(deviceid, roomid)["days"].keys())
+        room = getRoomStatus(deviceid, roomid)
+        return conditionalJson(str(room.version), lambda: room.days.keys())
 
 
 class Day(Resource):
     def get(self, deviceid, roomid, dayid):
-        return getRoomStatus(deviceid, roomid)["days"][dayid]
+        room = getRoomStatus(deviceid, roomid)
+        return conditionalJson(str(room.version), lambda: room.days[dayid])
 
     def put(self, deviceid, roomid, dayid):
         data = request.json
         val = data
         addr = getDeviceStatus(deviceid)["addr"]
-        new_val = getUdpServer().send_PROGRAM(
+        new_val = sendDownlink(
+            deviceid,
+            getUdpServer().send_PROGRAM,
             addr,
             getDeviceStatus(deviceid),
             deviceid,
@@ -291,16 +420,32 @@ class TimeResource(Resource):
     def get(self, deviceid):
         val = 0
         addr = getDeviceStatus(deviceid)["addr"]
-        return getUdpServer().send_DEVICE_TIME(
-            addr, getDeviceStatus(deviceid), deviceid, val, response=0, write=0, wait=1
+        return sendDownlink(
+            deviceid,
+            getUdpServer().send_DEVICE_TIME,
+            addr,
+            getDeviceStatus(deviceid),
+            deviceid,
+            val,
+            response=0,
+            write=0,
+            wait=1,
         )
 
     def put(self, deviceid):
         data = request.json
         val = data
         addr = getDeviceStatus(deviceid)["addr"]
-        new_val = getUdpServer().send_DEVICE_TIME(
-            addr, getDeviceStatus(deviceid), deviceid, val, response=0, write=1, wait=1
+        new_val = sendDownlink(
+            deviceid,
+            getUdpServer().send_DEVICE_TIME,
+            addr,
+            getDeviceStatus(deviceid),
+            deviceid,
+            val,
+            response=0,
+            write=1,
+            wait=1,
         )
         if new_val != val:
             return {"message": "ERROR"}, 500
@@ -313,8 +458,16 @@ class OutsideTempResource(Resource):
         data = request.json
         val = data
         addr = getDeviceStatus(deviceid)["addr"]
-        new_val = getUdpServer().send_OUTSIDE_TEMP(
-            addr, getDeviceStatus(deviceid), deviceid, val, response=0, write=1, wait=1
+        new_val = sendDownlink(
+            deviceid,
+            getUdpServer().send_OUTSIDE_TEMP,
+            addr,
+            getDeviceStatus(deviceid),
+            deviceid,
+            val,
+            response=0,
+            write=1,
+            wait=1,
         )
         if new_val != val:
             return {"message": "ERROR"}, 500
@@ -322,6 +475,152 @@ class OutsideTempResource(Resource):
             return {"message": "OK"}, 200
 
 
+class DispatchStats(Resource):
+    def get(self):
+        dispatcher = getUdpServer().dispatcher
+        return dispatcher.getStats() if dispatcher is not None else {}
+
+
+class DownlinkQueues(Resource):
+    def get(self):
+        return getUdpServer().downlink.getStats()
+
+
+class FakeBoostTimers(Resource):
+    def get(self):
+        return getUdpServer().boosts.getStats()
+
+
+class MqttStats(Resource):
+    def get(self):
+        bridge = app.config.get("mqttBridge")
+        return bridge.getStats() if bridge is not None else {}
+
+
+class CSeqStats(Resource):
+    def get(self):
+        devices = {
+            str(deviceid): device["cseq"].asdict()
+            for deviceid, device in list(getStatus()["devices"].items())
+        }
+        totals = {
+            key: sum(d[key] for d in devices.values())
+            for key in ("in_flight", "completed", "timed_out", "late", "unmatched")
+        }
+        return {**totals, "devices": devices}
+
+
+CHANGES_TIMEOUT = 30.0  # seconds a long-poll waits, between SSE keepalives
+CHANGES_ARGS = {
+    "since": fields.Int(load_default=0),
+    "deviceid": fields.Int(load_default=None),
+    "field": fields.List(fields.Str(), load_default=None),
+    "timeout": fields.Float(load_default=CHANGES_TIMEOUT),
+}
+
+
+class Changes(Resource):
+    # Long-poll: the changes after since, waits up to timeout for some
+    @use_args(CHANGES_ARGS, location="query")
+    def get(self, query):
+        changes, version, reset = feed.wait(
+            query["since"],
+            min(query["timeout"], CHANGES_TIMEOUT),
+            query["deviceid"],
+            query["field"],
+        )
+        return {"version": version, "reset": reset, "changes": changes}
+
+
+class ChangeStream(Resource):
+    # Server-sent events, one per change, resumes from Last-Event-ID
+    @use_args(CHANGES_ARGS, location="query")
+    def get(self, query):
+        since = int(request.headers.get("Last-Event-ID", query["since"]))
+
+        def events(since):
+            while True:
+                changes, since, reset = feed.wait(
+                    since, CHANGES_TIMEOUT, query["deviceid"], query["field"]
+                )
+                if reset:
+                    yield f"event: reset\nid: {since}\ndata: {{}}\n\n"
+                for change in changes:
+                    data = json.dumps(change, cls=SetEncoder)
+                    yield f"id: {change['version']}\ndata: {data}\n\n"
+                if not changes and not reset:
+                    yield ": keepalive\n\n"
+
+        return Response(
+            stream_with_context(events(since)),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+
+def parseMsgId(msgid: str) -> MsgId | None:
+    # Either the name (STATUS) or the value (0x24, 36) of the message
+    if msgid in MsgId.__members__:
+        return MsgId[msgid]
+    try:
+        msgId = MsgId(int(msgid, 0))
+    except ValueError:
+        return None
+    return None if msgId == MsgId.UNKNOWN_ID else msgId
+
+
+class PacketTrace(Resource):
+    def get(self):
+        return tracer.asdict()
+
+    def put(self):
+        data = request.json
+        msgIds = [parseMsgId(str(m)) for m in data.get("msgids", [])]
+        if None in msgIds:
+            return {"message": "Unknown MsgId"}, 400
+        tracer.configure(
+            all=data.get("all"),
+            deviceids=data.get("deviceids"),
+            msgIds=msgIds if "msgids" in data else None,
+        )
+        return tracer.asdict()
+
+
+class PacketTraceDevice(Resource):
+    def put(self, deviceid):
+        tracer.add(deviceid=deviceid)
+        return tracer.asdict()
+
+    def delete(self, deviceid):
+        tracer.remove(deviceid=deviceid)
+        return tracer.asdict()
+
+
+class PacketTraceMsgId(Resource):
+    def put(self, msgid):
+        msgId = parseMsgId(msgid)
+        if msgId is None:
+            return {"message": "Unknown MsgId"}, 404
+        tracer.add(msgType=msgId)
+        return tracer.asdict()
+
+    def delete(self, msgid):
+        msgId = parseMsgId(msgid)
+        if msgId is None:
+            return {"message": "Unknown MsgId"}, 404
+        tracer.remove(msgType=msgId)
+        return tracer.asdict()
+
+
+class DatalogStats(Resource):
+    def get(self):
+        return {
+            name: writer.getStats()
+            for name, writer in app.config.get("datalogs", {}).items()
+            if writer is not None
+        }
+
+
 class Weather(Resource):
     def get(self):
         return getWeather()
@@ -448,6 +747,19 @@ api.add_resource(
     host="api.besmart-home.com",
 )
 
+api.add_resource(
+    DeviceParams,
+    "/api/v1.0/devices/<int:deviceid>/params",
+    endpoint="device_params",
+    host="api.besmart-home.com",
+)
+api.add_resource(
+    RoomParams,
+    "/api/v1.0/devices/<int:deviceid>/rooms/<int:roomid>/params",
+    endpoint="room_params",
+    host="api.besmart-home.com",
+)
+
 api.add_resource(
     WriteableParamResource,
     "/api/v1.0/devices/<int:deviceid>/rooms/<int:roomid>/t1",
@@ -621,6 +933,74 @@ api.add_resource(
     endpoint="call_unknown_api",
 )
 
+api.add_resource(
+    DispatchStats,
+    "/api/v1.0/udp/dispatch",
+    endpoint="udp_dispatch",
+)
+
+api.add_resource(
+    DownlinkQueues,
+    "/api/v1.0/udp/downlink",
+    endpoint="udp_downlink",
+)
+
+api.add_resource(
+    CSeqStats,
+    "/api/v1.0/udp/cseq",
+    endpoint="udp_cseq",
+)
+
+api.add_resource(
+    FakeBoostTimers,
+    "/api/v1.0/udp/fakeboost",
+    endpoint="udp_fakeboost",
+)
+
+api.add_resource(
+    MqttStats,
+    "/api/v1.0/mqtt",
+    endpoint="mqtt",
+)
+
+api.add_resource(
+    Changes,
+    "/api/v1.0/changes",
+    endpoint="changes",
+    host="api.besmart-home.com",
+)
+
+api.add_resource(
+    ChangeStream,
+    "/api/v1.0/changes/stream",
+    endpoint="changes_stream",
+    host="api.besmart-home.com",
+)
+
+api.add_resource(
+    DatalogStats,
+    "/api/v1.0/datalog",
+    endpoint="datalog",
+)
+
+api.add_resource(
+    PacketTrace,
+    "/api/v1.0/udp/trace",
+    endpoint="udp_trace",
+)
+
+api.add_resource(
+    PacketTraceDevice,
+    "/api/v1.0/udp/trace/devices/<int:deviceid>",
+    endpoint="udp_trace_device",
+)
+
+api.add_resource(
+    PacketTraceMsgId,
+    "/api/v1.0/udp/trace/msgids/<string:msgid>",
+    endpoint="udp_trace_msgid",
+)
+
 
 # OpenTherm parameters
 for endpoint in [
@@ -669,7 +1049,9 @@ class TestResource(Resource):
 
         val = 0
         addr = getDeviceStatus(deviceid)["addr"]
-        return getUdpServer().send_SET(
+        return sendDownlink(
+            deviceid,
+            getUdpServer().send_SET,
             addr,
             getDeviceStatus(deviceid),
             deviceid,
@@ -1,52 +1,410 @@
 #
 # This is where we store the status of any connected peers/devices
 #
+# Peers, devices and rooms are slotted objects: attribute access on the hot
+# path (handleMsg) and a fraction of the memory of the dicts they replace.
+# They still behave as mappings (state["t3"], "fakeboost" in state) for the
+# REST API.
+#
+# Writers change the states under `lock` and publish them: every publish
+# takes the next store version and replaces the snapshot of the states, a
+# JSON ready dict which is never modified afterwards. Readers use asdict()
+# (the snapshot) without locking and never see a half applied STATUS of a
+# room. Item assignment publishes, attribute writes go in an update() block:
+#
+#     with update(roomStatus):
+#         roomStatus.temp = 201
+#         roomStatus.settemp = 210
+#
+# The peers/devices/rooms dicts are copy on write, they can be iterated
+# while the UDP server adds peers, devices or rooms. asdict() of a device
+# adds the snapshots of its rooms, and its version moves with theirs.
+#
+# Peers are the NAT addresses the devices send from, "index" maps every
+# deviceid to its current peer. Peers not heard from for PEER_EXPIRY seconds
+# are forgotten, swept when a new peer shows up.
+#
 # import logging
 # from pprint import pformat
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
 from uuid import uuid4
 
+from changefeed import feed
+from correlation import CSeqTable
+
+DAYS = 7
+HOURS = 24
+PEER_EXPIRY = 900  # seconds
+PEER_SWEEP_INTERVAL = 60  # seconds
+
+lock = threading.RLock()  # held by the writers only
+version = 0  # of the last publish, see getVersion()
+MISSING = object()
+
+
+class WeekProgram:
+    # Programs of the 7 days, 24 bytes a day, days never received are unset
+    __slots__ = ("data", "mask", "owner", "snapshot")
+
+    def __init__(self, owner: "State | None" = None) -> None:
+        self.data = bytearray(DAYS * HOURS)
+        self.mask = 0
+        self.owner = owner  # published when a day changes
+        self.snapshot: dict[int, list[int]] = {}
+
+    def __len__(self) -> int:
+        return self.mask.bit_count()
+
+    def __contains__(self, day) -> bool:
+        return isinstance(day, int) and 0 <= day < DAYS and bool(self.mask >> day & 1)
+
+    def __getitem__(self, day: int) -> list[int]:
+        if day not in self:
+            raise KeyError(day)
+        return list(self.data[day * HOURS : (day + 1) * HOURS])
+
+    def __setitem__(self, day: int, prog) -> None:
+        if not 0 <= day < DAYS or len(prog) != HOURS:
+            raise KeyError(day)
+        with lock:
+            self.data[day * HOURS : (day + 1) * HOURS] = bytes(prog)
+            self.mask |= 1 << day
+            self.snapshot = dict(self.items())
+            if self.owner is not None:
+                publish(self.owner)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.keys())
+
+    def keys(self) -> list[int]:
+        return [day for day in range(DAYS) if self.mask >> day & 1]
+
+    def items(self) -> list[tuple[int, list[int]]]:
+        return [(day, self[day]) for day in self.keys()]
+
+    def asdict(self) -> dict[int, list[int]]:
+        return self.snapshot
+
+
+class State:
+    # Mapping access to the slots, unset slots are missing keys
+    __slots__ = ("version", "snapshot")
+    FIELDS: tuple[str, ...] = ()
+
+    def __init__(self) -> None:
+        self.version = 0  # store version of the last publish
+        self.snapshot: dict[str, Any] | None = None
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        with lock:
+            setattr(self, key, value)
+            publish(self)
+
+    def __contains__(self, key) -> bool:
+        return key in self.FIELDS and hasattr(self, key)
+
+    def get(self, key: str, default=None) -> Any:
+        return getattr(self, key, default) if key in self.FIELDS else default
+
+    def keys(self) -> list[str]:
+        return [key for key in self.FIELDS if hasattr(self, key)]
+
+    def items(self) -> list[tuple[str, Any]]:
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def parents(self) -> tuple["State", ...]:
+        # States whose version moves with this one
+        return ()
+
+    def feedKey(self) -> tuple | None:
+        # (deviceid, room) of the changes in the change feed, None for none
+        return None
+
+    def asdict(self) -> dict[str, Any]:
+        # JSON ready, shared between callers: don't modify it
+        snapshot = self.snapshot
+        return snapshot if snapshot is not None else self.todict()
+
+    def todict(self) -> dict[str, Any]:
+        values = {}
+        for key in self.FIELDS:
+            value = getattr(self, key, MISSING)
+            if value is not MISSING:
+                values[key] = value
+        return values
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.todict()})"
+
 
-Status = {"peers": {}, "devices": {}, "token": str(uuid4())}
+class RoomState(State):
+    FIELDS = (
+        "days",
+        "heating",
+        "temp",
+        "settemp",
+        "t3",
+        "t2",
+        "t1",
+        "maxsetp",
+        "minsetp",
+        "mode",
+        "tempcurve",
+        "heatingsetp",
+        "sensorinfluence",
+        "units",
+        "advance",
+        "boost",
+        "cmdissued",
+        "winter",
+        "lastseen",
+        "fakeboost",
+    )
+    __slots__ = FIELDS + ("device", "room")
+
+    def __init__(self, device: "DeviceState | None" = None, room=None) -> None:
+        super().__init__()
+        self.days = WeekProgram(self)
+        self.device = device
+        self.room = room
+
+    def parents(self) -> tuple[State, ...]:
+        return (self.device,) if self.device is not None else ()
+
+    def feedKey(self) -> tuple | None:
+        if self.device is None or self.device.deviceid is None:
+            return None
+        return self.device.deviceid, self.room
+
+    def todict(self) -> dict[str, Any]:
+        return {**super().todict(), "days": self.days.asdict()}
+
+
+class DeviceState(State):
+    FIELDS = (
+        "rooms",
+        "cseq",
+        "addr",
+        "version",
+        "boilerOn",
+        "dhwMode",
+        "tFLO",
+        "tdH",
+        "tESt",
+        "wifisignal",
+        "lastseen",
+    )
+    # "version" is the software version of the device, see State.version
+    __slots__ = tuple(f for f in FIELDS if f != "version") + ("swversion", "deviceid")
+
+    def __init__(self, deviceid=None) -> None:
+        super().__init__()
+        self.deviceid = deviceid
+        self.rooms: dict[int, RoomState] = {}  # copy on write
+        # cseq is the control plane sequence numbers table, see correlation.py
+        self.cseq = CSeqTable()
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "version":
+            key = "swversion"
+        return super().__getitem__(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key == "version":
+            with lock:
+                self.swversion = value
+                publish(self)
+        else:
+            super().__setitem__(key, value)
+
+    def __contains__(self, key) -> bool:
+        if key == "version":
+            return hasattr(self, "swversion")
+        return super().__contains__(key)
+
+    def get(self, key: str, default=None) -> Any:
+        return self[key] if key in self else default
+
+    def keys(self) -> list[str]:
+        return [key for key in self.FIELDS if key in self]
+
+    def items(self) -> list[tuple[str, Any]]:
+        return [(key, self[key]) for key in self.keys()]
+
+    def feedKey(self) -> tuple | None:
+        return (self.deviceid, None) if self.deviceid is not None else None
+
+    def asdict(self) -> dict[str, Any]:
+        # the cseq counters change all the time, they aren't in the snapshot
+        return {
+            "rooms": {room: r.asdict() for room, r in self.rooms.items()},
+            **super().asdict(),
+            "cseq": self.cseq.asdict(),
+        }
+
+    def todict(self) -> dict[str, Any]:
+        values = {}
+        for key in self.FIELDS[2:]:  # rooms and cseq are added by asdict()
+            value = getattr(self, "swversion" if key == "version" else key, MISSING)
+            if value is not MISSING:
+                values[key] = value
+        return values
+
+
+class PeerState(State):
+    FIELDS = ("devices", "seq", "lastseen")
+    __slots__ = FIELDS
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.devices: set[int] = set()
+        self.lastseen = int(time.time())
+
+    def todict(self) -> dict[str, Any]:
+        return {**super().todict(), "devices": sorted(self.devices)}
+
+
+def publish(*states: State) -> int:
+    # New snapshots of states, returns the store version they got. The
+    # fields which changed go to the change feed.
+    global version
+    with lock:
+        version += 1
+        for state in states:
+            old, new = state.snapshot or {}, state.todict()
+            state.snapshot = new
+            state.version = version
+            for parent in state.parents():
+                parent.version = version
+            key = state.feedKey()
+            if key is not None:
+                values = {k: v for k, v in new.items() if old.get(k, MISSING) != v}
+                if values:
+                    feed.append(version, *key, values)
+        return version
+
+
+@contextmanager
+def update(*states: State) -> Iterator[None]:
+    # Change states under the lock, publish them once done
+    with lock:
+        yield
+        publish(*states)
+
+
+Status = {"peers": {}, "devices": {}, "index": {}, "token": str(uuid4())}
 # Status = {
-#    "peers": {("192.168.0.105", 6199): {"devices": {596505258}, "seq": 1306}},
-#    "devices": {},
+#    "peers": {("192.168.0.105", 6199): PeerState(devices={596505258}, seq=1306)},
+#    "devices": {596505258: DeviceState(rooms={8: RoomState(...)}, ...)},
+#    "index": {596505258: ("192.168.0.105", 6199)},
 #    "token": str(uuid4()),
 # }
+lastSweep = 0.0
 
 
 def getStatus():
     return Status
 
 
+def getVersion() -> int:
+    return version
+
+
 def getPeerFromDeviceId(deviceId):
-    value = dict(
-        filter(lambda pair: deviceId in pair[1]["devices"], Status["peers"].items())
-    ).keys()
-    # logging.debug(
-    #    pformat((Status, value, len(value), list(value)[0] if len(value) > 0 else None))
-    # )
-    return list(value)[0] if len(value) > 0 else None
+    return Status["index"].get(deviceId)
+
+
+def getPeerStatus(addr) -> PeerState:
+    peer = Status["peers"].get(addr)
+    if peer is None:
+        with lock:
+            sweepPeers()
+            peer = Status["peers"].get(addr)
+            if peer is None:
+                peer = PeerState()
+                publish(peer)
+                Status["peers"] = {**Status["peers"], addr: peer}
+    return peer
+
+
+def setPeerDevice(addr, deviceid) -> PeerState:
+    # deviceid sends from addr, moves it from the peer it had before
+    peer = getPeerStatus(addr)
+    index = Status["index"]
+    if index.get(deviceid) == addr and deviceid in peer.devices:
+        return peer
+    with lock:
+        old = index.get(deviceid)
+        previous = Status["peers"].get(old) if old != addr else None
+        if previous is not None:
+            previous.devices.discard(deviceid)
+            publish(previous)
+            if not previous.devices:
+                Status["peers"] = {a: p for a, p in Status["peers"].items() if a != old}
+        peer.devices.add(deviceid)
+        publish(peer)
+        index[deviceid] = addr
+    return peer
+
 
+def expirePeers(maxAge: float = PEER_EXPIRY, now: float | None = None) -> list:
+    # Forget the peers not seen for maxAge seconds, returns their addresses
+    now = time.time() if now is None else now
+    with lock:
+        peers, index = Status["peers"], Status["index"]
+        expired = [addr for addr, peer in peers.items() if peer.lastseen < now - maxAge]
+        if expired:
+            Status["peers"] = {a: p for a, p in peers.items() if a not in expired}
+        for addr in expired:
+            for deviceid in peers[addr].devices:
+                if index.get(deviceid) == addr:
+                    del index[deviceid]
+        if expired:
+            publish()  # the peers changed, move the store version
+    return expired
 
-def getPeerStatus(addr):
-    if addr not in Status["peers"]:
-        Status["peers"][addr] = {"devices": set()}
-    return Status["peers"][addr]
 
+def sweepPeers(now: float | None = None) -> list:
+    # expirePeers at most every PEER_SWEEP_INTERVAL seconds
+    global lastSweep
+    now = time.time() if now is None else now
+    if now - lastSweep < PEER_SWEEP_INTERVAL:
+        return []
+    lastSweep = now
+    return expirePeers(PEER_EXPIRY, now)
 
-def getDeviceStatus(deviceid):
-    if deviceid not in Status["devices"]:
-        # cseq is control plane sequence number, 0..0xfd
-        # results is a dict holding the results from a request
-        # 'results' = { <sequence number of request sent> : { 'ev' : <threading.Event>,
-        # 'val' : <result of requested operation> }, ... }
-        Status["devices"][deviceid] = {"rooms": {}, "cseq": 0x0, "results": {}}
-    return Status["devices"][deviceid]
 
+def getDeviceStatus(deviceid) -> DeviceState:
+    device = Status["devices"].get(deviceid)
+    if device is None:
+        with lock:
+            device = Status["devices"].get(deviceid)
+            if device is None:
+                device = DeviceState(deviceid)
+                publish(device)
+                Status["devices"] = {**Status["devices"], deviceid: device}
+    return device
 
-def getRoomStatus(deviceid, room):
-    deviceStatus = getDeviceStatus(deviceid)
 
-    if room not in deviceStatus["rooms"]:
-        deviceStatus["rooms"][room] = {"days": {}}
-    return deviceStatus["rooms"][room]
+def getRoomStatus(deviceid, room) -> RoomState:
+    device = getDeviceStatus(deviceid)
+    roomStatus = device.rooms.get(room)
+    if roomStatus is None:
+        with lock:
+            roomStatus = device.rooms.get(room)
+            if roomStatus is None:
+                roomStatus = RoomState(device, room)
+                device.rooms = {**device.rooms, room: roomStatus}
+                publish(roomStatus)
+    return roomStatus
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+
+class Broker:
+    # In-process stand-in for an MQTT broker: retained messages, a log of
+    # everything published and clients that can be disconnected
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.retained: dict[str, str] = {}
+        self.log: list[tuple[str, str, bool]] = []
+        self.clients: list["Client"] = []
+
+    def client(self) -> "Client":
+        client = Client(self)
+        self.clients.append(client)
+        return client
+
+    def deliver(self, topic: str, payload: str, retain: bool) -> None:
+        with self.lock:
+            self.log.append((topic, payload, retain))
+            if retain:
+                self.retained[topic] = payload
+            subscribers = [c for c in self.clients if c.subscribed(topic)]
+        for client in subscribers:
+            client.receive(topic, payload)
+
+    def outage(self) -> None:
+        for client in self.clients:
+            client.disconnect()
+
+    def restore(self) -> None:
+        for client in self.clients:
+            client.connect()
+
+
+class Message:
+    def __init__(self, topic: str, payload: str) -> None:
+        self.topic = topic
+        self.payload = payload.encode()
+
+
+class Client:
+    # The part of paho.mqtt.client.Client the bridge uses
+    def __init__(self, broker: Broker) -> None:
+        self.broker = broker
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.topics: set[str] = set()
+        self.connected = False
+
+    def connect(self) -> None:
+        self.connected = True
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+
+    def disconnect(self) -> None:
+        self.connected = False
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, None, 1)
+
+    def publish(self, topic, payload, qos=0, retain=False) -> None:
+        assert self.connected, "published while disconnected"
+        self.broker.deliver(topic, payload, retain)
+
+    def subscribe(self, topic, qos=0) -> None:
+        self.topics.add(topic)
+
+    def subscribed(self, topic: str) -> bool:
+        # "+" wildcards only
+        parts = topic.split("/")
+        for pattern in self.topics:
+            wanted = pattern.split("/")
+            if len(wanted) == len(parts) and all(
+                w in ("+", p) for w, p in zip(wanted, parts)
+            ):
+                return True
+        return False
+
+    def receive(self, topic: str, payload: str) -> None:
+        if self.on_message is not None:
+            self.on_message(self, None, Message(topic, payload))
+
+
+@pytest.fixture
+def broker() -> Broker:
+    return Broker()
@@ -0,0 +1,37 @@
+import asyncio
+import time
+
+import udpserver
+from asyncUdpServer import AsyncUdpServer
+from database import Database
+from emulator import Fleet
+from status import getDeviceStatus
+from udpserver import UdpServer
+
+
+def test_asyncio_engine_answers_ping_and_status(tmp_path, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(udpserver, "GET_PROG_INTERVAL", 0)
+    database = Database()
+    database.name = str(tmp_path / "async.db")
+    database.check_migrations()
+    engine = AsyncUdpServer(UdpServer(("127.0.0.1", 0)))
+    engine.daemon = True
+    engine.start()
+    deadline = time.monotonic() + 5
+    while engine.transport is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    target = engine.transport.get_extra_info("sockname")
+    fleet = Fleet(target, 1, timeScale=80, baseDeviceId=4300, seed=2)
+
+    # Act
+    stats = asyncio.run(fleet.run(1.0)).asdict()
+    engine.shutdown()
+    engine.join(5)
+
+    # Assert
+    assert stats["received"]["PING"] >= 1
+    assert stats["status_sent"] >= 2
+    assert stats["status_acked"] == stats["status_sent"]
+    assert getDeviceStatus(4300)["addr"][0] == "127.0.0.1"
+    assert not engine.is_alive()
@@ -0,0 +1,83 @@
+import os
+
+from capture import CaptureFile, CaptureWriter, convertCsv, readCapture, segments
+
+ADDR = ("192.168.0.105", 6199)
+
+
+def records(start, count):
+    return [(start + n, "I", ADDR, bytes([n % 256]) * 20) for n in range(count)]
+
+
+def test_write_read_roundtrip(tmp_path):
+    # Arrange
+    path = str(tmp_path / "udp.bin")
+    capture = CaptureFile(path)
+
+    # Act
+    capture.write(records(1000.0, 10))
+    capture.close()
+
+    # Assert
+    read = list(readCapture(path))
+    assert [r.time for r in read] == [1000.0 + n for n in range(10)]
+    assert read[3].direction == "I"
+    assert read[3].peer == str(ADDR)
+    assert read[3].data == bytes([3]) * 20
+
+
+def test_rotation_compression_and_time_window(tmp_path):
+    # Arrange
+    path = str(tmp_path / "udp.bin")
+    capture = CaptureFile(path, rotateBytes=1000)
+
+    # Act
+    for n in range(20):
+        capture.write(records(1000.0 + n * 10, 10))
+    capture.close()
+    for compressor in capture.compressors:
+        compressor.join()
+
+    # Assert
+    names = segments(path)
+    assert len(names) > 3
+    assert all(name.endswith(".gz") for name in names[:-1])
+    window = list(readCapture(path, start=1055.0, end=1123.0))
+    assert [r.time for r in window] == [1055.0 + n for n in range(69)]
+    assert len(list(readCapture(path))) == 200
+
+
+def test_convert_csv_datalog(tmp_path):
+    # Arrange
+    csvPath = tmp_path / "udp.csv"
+    csvPath.write_text(
+        f'"I","{ADDR}","FAD40100"\r\n"O","{ADDR}","FAD40200"\r\n',
+    )
+    path = str(tmp_path / "udp.bin")
+
+    # Act
+    capture = CaptureFile(path)
+    n = convertCsv(str(csvPath), capture, start=50.0, interval=0.5)
+    capture.close()
+
+    # Assert
+    read = list(readCapture(path))
+    assert n == 2
+    assert [(r.time, r.direction) for r in read] == [(50.0, "I"), (50.5, "O")]
+    assert read[1].data == bytes.fromhex("FAD40200")
+
+
+def test_capture_writer(tmp_path):
+    # Arrange
+    path = str(tmp_path / "udp.bin")
+    writer = CaptureWriter(CaptureFile(path))
+    writer.start()
+
+    # Act
+    writer.record("I", ADDR, b"\x01\x02")
+    writer.record("O", ADDR, bytearray(b"\x03"))
+    writer.close()
+
+    # Assert
+    assert [r.data for r in readCapture(path)] == [b"\x01\x02", b"\x03"]
+    assert os.path.getsize(path) > 0
@@ -0,0 +1,85 @@
+import threading
+
+from changefeed import ChangeFeed
+from restapi import app
+from status import getRoomStatus, update
+
+DEVICEID = 596505260
+
+
+def test_feed_filters_by_device_and_field():
+    # Arrange
+    feed = ChangeFeed(size=8)
+    feed.append(1, 10, 1, {"temp": 200, "t3": 215})
+    feed.append(2, 11, 1, {"temp": 190})
+    feed.append(3, 10, None, {"wifisignal": 80})
+
+    # Act
+    device = feed.since(0, deviceid=10)
+    temp = feed.since(0, fields=["temp"])
+    later = feed.since(2)
+
+    # Assert
+    assert [c["version"] for c in device[0]] == [1, 3]
+    assert [c["values"] for c in temp[0]] == [{"temp": 200}, {"temp": 190}]
+    assert later == (
+        [{"version": 3, "deviceid": 10, "room": None, "values": {"wifisignal": 80}}],
+        3,
+        False,
+    )
+
+
+def test_missed_changes_reset_the_cursor():
+    # Arrange
+    feed = ChangeFeed(size=2)
+
+    # Act
+    for version in range(1, 5):
+        feed.append(version, 10, 1, {"temp": version})
+
+    # Assert
+    assert feed.since(1)[2] is True
+    assert feed.since(2) == (
+        [
+            {"version": 3, "deviceid": 10, "room": 1, "values": {"temp": 3}},
+            {"version": 4, "deviceid": 10, "room": 1, "values": {"temp": 4}},
+        ],
+        4,
+        False,
+    )
+    # From before a restart
+    assert feed.since(10)[2] is True
+
+
+def test_long_poll_returns_the_room_delta():
+    # Arrange
+    app.config["TESTING"] = True
+    client = app.test_client()
+    room = getRoomStatus(DEVICEID, 3)
+    room["temp"] = 200
+    version = client.get("/api/v1.0/changes?timeout=0").json["version"]
+
+    def change():
+        with update(room):
+            room.temp = 205
+            room.t3 = 215
+
+    # Act
+    timer = threading.Timer(0.1, change)
+    timer.start()
+    response = client.get(
+        f"/api/v1.0/changes?since={version}&deviceid={DEVICEID}&field=temp&timeout=5"
+    )
+    timer.join()
+
+    # Assert
+    assert response.json["reset"] is False
+    assert response.json["changes"] == [
+        {
+            "version": room.version,
+            "deviceid": DEVICEID,
+            "room": 3,
+            "values": {"temp": 205},
+        }
+    ]
+    assert response.json["version"] >= room.version
@@ -0,0 +1,101 @@
+import struct
+
+import pytest
+from codec import DOWNLINK, UPLINK, MsgId, SetMsg, setSchema
+
+DEVICEID = 596505258
+
+
+def status_payload():
+    p = struct.pack("<BBHI", 0xFF, 2, 4, DEVICEID)
+    for room in range(8):
+        p += struct.pack(
+            "<IBBhhhhhhhBBHBB",
+            room + 1,
+            0x8F,
+            0x31,
+            205,
+            200,
+            210,
+            180,
+            160,
+            300,
+            50,
+            0x36,
+            0x7,
+            0,
+            15,
+            40,
+        )
+    p += struct.pack("<BB", 0x60, 0) + struct.pack("<10h", *range(10))
+    p += struct.pack("<BBHHHH", 70, 0, 0, 0, 0, 0)
+    return p
+
+
+@pytest.mark.parametrize(
+    "table, msgId, payload",
+    [
+        (UPLINK, MsgId.STATUS, status_payload()),
+        (UPLINK, MsgId.PING, struct.pack("<BBHIH", 0xFF, 2, 4, DEVICEID, 1)),
+        (
+            UPLINK,
+            MsgId.PROGRAM,
+            struct.pack("<BBHIIH24B", 0xFF, 2, 1, DEVICEID, 1, 3, *range(24)),
+        ),
+        (
+            UPLINK,
+            MsgId.SWVERSION,
+            struct.pack("<BBHI13s", 0, 2, 1, DEVICEID, b"0654918011102"),
+        ),
+        (UPLINK, MsgId.SET_MODE, struct.pack("<BBHIIB", 0, 2, 1, DEVICEID, 1, 3)),
+        (DOWNLINK, MsgId.STATUS, struct.pack("<BBHII", 0xFF, 0, 0, DEVICEID, 1234)),
+        (DOWNLINK, MsgId.DEVICE_TIME, struct.pack("<BBHI", 1, 0, 0, DEVICEID)),
+        (
+            DOWNLINK,
+            MsgId.DEVICE_TIME,
+            struct.pack("<BBHIII", 1, 0, 0, DEVICEID, 1, 0),
+        ),
+        (DOWNLINK, MsgId.SET_T1, struct.pack("<BBHIIH", 3, 0, 0, DEVICEID, 1, 190)),
+    ],
+)
+def test_decode_encode_roundtrip(table, msgId, payload):
+    # Arrange
+    schema = table.get(msgId, len(payload))
+
+    # Act
+    msg = schema.decode(payload)
+
+    # Assert
+    assert msg.deviceid == DEVICEID
+    assert schema.encode(msg) == payload
+
+
+def test_status_room_fields():
+    # Act
+    msg = UPLINK.get(MsgId.STATUS).decode(status_payload())
+
+    # Assert
+    assert len(msg.rooms) == 8
+    room = msg.rooms[0]
+    assert room.connected and room.heating == 1
+    assert (room.mode, room.unk9) == (3, 1)
+    assert (room.sensorinfluence, room.units, room.advance) == (6, 1, 1)
+    assert (room.boost, room.cmdissued, room.winter) == (1, 1, 1)
+    assert (msg.boilerHeating, msg.dhwMode) == (1, 1)
+    assert (msg.tFLO, msg.tdH, msg.tESt, msg.wifisignal) == (2, 4, 5, 70)
+
+
+@pytest.mark.parametrize("numBytes, fmt", [(1, "<B"), (2, "<H"), (4, "<I")])
+def test_set_schema_sizes(numBytes, fmt):
+    # Act
+    payload = setSchema(MsgId.SET_T1, numBytes).encode(
+        SetMsg(cseq=1, flags=0, unk2=0, deviceid=DEVICEID, room=2, value=7)
+    )
+
+    # Assert
+    assert payload == struct.pack("<BBHII", 1, 0, 0, DEVICEID, 2) + struct.pack(fmt, 7)
+
+
+def test_set_schema_rejects_unknown_size():
+    with pytest.raises(ValueError):
+        setSchema(MsgId.SET_T1, 3)
@@ -0,0 +1,154 @@
+import threading
+import time
+
+from correlation import MAX_CSEQ, CSeqTable
+from timerwheel import TimerWheel
+
+
+def test_concurrent_allocations_never_collide():
+    # Arrange
+    table = CSeqTable(TimerWheel(tick=0.01))
+    allocated = []
+    lock = threading.Lock()
+
+    def allocate():
+        for _ in range(25):
+            cseq = table.allocate(wait=5)
+            with lock:
+                allocated.append(cseq)
+
+    threads = [threading.Thread(target=allocate) for _ in range(8)]
+
+    # Act
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Assert
+    assert len(allocated) == 200
+    assert len(set(allocated)) == 200
+    assert all(0 <= cseq <= MAX_CSEQ for cseq in allocated)
+    assert table.asdict()["in_flight"] == 200
+
+
+def test_answer_before_wait_and_late_answer():
+    # Arrange
+    table = CSeqTable(TimerWheel(tick=0.01))
+    answered = table.allocate(wait=1)
+    lost = table.allocate(wait=0.05)
+
+    # Act
+    table.signal(answered, 21)
+    value = table.wait(answered)
+    t = time.monotonic()
+    timedOut = table.wait(lost)
+    elapsed = time.monotonic() - t
+    table.signal(lost, 22)
+    table.signal(0x42, 1)
+
+    # Assert
+    assert value == 21
+    assert timedOut is None
+    assert 0.03 < elapsed < 0.5
+    stats = table.asdict()
+    assert stats["in_flight"] == 0
+    assert stats["completed"] == 1
+    assert stats["timed_out"] == 1
+    assert stats["late"] == 1
+    assert stats["unmatched"] == 1
+    assert table.done == {}
+
+
+def test_timer_wheel_fires_in_order_and_skips_cancelled():
+    # Arrange
+    wheel = TimerWheel(tick=0.01, slots=8)
+    fired = []
+    done = threading.Event()
+
+    # Act
+    # Longer than a turn of the wheel
+    wheel.schedule(0.15, fired.append, "late")
+    wheel.schedule(0.02, fired.append, "early")
+    wheel.schedule(0.05, fired.append, "cancelled").cancel()
+    wheel.schedule(0.2, done.set)
+    done.wait(2)
+
+    # Assert
+    assert fired == ["early", "late"]
+    assert wheel.count == 0
+
+
+def test_lost_request_is_retransmitted_with_the_same_cseq():
+    # Arrange
+    table = CSeqTable(TimerWheel(tick=0.01), retries=2)
+    sent = []
+
+    def send(cseq):
+        sent.append(cseq)
+        if len(sent) == 2:
+            # The first copy was lost, this one is answered
+            table.signal(cseq, 42)
+
+    cseq = table.allocate(wait=0.05)
+    table.setResend(cseq, send, cseq)
+
+    # Act
+    send(cseq)
+    value = table.wait(cseq)
+
+    # Assert
+    assert value == 42
+    assert sent == [cseq, cseq]
+    stats = table.asdict()
+    assert stats["retransmits"] == 1
+    assert stats["timed_out"] == 0
+    # Karn: no RTT sample from a retransmitted request
+    assert table.rtt.samples == 0
+
+
+def test_timeout_adapts_to_the_round_trip_time():
+    # Arrange
+    table = CSeqTable(TimerWheel(tick=0.01), retries=1)
+
+    # Act
+    for _ in range(10):
+        cseq = table.allocate(wait=1)
+        time.sleep(0.01)
+        table.signal(cseq, 0)
+        table.wait(cseq)
+    sent = []
+    cseq = table.allocate(wait=1)
+    table.setResend(cseq, sent.append, cseq)
+    t = time.monotonic()
+    value = table.wait(cseq)
+    elapsed = time.monotonic() - t
+
+    # Assert
+    assert table.rtt.samples == 10
+    assert 0.01 <= table.rtt.srtt < 0.1
+    # Both attempts waited less than the initial 1 s
+    assert value is None
+    assert sent == [cseq]
+    assert elapsed < 1.0
+    assert table.asdict()["timed_out"] == 1
+
+
+def test_retransmissions_stay_within_the_callers_wait():
+    # Arrange
+    table = CSeqTable(TimerWheel(tick=0.01), retries=3)
+    sent = []
+    cseq = table.allocate(wait=0.4)
+    table.setResend(cseq, sent.append, cseq)
+
+    # Act
+    t = time.monotonic()
+    value = table.wait(cseq)
+    elapsed = time.monotonic() - t
+
+    # Assert
+    # A dead device: retransmitted, and given up once the wait is over
+    assert value is None
+    assert sent
+    assert 0.3 <= elapsed < 0.6
+    assert table.asdict()["timed_out"] == 1
@@ -0,0 +1,53 @@
+import threading
+
+from database import Database
+
+
+def test_short_lived_threads_reuse_the_same_connection(tmp_path):
+    # Arrange
+    database = Database()
+    database.name = str(tmp_path / "pool.db")
+    database.check_migrations()
+    opened = database.opened
+    used = []
+
+    def request():
+        # As a Flask request on its own thread
+        conn = database.get_connection()
+        used.append(conn.getConn())
+        conn.run_sql("select count(*) as n from besim_outside_temperature")
+        conn.close(commit=True)
+        database.log_outside_temperature(5.0)
+
+    # Act
+    for _ in range(2):
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+
+    # Assert
+    assert database.opened == opened
+    assert used[0] is used[1]
+    assert len(database.get_outside_temperature()) == 2
+
+
+def test_pooled_connection_is_handed_out_once_and_rolled_back(tmp_path):
+    # Arrange
+    database = Database()
+    database.name = str(tmp_path / "pool.db")
+    database.check_migrations()
+    conn = database.get_connection()
+    sql = "insert into besim_outside_temperature(ts, temp) values (?,?)"
+
+    # Act
+    other = database.get_connection()
+    conn.run_sql(sql, ("2024-01-01T00:00:00", 5.0), commit=False)
+    conn.close()
+    reused = database.get_connection()
+
+    # Assert
+    assert other is not conn
+    assert reused is conn
+    assert reused.run_sql("select count(*) as n from besim_outside_temperature") == [
+        {"n": 0}
+    ]
@@ -0,0 +1,34 @@
+import pytest
+
+from database import Database
+
+
+def test_performance_profile_is_applied_to_new_connections(tmp_path):
+    # Arrange
+    database = Database()
+    database.name = str(tmp_path / "profile.db")
+
+    # Act
+    database.configure("performance", {"cache_size": "-4096"})
+    database.check_migrations()
+    settings = database.get_settings()
+    database.configure()
+
+    # Assert
+    assert settings == {
+        "journal_mode": "wal",
+        "synchronous": 1,
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -4096,
+        "temp_store": 2,
+        "busy_timeout": 5000,
+    }
+
+
+def test_unknown_profile_is_rejected():
+    # Arrange
+    database = Database()
+
+    # Act / Assert
+    with pytest.raises(ValueError):
+        database.configure("fastest")
@@ -0,0 +1,43 @@
+from database import Database
+
+
+def test_run_sql_without_commit_leaves_the_transaction_open(tmp_path):
+    # Arrange
+    database = Database()
+    database.name = str(tmp_path / "tx.db")
+    database.check_migrations()
+    conn = database.get_connection()
+    sql = "insert into besim_temperature(ts, thermostat, temp, settemp, heating) values (?,?,?,?,?)"
+
+    # Act
+    conn.run_sql(sql, ("2024-01-01T00:00:00", 1, 20.0, 21.0, 0), commit=False)
+    uncommitted = conn.run_sql(
+        "select count(*) as n from besim_temperature", commit=False
+    )
+    conn.rollback()
+
+    # Assert
+    assert uncommitted[0]["n"] == 1
+    assert conn.run_sql("select count(*) as n from besim_temperature")[0]["n"] == 0
+
+
+def test_log_temperatures_is_one_transaction(tmp_path):
+    # Arrange
+    database = Database()
+    database.name = str(tmp_path / "tx.db")
+    database.check_migrations()
+    conn = database.get_connection()
+    rows = [(f"2024-01-01T00:00:0{n}", n, 20.0 + n, 21.0, n % 2) for n in range(8)]
+
+    # Act
+    database.log_temperatures(rows, conn=conn, commit=False)
+    # Another connection doesn't see them until the commit
+    before = database.get_temperature(3, "2024-01-01", "2024-01-02")
+    conn.commit()
+    logged = database.get_temperature(3, "2024-01-01", "2024-01-02")
+
+    # Assert
+    assert before == []
+    assert logged == [
+        {"ts": "2024-01-01T00:00:03", "temp": 23.0, "settemp": 21.0, "heating": 1}
+    ]
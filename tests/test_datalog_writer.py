@@ -0,0 +1,56 @@
+from datalog import DatalogWriter
+
+
+def test_records_are_written_in_order(tmp_path):
+    # Arrange
+    path = tmp_path / "udp.csv"
+    writer = DatalogWriter(open(path, "at"), fsyncInterval=60, fsyncBytes=1 << 20)
+    writer.start()
+
+    # Act
+    for n in range(100):
+        writer.record("I", ("1.2.3.4", 6199), bytes([n]))
+    writer.write('"O","x","00"\r\n')
+    writer.close()
+
+    # Assert
+    lines = path.read_text().splitlines()
+    assert len(lines) == 101
+    assert lines[0] == '"I","(\'1.2.3.4\', 6199)","00"'
+    assert lines[99] == '"I","(\'1.2.3.4\', 6199)","63"'
+    assert lines[100] == '"O","x","00"'
+    stats = writer.getStats()
+    assert stats["written"] == 101 and stats["dropped"] == 0
+    assert stats["fsyncs"] >= 1
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    # Arrange: writer not started, nothing drains the queue
+    path = tmp_path / "udp.csv"
+    writer = DatalogWriter(open(path, "at"), maxQueue=2)
+
+    # Act
+    results = [writer.record("I", "addr", b"\x01") for _ in range(5)]
+    writer.close()
+
+    # Assert
+    assert results == [True, True, False, False, False]
+    assert writer.getStats()["dropped"] == 3
+    assert len(path.read_text().splitlines()) == 2
+
+
+def test_fsync_on_byte_threshold(tmp_path):
+    # Arrange
+    writer = DatalogWriter(
+        open(tmp_path / "udp.csv", "at"), fsyncInterval=60, fsyncBytes=10
+    )
+
+    # Act
+    writer.lastFsync += 60  # interval not elapsed
+    writer.commit(["12345\r\n"])
+    small = writer.fsyncs
+    writer.commit(["1234567890\r\n"])
+
+    # Assert
+    assert small == 0
+    assert writer.fsyncs == 1
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+from dispatcher import DeviceDispatcher
+
+
+@pytest.mark.parametrize("workers", [1, 2, 8])
+def test_dispatch_keeps_order_per_device(workers):
+    # Arrange
+    handled = {}
+    lock = threading.Lock()
+
+    def handler(key, n):
+        with lock:
+            handled.setdefault(key, []).append(n)
+
+    dispatcher = DeviceDispatcher(handler, workers=workers)
+
+    # Act
+    for n in range(50):
+        for key in ("a", "b", "c"):
+            dispatcher.dispatch(key, key, n)
+    dispatcher.shutdown(wait=True)
+
+    # Assert
+    assert handled == {key: list(range(50)) for key in ("a", "b", "c")}
+    stats = dispatcher.getStats()
+    assert stats["a"]["processed"] == 50
+    assert stats["a"]["depth"] == 0
+
+
+def test_slow_device_does_not_block_others():
+    # Arrange
+    release = threading.Event()
+    done = threading.Event()
+
+    def handler(key):
+        if key == "slow":
+            release.wait(5)
+        else:
+            done.set()
+
+    dispatcher = DeviceDispatcher(handler, workers=2)
+
+    # Act
+    dispatcher.dispatch("slow", "slow")
+    dispatcher.dispatch("slow", "slow")
+    time.sleep(0.05)
+    dispatcher.dispatch("fast", "fast")
+
+    # Assert
+    assert done.wait(1)
+    assert dispatcher.getStats()["slow"]["depth"] >= 1
+    release.set()
+    dispatcher.shutdown(wait=True)
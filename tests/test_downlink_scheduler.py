@@ -0,0 +1,131 @@
+import threading
+import time
+
+from downlink import PRIORITY_BACKGROUND, PRIORITY_USER, DownlinkScheduler
+
+
+def test_user_commands_go_ahead_of_background_ones():
+    # Arrange
+    scheduler = DownlinkScheduler(gap=0.02)
+    release = threading.Event()
+    sent = []
+
+    def send(name):
+        sent.append(name)
+
+    # Act
+    # Holds the device while the queue fills up
+    first = scheduler.submit(1, PRIORITY_BACKGROUND, release.wait, 5)
+    for room in range(3):
+        scheduler.submit(1, PRIORITY_BACKGROUND, send, f"GET_PROG {room}")
+    user = scheduler.submit(1, PRIORITY_USER, send, "SET")
+    release.set()
+    user.result(5)
+    first.result(5)
+    scheduler.shutdown(wait=True)
+
+    # Assert
+    assert sent[0] == "SET"
+
+
+def test_commands_of_a_device_are_paced():
+    # Arrange
+    gap = 0.05
+    scheduler = DownlinkScheduler(gap=gap)
+    started = {1: [], 2: []}
+
+    # Act
+    futures = [
+        scheduler.submit(
+            key, PRIORITY_BACKGROUND, lambda k=key: started[k].append(time.monotonic())
+        )
+        for _ in range(4)
+        for key in (1, 2)
+    ]
+    for future in futures:
+        future.result(5)
+    scheduler.shutdown(wait=True)
+
+    # Assert
+    for key in (1, 2):
+        gaps = [b - a for a, b in zip(started[key], started[key][1:])]
+        assert len(gaps) == 3
+        assert min(gaps) >= gap * 0.9
+    # Devices are paced independently
+    assert abs(started[1][0] - started[2][0]) < gap
+
+
+def test_same_tag_is_coalesced_and_submit_does_not_block():
+    # Arrange
+    scheduler = DownlinkScheduler(gap=10)
+    running = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        running.set()
+        release.wait(5)
+
+    scheduler.submit(1, PRIORITY_USER, hold)
+    running.wait(5)
+
+    # Act
+    t = time.monotonic()
+    a = scheduler.submit(1, PRIORITY_BACKGROUND, lambda: "prog", tag=("GET_PROG", 1))
+    b = scheduler.submit(1, PRIORITY_BACKGROUND, lambda: "prog", tag=("GET_PROG", 1))
+    elapsed = time.monotonic() - t
+    stats = scheduler.getStats()
+    release.set()
+    scheduler.shutdown(wait=True)
+
+    # Assert
+    assert a is b
+    assert elapsed < 0.5
+    assert stats["coalesced"] == 1
+    assert [c["name"] for c in stats["devices"]["1"]["queued"]] == ["<lambda>"]
+    assert stats["devices"]["1"]["running"]["name"] == "hold"
+    assert a.cancelled()
+
+
+def test_replace_runs_the_latest_command_of_a_tag():
+    # Arrange
+    scheduler = DownlinkScheduler(gap=0)
+    running = threading.Event()
+    release = threading.Event()
+    sent = []
+
+    def hold():
+        running.set()
+        release.wait(5)
+
+    scheduler.submit(1, PRIORITY_USER, hold)
+    running.wait(5)
+
+    # Act
+    a = scheduler.submit(1, PRIORITY_USER, sent.append, 200, tag="t3", replace=True)
+    b = scheduler.submit(1, PRIORITY_USER, sent.append, 215, tag="t3", replace=True)
+    release.set()
+    b.result(5)
+    scheduler.shutdown(wait=True)
+
+    # Assert
+    assert a is b
+    assert sent == [215]
+
+
+def test_silent_devices_do_not_hold_the_others():
+    # Arrange
+    scheduler = DownlinkScheduler(gap=0)
+    release = threading.Event()
+    for key in range(8):
+        scheduler.submit(key, PRIORITY_USER, release.wait, 5)
+
+    # Act
+    other = scheduler.submit(99, PRIORITY_USER, lambda: "OK")
+    result = other.result(2)
+    devices = scheduler.getStats()["devices"]
+    release.set()
+    scheduler.shutdown(wait=True)
+
+    # Assert
+    assert result == "OK"
+    assert all(devices[str(key)]["running"] for key in range(8))
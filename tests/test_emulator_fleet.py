@@ -0,0 +1,56 @@
+import asyncio
+import socket
+import time
+
+import udpserver
+from codec import MsgId
+from database import Database
+from emulator import Fleet
+from status import getDeviceStatus, getRoomStatus
+from udpserver import UdpServer
+
+
+def test_fleet_against_udpserver(tmp_path, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(udpserver, "GET_PROG_INTERVAL", 0)
+    database = Database()
+    database.name = str(tmp_path / "fleet.db")
+    database.check_migrations()
+    server = UdpServer(("127.0.0.1", 0))
+    server.daemon = True
+    server.start()
+    while getattr(server, "sock", None) is None or server.sock.getsockname()[1] == 0:
+        time.sleep(0.01)
+    target = server.sock.getsockname()
+
+    def setter(device, room):
+        value = room["t3"] + 1
+        rc = server.send_SET(
+            getDeviceStatus(device.deviceid)["addr"],
+            getDeviceStatus(device.deviceid),
+            device.deviceid,
+            room["room"],
+            MsgId.SET_T3,
+            value,
+            write=1,
+            wait=1,
+        )
+        return rc == value
+
+    fleet = Fleet(
+        target, 5, timeScale=80, jitter=(0.001, 0.005), baseDeviceId=4200, seed=1
+    )
+
+    # Act
+    stats = asyncio.run(fleet.run(2.0, setter, setInterval=0.5))
+    server.stop = True
+    socket.socket(type=socket.SOCK_DGRAM).sendto(b"", target)
+
+    # Assert
+    report = stats.asdict()
+    assert report["status_sent"] >= 10
+    assert report["status_acked"] == report["status_sent"]
+    assert report["received"]["GET_PROG"] == 5 * 8
+    assert report["set_count"] >= 1 and report["set_failed"] == 0
+    room = fleet.devices[0].rooms[0]
+    assert len(getRoomStatus(4200, room["room"])["days"]) == 7
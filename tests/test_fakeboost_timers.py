@@ -0,0 +1,58 @@
+import threading
+import time
+
+from database import Database
+from fakeboost import BoostTimers
+from timerwheel import TimerWheel
+
+
+def test_rearmed_boost_expires_once_at_the_last_deadline():
+    # Arrange
+    wheel = TimerWheel(tick=0.01)
+    expired = []
+    done = threading.Event()
+
+    def expire(deviceid, room):
+        expired.append((deviceid, room, time.time()))
+        done.set()
+
+    boosts = BoostTimers(expire, wheel=wheel)
+
+    # Act
+    boosts.arm(1, 8, time.time() + 0.05)
+    deadline = time.time() + 0.2
+    boosts.arm(1, 8, deadline)
+    pending = boosts.getStats()["pending"]
+    done.wait(5)
+    time.sleep(0.1)
+    wheel.shutdown()
+
+    # Assert
+    assert [(t["deviceid"], t["room"]) for t in pending] == [(1, 8)]
+    assert [(d, r) for d, r, _ in expired] == [(1, 8)]
+    assert expired[0][2] >= deadline - 0.01
+    assert boosts.getStats()["pending"] == []
+
+
+def test_deadlines_survive_a_restart(tmp_path):
+    # Arrange
+    database = Database()
+    database.name = str(tmp_path / "boost.db")
+    database.check_migrations()
+    wheel = TimerWheel(tick=0.01)
+    deadline = time.time() + 1800
+    BoostTimers(lambda *_: None, database, wheel).arm(1, 8, deadline)
+    BoostTimers(lambda *_: None, database, wheel).arm(1, 9, deadline)
+
+    # Act
+    restarted = BoostTimers(lambda *_: None, database, wheel)
+    restored = restarted.restore()
+    restarted.cancel(1, 9)
+    wheel.shutdown()
+
+    # Assert
+    assert restored == 2
+    assert restarted.deadline(1, 8) == deadline
+    assert database.get_fakeboosts() == [
+        {"deviceid": 1, "room": 8, "deadline": deadline}
+    ]
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+from crccheck.crc import Crc16Xmodem
+from udpserver import Frame, crc16_xmodem
+
+
+@pytest.mark.parametrize("size", [0, 1, 12, 248, 1024])
+def test_crc16_xmodem_matches_crccheck(size):
+    # Arrange
+    data = os.urandom(size)
+
+    # Act / Assert
+    assert crc16_xmodem(data) == Crc16Xmodem.calc(data)
+    assert crc16_xmodem(memoryview(data)) == Crc16Xmodem.calc(data)
+
+
+def test_frame_roundtrip_is_zero_copy():
+    # Arrange
+    payload = os.urandom(40)
+    data = bytes(Frame(payload=payload).encode(seq=7))
+
+    # Act
+    frame = Frame()
+    decoded = frame.decode(data)
+
+    # Assert
+    assert isinstance(decoded, memoryview)
+    assert decoded.obj is data
+    assert bytes(decoded) == payload
+    assert frame.seq == 7
+
+
+@pytest.mark.parametrize(
+    "mangle",
+    [
+        lambda d: d[:5],
+        lambda d: d[:-1],
+        lambda d: b"\x00" + d[1:],
+        lambda d: d[:10] + bytes([d[10] ^ 0xFF]) + d[11:],
+        lambda d: d[:-1] + b"\x00",
+    ],
+)
+def test_frame_rejects_invalid(mangle):
+    # Arrange
+    data = bytes(Frame(payload=b"\x01\x02\x03\x04").encode())
+
+    # Act / Assert
+    assert Frame().decode(mangle(data)) is None
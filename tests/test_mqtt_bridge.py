@@ -0,0 +1,98 @@
+import json
+import time
+
+from changefeed import ChangeFeed
+from mqttbridge import MqttBridge
+from status import getRoomStatus, update
+
+DEVICEID = 596505261
+
+
+def setRoom(room, temp, settemp=210, heating=0):
+    with update(room):
+        room.temp = temp
+        room.settemp = settemp
+        room.t1, room.t2, room.t3 = 150, 180, settemp
+        room.mode = 0
+        room.heating = heating
+        room.lastseen = int(time.time())
+
+
+def wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def start(broker, **kwargs):
+    client = broker.client()
+    bridge = MqttBridge(client, window=0.05, **kwargs)
+    client.connect()
+    bridge.start()
+    return bridge
+
+
+def test_rooms_are_announced_and_changes_coalesced(broker):
+    # Arrange
+    room = getRoomStatus(DEVICEID, 1)
+    setRoom(room, 200)
+    bridge = start(broker)
+    state = f"besim/{DEVICEID}/1/state"
+    config = f"homeassistant/climate/besim_{DEVICEID}_1/config"
+    assert wait(lambda: state in broker.retained)
+    published = len([t for t, _, _ in broker.log if t == state])
+
+    # Act
+    # A burst: one message with the last value
+    for temp in (201, 202, 203):
+        setRoom(room, temp)
+    assert wait(
+        lambda: json.loads(broker.retained[state])["current_temperature"] == 20.3
+    )
+    # A STATUS with the same values publishes nothing
+    setRoom(room, 203)
+    time.sleep(0.2)
+    bridge.shutdown()
+
+    # Assert
+    assert json.loads(broker.retained[config])["current_temperature_topic"] == state
+    assert len([t for t, _, _ in broker.log if t == config]) == 1
+    assert len([t for t, _, _ in broker.log if t == state]) == published + 1
+    assert all(retain for _, _, retain in broker.log)
+
+
+def test_broker_outage_is_absorbed_by_the_outbox(broker):
+    # Arrange
+    rooms = [getRoomStatus(DEVICEID + 1, r) for r in range(4)]
+    for room in rooms:
+        setRoom(room, 200)
+    bridge = start(broker, maxQueue=3, changes=ChangeFeed())
+    # a private feed: publish the rooms to it by hand
+    bridge.feed.append(1, DEVICEID + 1, 0, {})
+    assert wait(lambda: bridge.getStats()["entities"] >= 4)
+
+    # Act
+    broker.outage()
+    started = time.monotonic()
+    for version, room in enumerate(rooms, 2):
+        setRoom(room, 250)
+        bridge.feed.append(version, DEVICEID + 1, room.room, {"temp": 250})
+    elapsed = time.monotonic() - started
+    assert wait(lambda: bridge.getStats()["queued"] == 3)
+    stats = bridge.getStats()
+    broker.restore()
+    topics = [f"besim/{DEVICEID + 1}/{r}/state" for r in range(4)]
+    assert wait(
+        lambda: all(
+            json.loads(broker.retained[t])["current_temperature"] == 25.0
+            for t in topics
+        )
+    )
+    bridge.shutdown()
+
+    # Assert
+    assert elapsed < 0.1  # the writers never waited for the broker
+    assert stats["dropped"] >= 1 and not stats["connected"]
+    # After the reconnect every room was published again
+    assert bridge.getStats()["queued"] == 0
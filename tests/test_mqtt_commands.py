@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+
+from codec import MsgId
+from downlink import DownlinkScheduler
+from mqttbridge import MqttBridge
+from status import getDeviceStatus, getRoomStatus, getStatus, update
+
+DEVICEID = 596505270
+ADDR = ("192.168.0.106", 6199)
+
+
+class Server:
+    # The UdpServer downlinks, the device acks once `gate` is set
+    def __init__(self, rejected=()) -> None:
+        self.downlink = DownlinkScheduler(gap=0)
+        self.gate = threading.Event()
+        self.rejected = rejected
+        self.sent: list[tuple] = []
+
+    def schedule(
+        self, deviceid, fn, *args, priority=0, tag=None, replace=False, **kwargs
+    ):
+        return self.downlink.submit(
+            deviceid, priority, fn, *args, tag=tag, replace=replace, **kwargs
+        )
+
+    def send_SET(self, addr, device, deviceid, room, msgType, value, **kwargs):
+        self.gate.wait(5)
+        self.sent.append((room, msgType, value))
+        return value + 1 if msgType in self.rejected else value
+
+    def send_FAKE_BOOST(self, addr, device, deviceid, room, val):
+        self.sent.append((room, "boost", val))
+        return val
+
+
+def setup(broker, deviceid, server):
+    getDeviceStatus(deviceid)["addr"] = ADDR
+    room = getRoomStatus(deviceid, 1)
+    with update(room):
+        room.temp, room.settemp = 200, 200
+        room.t1, room.t2, room.t3 = 150, 180, 200
+        room.mode, room.heating = 0, 0
+    client = broker.client()
+    bridge = MqttBridge(client, window=0.01, server=server)
+    client.connect()
+    bridge.start()
+    ha = broker.client()
+    ha.connect()
+    return bridge, room, ha
+
+
+def state(broker, deviceid):
+    return json.loads(broker.retained[f"besim/{deviceid}/1/state"])
+
+
+def wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_slider_sends_the_last_value_and_confirms_it(broker):
+    # Arrange
+    server = Server()
+    bridge, room, ha = setup(broker, DEVICEID, server)
+    topic = f"besim/{DEVICEID}/1/set/temperature"
+    assert wait(lambda: f"besim/{DEVICEID}/1/state" in broker.retained)
+
+    # Act
+    # The first SET is on its way, the others wait in the queue
+    ha.publish(topic, "20.5", qos=1)
+    devices = server.downlink.getStats
+    assert wait(lambda: devices()["devices"][str(DEVICEID)]["running"] is not None)
+    for value in ("21.0", "21.0", "21.5", "22.0"):
+        ha.publish(topic, value, qos=1)
+    optimistic = state(broker, DEVICEID)["temperature"]
+    server.gate.set()
+    assert wait(lambda: bridge.getStats()["commands"]["confirmed"] == 1)
+    bridge.shutdown()
+
+    # Assert
+    assert optimistic == 22.0
+    assert server.sent == [(1, MsgId.SET_T3, 205), (1, MsgId.SET_T3, 220)]
+    assert room["t3"] == 220
+    assert state(broker, DEVICEID)["temperature"] == 22.0
+    stats = bridge.getStats()["commands"]
+    assert stats["received"] == 4 and stats["deduped"] == 1
+    assert stats["latency"]["count"] == 1
+    assert stats["latency"]["le_ms"]["+Inf"] == 1
+
+
+def test_rejected_command_is_rolled_back(broker):
+    # Arrange
+    server = Server(rejected={MsgId.SET_MODE})
+    server.gate.set()
+    bridge, room, ha = setup(broker, DEVICEID + 1, server)
+    assert wait(lambda: f"besim/{DEVICEID + 1}/1/state" in broker.retained)
+
+    # Act
+    ha.publish(f"besim/{DEVICEID + 1}/1/set/mode", "off", qos=1)
+    assert wait(lambda: bridge.getStats()["commands"]["rolled_back"] == 1)
+    bridge.shutdown()
+
+    # Assert
+    modes = [
+        json.loads(payload)["mode"]
+        for topic, payload, _ in broker.log
+        if topic == f"besim/{DEVICEID + 1}/1/state"
+    ]
+    assert modes[-2:] == ["off", "auto"]
+    assert room["mode"] == 0
+
+
+def test_command_to_an_unknown_device_is_dropped(broker):
+    # Arrange
+    server = Server()
+    server.gate.set()
+    bridge, _, ha = setup(broker, DEVICEID + 2, server)
+    assert wait(lambda: f"besim/{DEVICEID + 2}/1/state" in broker.retained)
+
+    # Act
+    ha.publish(f"besim/{DEVICEID + 3}/1/set/temperature", "21.0", qos=1)
+    ha.publish(f"besim/{DEVICEID + 2}/9/set/temperature", "21.0", qos=1)
+    assert wait(lambda: bridge.getStats()["commands"]["unknown"] == 2)
+    bridge.shutdown()
+
+    # Assert
+    assert DEVICEID + 3 not in getStatus()["devices"]
+    assert 9 not in getStatus()["devices"][DEVICEID + 2].rooms
+    assert server.sent == []
+    assert bridge.getStats()["commands"]["received"] == 0
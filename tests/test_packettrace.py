@@ -0,0 +1,74 @@
+import logging
+
+from codec import MsgId
+from packettrace import PacketTracer
+from restapi import app
+
+
+class Dump:
+    formatted = 0
+
+    def __len__(self):
+        return 1
+
+    def __str__(self):
+        Dump.formatted += 1
+        return "dump"
+
+
+def test_packet_formats_only_when_selected(caplog):
+    # Arrange
+    tracer = PacketTracer(logging.getLogger("test.packettrace"))
+    Dump.formatted = 0
+    caplog.set_level(logging.INFO, logger="test.packettrace")
+
+    # Act
+    tracer.packet("From", ("1.2.3.4", 6199), b"\x00", 1, MsgId.PING)
+    tracer.packet("From", ("1.2.3.4", 6199), Dump(), 1, MsgId.PING)
+    formatted = Dump.formatted
+    tracer.configure(deviceids=[2])
+    tracer.packet("From", ("1.2.3.4", 6199), b"\x00", 1, MsgId.PING)
+    tracer.packet("From", ("1.2.3.4", 6199), b"\x00", 2, MsgId.PING)
+    tracer.add(msgType=MsgId.STATUS)
+    tracer.remove(deviceid=2)
+    if tracer.enabled(1, MsgId.STATUS):
+        tracer.log("%s", Dump())
+    if tracer.enabled(1, MsgId.PING):
+        tracer.log("%s", Dump())
+
+    # Assert
+    assert [r.getMessage() for r in caplog.records] == [
+        "From ('1.2.3.4', 6199) 1 bytes : 00",
+        "dump",
+    ]
+    assert formatted == 0
+    assert tracer.asdict()["msgids"] == ["STATUS"]
+
+
+def test_packet_skipped_when_level_filtered(caplog):
+    # Arrange
+    tracer = PacketTracer(logging.getLogger("test.packettrace.filtered"))
+    tracer.configure(all=True)
+    caplog.set_level(logging.WARNING, logger="test.packettrace.filtered")
+
+    # Act / Assert
+    assert not tracer.active
+    assert not tracer.enabled(1, MsgId.PING)
+
+
+def test_trace_rest_api():
+    # Arrange
+    client = app.test_client()
+
+    # Act
+    client.put("/api/v1.0/udp/trace/devices/596505258")
+    client.put("/api/v1.0/udp/trace/msgids/0x24")
+    response = client.get("/api/v1.0/udp/trace")
+    unknown = client.put("/api/v1.0/udp/trace/msgids/NOPE")
+    client.put("/api/v1.0/udp/trace", json={"deviceids": [], "msgids": []})
+
+    # Assert
+    assert response.json["deviceids"] == [596505258]
+    assert response.json["msgids"] == ["STATUS"]
+    assert unknown.status_code == 404
+    assert client.get("/api/v1.0/udp/trace").json["deviceids"] == []
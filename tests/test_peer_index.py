@@ -0,0 +1,66 @@
+import status
+from status import (
+    expirePeers,
+    getPeerFromDeviceId,
+    getPeerStatus,
+    getStatus,
+    getVersion,
+    setPeerDevice,
+)
+
+OLD = ("192.168.0.105", 6199)
+NEW = ("192.168.0.105", 6200)
+
+
+def test_device_follows_its_peer():
+    # Arrange
+    deviceid = 1001
+
+    # Act
+    setPeerDevice(OLD, deviceid)
+    before = getPeerFromDeviceId(deviceid)
+    # The NAT mapping of the box changed
+    setPeerDevice(NEW, deviceid)
+
+    # Assert
+    assert before == OLD
+    assert getPeerFromDeviceId(deviceid) == NEW
+    assert OLD not in getStatus()["peers"]
+    assert getPeerStatus(NEW).devices == {deviceid}
+    assert getPeerFromDeviceId(1002) is None
+
+
+def test_stale_peers_expire():
+    # Arrange
+    stale, live = ("10.0.0.1", 6199), ("10.0.0.2", 6199)
+    setPeerDevice(stale, 2001)
+    setPeerDevice(live, 2002)
+    getPeerStatus(stale).lastseen -= 1000
+
+    before = getVersion()
+
+    # Act
+    expired = expirePeers(maxAge=600)
+
+    # Assert
+    assert getVersion() > before
+    assert stale in expired and live not in expired
+    assert getPeerFromDeviceId(2001) is None
+    assert getPeerFromDeviceId(2002) == live
+
+
+def test_new_peers_sweep_the_stale_ones(monkeypatch):
+    # Arrange
+    for port in range(100):
+        setPeerDevice(("10.0.1.1", port), 3000 + port)
+        getPeerStatus(("10.0.1.1", port)).lastseen -= 2 * status.PEER_EXPIRY
+    monkeypatch.setattr(status, "lastSweep", 0.0)
+
+    # Act
+    getPeerStatus(("10.0.1.1", 1000))
+
+    # Assert
+    assert not any(
+        addr[0] == "10.0.1.1" and addr[1] < 100 for addr in getStatus()["peers"]
+    )
+    assert getPeerFromDeviceId(3000) is None
@@ -0,0 +1,59 @@
+import os
+import struct
+
+from capture import CaptureFile
+from database import Database
+from replay import ReplayStats, ReplayUdpServer, StubSocket, loadDatalog, replay
+from udpserver import Frame
+
+ADDR = ("192.168.0.105", 6199)
+DEVICEID = 596505258
+
+
+def frame(msgType, body):
+    payload = struct.pack("<BBH", msgType, 0x04, len(body) - 8) + body
+    return bytes(Frame(payload=payload).encode(seq=1))
+
+
+def test_replay_csv_datalog(tmp_path):
+    # Arrange
+    database = Database()
+    database.name = str(tmp_path / "replay.db")
+    database.check_migrations()
+    ping = frame(0x22, struct.pack("<BBHIH", 0xFF, 2, 4, DEVICEID, 1))
+    path = tmp_path / "udp.csv"
+    path.write_text(
+        f'"I","{ADDR}","{ping.hex().upper()}"\r\n'
+        f'"O","{ADDR}","{ping.hex().upper()}"\r\n' + f'"I","{ADDR}","00"\r\n' * 2
+    )
+    server = ReplayUdpServer(("", 0))
+    server.sock = StubSocket()
+
+    # Act
+    stats = replay(server, loadDatalog(str(path)), stats=ReplayStats())
+
+    # Assert
+    report = stats.asdict()
+    assert report["messages"] == 3
+    assert report["skipped"] == 1
+    assert report["msgids"]["PING"]["count"] == 1
+    assert report["msgids"]["INVALID"]["count"] == 2
+    assert server.sock.sent == 1
+
+
+def test_capture_with_rotated_segments_only(tmp_path):
+    # Arrange
+    path = str(tmp_path / "udp.bin")
+    capture = CaptureFile(path, rotateBytes=100, compress=False)
+    capture.write([(1000.0 + n, "I", ADDR, bytes([n]) * 20) for n in range(10)])
+    capture.rotate()
+    capture.close()
+    os.remove(path)
+    os.remove(path + ".idx")
+
+    # Act
+    records = list(loadDatalog(path))
+
+    # Assert
+    assert [r[0] for r in records] == [1000.0 + n for n in range(10)]
+    assert records[0][1:3] == ("I", ADDR)
@@ -0,0 +1,84 @@
+from restapi import app
+from status import getDeviceStatus, getRoomStatus, setPeerDevice, update
+
+DEVICEID = 596505259
+
+
+def test_unchanged_room_is_not_modified():
+    # Arrange
+    app.config["TESTING"] = True
+    client = app.test_client()
+    room = getRoomStatus(DEVICEID, 1)
+    room["temp"] = 200
+    url = f"/api/v1.0/devices/{DEVICEID}/rooms/1"
+
+    # Act
+    first = client.get(url)
+    again = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    with update(room):
+        room.temp = 210
+    changed = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+
+    # Assert
+    assert first.status_code == 200 and first.json["temp"] == 200
+    assert again.status_code == 304 and again.data == b""
+    assert again.headers["ETag"] == first.headers["ETag"]
+    assert changed.status_code == 200 and changed.json["temp"] == 210
+    assert changed.headers["ETag"] != first.headers["ETag"]
+
+
+def test_device_and_param_etags():
+    # Arrange
+    app.config["TESTING"] = True
+    client = app.test_client()
+    room = getRoomStatus(DEVICEID, 2)
+    room["t3"] = 215
+    device = f"/api/v1.0/devices/{DEVICEID}"
+    t3 = f"/api/v1.0/devices/{DEVICEID}/rooms/2/t3"
+
+    # Act
+    etags = {url: client.get(url).headers["ETag"] for url in (device, t3)}
+    unchanged = {
+        url: client.get(url, headers={"If-None-Match": etag}).status_code
+        for url, etag in etags.items()
+    }
+    # A new cseq changes the device, not the room
+    getRoomStatus(DEVICEID, 2).device.cseq.allocate()
+    after = {
+        url: client.get(url, headers={"If-None-Match": etag}).status_code
+        for url, etag in etags.items()
+    }
+
+    # Assert
+    assert unchanged == {device: 304, t3: 304}
+    assert after == {device: 200, t3: 304}
+    assert client.get(t3).json == 215
+
+
+def test_new_device_and_peer_change_the_etags():
+    # Arrange
+    app.config["TESTING"] = True
+    client = app.test_client()
+    getRoomStatus(DEVICEID, 1)
+    etags = {
+        url: client.get(url).headers["ETag"]
+        for url in ("/api/v1.0/devices", "/api/v1.0/peers")
+    }
+
+    # Act
+    setPeerDevice(("192.0.2.1", 6199), DEVICEID + 1)
+    getDeviceStatus(DEVICEID + 1)
+    devices = client.get(
+        "/api/v1.0/devices", headers={"If-None-Match": etags["/api/v1.0/devices"]}
+    )
+    peers = client.get(
+        "/api/v1.0/peers", headers={"If-None-Match": etags["/api/v1.0/peers"]}
+    )
+
+    # Assert
+    assert devices.status_code == 200
+    assert devices.headers["ETag"] != etags["/api/v1.0/devices"]
+    assert DEVICEID + 1 in devices.json
+    assert peers.status_code == 200
+    assert peers.headers["ETag"] != etags["/api/v1.0/peers"]
+    assert peers.json["192.0.2.1:6199"]["devices"] == [DEVICEID + 1]
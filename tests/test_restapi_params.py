@@ -0,0 +1,129 @@
+import threading
+import time
+
+from codec import DOWNLINK, UPLINK, MsgId, SetMsg
+from database import Database
+from downlink import DownlinkScheduler
+from emulator import encodeUL
+import restapi
+from restapi import app
+from status import getDeviceStatus
+from udpserver import Frame, UdpServer, Wrapper
+
+ADDR = ("192.168.0.105", 6199)
+GAP = 0.1  # --downlink-gap
+DEVICEID = 596505258
+
+
+class DeviceSocket:
+    # Answers the SET downlinks as the device would, from another thread
+    def __init__(self, server: UdpServer, rejected=()) -> None:
+        self.server = server
+        self.rejected = rejected
+        self.sent: list[tuple[int, int, int]] = []
+        self.times: list[float] = []
+
+    def sendto(self, data, addr) -> int:
+        wrapper = Wrapper(from_cloud=True)
+        payload = wrapper.decodeUL(Frame().decode(data))
+        msgType = wrapper.msgType
+        msg = DOWNLINK.get(msgType).decode(payload)
+        self.sent.append((msg.room, msgType, msg.value))
+        self.times.append(time.monotonic())
+        value = msg.value + 1 if msgType in self.rejected else msg.value
+        reply = SetMsg(msg.cseq, 0x0, 0x1, msg.deviceid, msg.room, value)
+        frame = encodeUL(
+            msgType, UPLINK.get(msgType).encode(reply), response=1, write=1, seq=1
+        )
+        threading.Thread(target=self.server.handleMsg, args=(frame, addr)).start()
+        return len(data)
+
+
+def setup(tmp_path, rejected=(), gap=GAP):
+    database = Database()
+    database.name = str(tmp_path / "params.db")
+    database.check_migrations()
+    server = UdpServer(("", 0), downlink=DownlinkScheduler(gap))
+    server.sock = DeviceSocket(server, rejected)
+    app.config["TESTING"] = True
+    app.config["udpServer"] = server
+    getDeviceStatus(DEVICEID)["addr"] = ADDR
+    return server, app.test_client()
+
+
+def test_room_params_in_one_request(tmp_path):
+    # Arrange
+    server, client = setup(tmp_path)
+
+    # Act
+    response = client.put(
+        f"/api/v1.0/devices/{DEVICEID}/rooms/1/params",
+        json={"t1": 150, "t3": 215, "mode": 1},
+    )
+
+    # Assert
+    assert response.status_code == 200
+    assert response.json["results"] == {"1": {"t1": "OK", "t3": "OK", "mode": "OK"}}
+    assert sorted(server.sock.sent) == [
+        (1, MsgId.SET_MODE, 1),
+        (1, MsgId.SET_T3, 215),
+        (1, MsgId.SET_T1, 150),
+    ]
+    # A command per SET on the downlink queue of the device
+    assert server.downlink.getStats()["devices"][str(DEVICEID)]["sent"] == 3
+
+
+def test_device_params_report_each_field(tmp_path):
+    # Arrange
+    server, client = setup(tmp_path, rejected={MsgId.SET_T2})
+
+    # Act
+    response = client.put(
+        f"/api/v1.0/devices/{DEVICEID}/params",
+        json={"1": {"t2": 180}, "2": {"t2": 180, "t1": 100}},
+    )
+    unknown = client.put(f"/api/v1.0/devices/{DEVICEID}/params", json={"1": {"x": 1}})
+
+    # Assert
+    assert response.status_code == 500
+    assert response.json["results"] == {
+        "1": {"t2": "ERROR"},
+        "2": {"t2": "ERROR", "t1": "OK"},
+    }
+    assert unknown.status_code == 400
+    assert len(server.sock.sent) == 3
+
+
+class SilentSocket:
+    def sendto(self, data, addr) -> int:
+        return len(data)
+
+
+def test_silent_device_is_a_gateway_timeout(tmp_path, monkeypatch):
+    # Arrange
+    server, client = setup(tmp_path)
+    server.sock = SilentSocket()
+    monkeypatch.setattr(restapi, "DOWNLINK_TIMEOUT", 0.2)
+
+    # Act
+    response = client.put(f"/api/v1.0/devices/{DEVICEID}/rooms/1/t3", json=215)
+
+    # Assert
+    assert response.status_code == 504
+
+
+def test_batched_sets_are_paced_by_the_downlink_gap(tmp_path):
+    # Arrange
+    server, client = setup(tmp_path)
+
+    # Act
+    response = client.put(
+        f"/api/v1.0/devices/{DEVICEID}/rooms/1/params",
+        json={"t1": 150, "t2": 180, "t3": 215},
+    )
+
+    # Assert
+    assert response.status_code == 200
+    times = server.sock.times
+    assert len(times) == 3
+    assert min(b - a for a, b in zip(times, times[1:])) >= GAP * 0.9
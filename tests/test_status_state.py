@@ -0,0 +1,126 @@
+import json
+import sys
+import threading
+
+from status import (
+    DeviceState,
+    RoomState,
+    WeekProgram,
+    getDeviceStatus,
+    getRoomStatus,
+    getVersion,
+    update,
+)
+
+
+def test_room_state_behaves_like_the_old_dict():
+    # Arrange
+    room = RoomState()
+
+    # Act
+    room["t3"] = 215
+    with update(room):
+        room.temp = 201
+    room.days[2] = range(24)
+
+    # Assert
+    assert room["t3"] == 215 and room.get("temp") == 201
+    assert "fakeboost" not in room and room.get("fakeboost") is None
+    assert len(room["days"]) == 1 and room["days"][2] == list(range(24))
+    assert json.loads(json.dumps(room.asdict())) == {
+        "days": {"2": list(range(24))},
+        "temp": 201,
+        "t3": 215,
+    }
+
+
+def test_snapshots_are_published_on_update():
+    # Arrange
+    room = getRoomStatus(4001, 1)
+    device = getDeviceStatus(4001)
+    room["temp"] = 200
+
+    # Act
+    first = device.asdict()
+    second = device.asdict()
+    with update(room):
+        room.temp = 210
+        # Not published yet
+        during = device.asdict()["rooms"][1]["temp"]
+    third = device.asdict()
+    room.days[0] = [1] * 24
+    fourth = device.asdict()
+
+    # Assert
+    assert first["rooms"][1] is second["rooms"][1]
+    assert during == 200
+    assert third["rooms"][1]["temp"] == 210
+    assert first["rooms"][1]["temp"] == 200
+    assert fourth["rooms"][1]["days"] == {0: [1] * 24}
+    assert room.version == device.version == getVersion()
+    # the cseq counters are always fresh
+    assert first["cseq"] is not second["cseq"]
+    assert "completed" in first["cseq"]
+
+
+def test_readers_never_see_a_half_applied_update():
+    # Arrange
+    room = getRoomStatus(4002, 1)
+    stop = threading.Event()
+    torn = []
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            with update(room):
+                room.temp = n
+                room.settemp = n
+
+    def reader():
+        for _ in range(20000):
+            snapshot = getDeviceStatus(4002).asdict()["rooms"][1]
+            if snapshot.get("temp") != snapshot.get("settemp"):
+                torn.append(snapshot)
+            # New rooms don't break the iteration of the others
+            list(getDeviceStatus(4002).rooms.items())
+
+    # Act
+    thread = threading.Thread(target=writer)
+    thread.start()
+    for r in range(2, 10):
+        getRoomStatus(4002, r)
+    reader()
+    stop.set()
+    thread.join()
+
+    # Assert
+    assert torn == []
+
+
+def test_device_version_is_the_software_version():
+    # Arrange
+    device = DeviceState()
+
+    # Act
+    missing = "version" in device
+    device["version"] = "1.2"
+
+    # Assert
+    assert not missing
+    assert device["version"] == "1.2" and device.asdict()["version"] == "1.2"
+    assert device.version == getVersion()
+
+
+def test_programs_are_compact():
+    # Arrange
+    room = RoomState()
+
+    # Act
+    for day in range(7):
+        room.days[day] = [0xFF] * 24
+
+    # Assert
+    assert not hasattr(room, "__dict__")
+    assert sys.getsizeof(room.days.data) < 7 * sys.getsizeof([0xFF] * 24)
+    assert isinstance(room.days, WeekProgram) and len(room.days) == 7
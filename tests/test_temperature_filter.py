@@ -0,0 +1,59 @@
+import math
+
+from ingest import TemperatureFilter
+
+
+def test_unchanged_temperatures_are_dropped():
+    # Arrange
+    filter = TemperatureFilter(deadband=0.2, heartbeat=900)
+    statuses = 24 * 3600 // 40
+    logged = []
+
+    # Act
+    # A day of STATUS every 40 s: slow swings in tenths of degC, heating
+    # switched every 3 hours
+    for n in range(statuses):
+        t = n * 40.0
+        temp = round(200 + 10 * math.sin(t / 7200)) / 10.0
+        heating = int(t // 10800) % 2
+        logged += filter.filter(1, temp, 21.0, heating, now=t)
+
+    # Assert
+    assert len(logged) * 10 <= statuses
+    assert filter.rows + filter.suppressed == statuses
+    # Every heating change is logged when it happens
+    changes = [s.time for a, s in zip(logged, logged[1:]) if s.heating != a.heating]
+    assert changes == [t for t in range(10800, 24 * 3600, 10800)]
+    # Continuous graphs, at most a STATUS after the heartbeat
+    assert max(b.time - a.time for a, b in zip(logged, logged[1:])) <= 900 + 40
+    # Nothing moves more than the deadband between two logged rows
+    assert max(abs(b.temp - a.temp) for a, b in zip(logged, logged[1:])) < 0.25
+
+
+def test_step_after_a_flat_period_keeps_the_previous_sample():
+    # Arrange
+    filter = TemperatureFilter(deadband=0.2, heartbeat=900)
+
+    # Act
+    first = filter.filter(1, 19.0, 21.0, 0, now=0)
+    flat = [filter.filter(1, 19.1, 21.0, 0, now=t) for t in (40, 80, 120)]
+    step = filter.filter(1, 19.1, 22.0, 0, now=160)
+    other = filter.filter(2, 19.1, 22.0, 0, now=160)
+
+    # Assert
+    assert [s.time for s in first] == [0]
+    assert flat == [[], [], []]
+    assert [(s.time, s.settemp) for s in step] == [(120, 21.0), (160, 22.0)]
+    assert len(other) == 1
+    assert filter.suppressed == 2
+
+
+def test_zero_deadband_logs_everything():
+    # Arrange
+    filter = TemperatureFilter(deadband=0)
+
+    # Act
+    logged = [filter.filter(1, 20.0, 21.0, 0, now=t) for t in range(10)]
+
+    # Assert
+    assert all(len(samples) == 1 for samples in logged)
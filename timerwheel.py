@@ -0,0 +1,121 @@
+#
+# Hashed timer wheel
+#
+# A single thread serves every timer: the wheel has `slots` buckets of `tick`
+# seconds, a timer is put in the bucket of its deadline with the number of
+# full turns still to go. Scheduling and cancelling are O(1) (a cancelled timer
+# is only flagged and dropped when its bucket comes up), which suits lots of
+# short lived timeouts that are mostly cancelled. Callbacks run on the wheel
+# thread and must be quick: resolve a future, queue some work.
+#
+import logging
+import math
+import threading
+import time
+import traceback
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    __slots__ = ("deadline", "rounds", "callback", "args", "cancelled")
+
+    def __init__(self, deadline: float, rounds: int, callback, args) -> None:
+        self.deadline = deadline
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class TimerWheel(threading.Thread):
+    def __init__(self, tick: float = 0.05, slots: int = 512) -> None:
+        super().__init__(name="timer-wheel", daemon=True)
+        self.tick = tick
+        self.slots: list[list[Timer]] = [[] for _ in range(slots)]
+        self.cond = threading.Condition()
+        self.started = time.monotonic()
+        self.current = 0  # ticks processed since started
+        self.count = 0  # timers in the wheel, cancelled ones included
+        self.fired = 0
+        self.stop = False
+
+    def schedule(self, delay: float, callback: Callable[..., Any], *args) -> Timer:
+        with self.cond:
+            if self.ident is None:
+                self.start()
+            now = time.monotonic()
+            if self.count == 0:
+                # Idle wheel: skip the empty buckets gone by
+                self.current = max(self.current, self._ticks(now))
+            deadline = now + max(delay, 0)
+            # Never in a bucket already processed, at worst one tick late
+            ticks = max(
+                math.ceil((deadline - self.started) / self.tick), self.current + 1
+            )
+            offset = ticks - self.current
+            timer = Timer(deadline, (offset - 1) // len(self.slots), callback, args)
+            self.slots[ticks % len(self.slots)].append(timer)
+            self.count += 1
+            if self.count == 1:
+                self.cond.notify()
+        return timer
+
+    def _ticks(self, now: float) -> int:
+        return int((now - self.started) / self.tick)
+
+    def run(self) -> None:
+        while True:
+            with self.cond:
+                if self.stop:
+                    return
+                if self.count == 0:
+                    self.cond.wait()
+                    continue
+                now = time.monotonic()
+                if self._ticks(now) <= self.current:
+                    self.cond.wait(self.started + (self.current + 1) * self.tick - now)
+                    continue
+                due = []
+                while self.current < self._ticks(now):
+                    self.current += 1
+                    due += self._expire(self.slots[self.current % len(self.slots)])
+            for timer in due:
+                self.fired += 1
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    logger.error(traceback.format_exc())
+
+    def _expire(self, bucket: list[Timer]) -> list[Timer]:
+        # Called with the lock held, returns the timers to fire
+        due = []
+        keep = []
+        for timer in bucket:
+            if timer.cancelled:
+                self.count -= 1
+            elif timer.rounds > 0:
+                timer.rounds -= 1
+                keep.append(timer)
+            else:
+                self.count -= 1
+                due.append(timer)
+        bucket[:] = keep
+        return due
+
+    def getStats(self) -> dict[str, int]:
+        with self.cond:
+            return {"timers": self.count, "fired": self.fired}
+
+    def shutdown(self) -> None:
+        with self.cond:
+            self.stop = True
+            self.cond.notify()
+
+
+# Shared by the CSeq correlation tables and the fake boost timers
+wheel = TimerWheel()
@@ -1,27 +1,81 @@
 import binascii
-from functools import wraps
-import io
-import os
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from functools import lru_cache, wraps
 import pickle
 from typing import Any, Optional
 from typing_extensions import Buffer
-from crccheck.crc import Crc16Xmodem
-from enum import IntEnum
 import time
 import socket
 import threading
 import struct
 import logging
-import hexdump
 import traceback
 
-from status import getPeerStatus, getRoomStatus, getDeviceStatus, getStatus
+from codec import (
+    DOWNLINK,
+    SET_PAYLOAD_SIZE,
+    UPLINK,
+    DeviceTimeDLMsg,
+    GetProgMsg,
+    HeaderMsg,
+    HeatingMode,
+    MsgId,
+    OutsideTempMsg,
+    PingMsg,
+    ProgEndMsg,
+    ProgramMsg,
+    SetMsg,
+    StatusReplyMsg,
+    setSchema,
+)
+from status import (
+    getPeerFromDeviceId,
+    getPeerStatus,
+    getRoomStatus,
+    getDeviceStatus,
+    getStatus,
+    setPeerDevice,
+    update,
+)
+from correlation import UNUSED_CSEQ
 from database import Database
+from datalog import DatalogWriter
+from dispatcher import DeviceDispatcher
+from fakeboost import BoostTimers
+from downlink import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_TIMER,
+    PRIORITY_USER,
+    DownlinkScheduler,
+)
+from ingest import TemperatureFilter
+from packettrace import tracer
 
 logger = logging.getLogger(__name__)
 
+# Room parameter updated by each MsgId.SET_* message
+SET_PARAMS = {
+    MsgId.SET_T1: "t1",
+    MsgId.SET_T2: "t2",
+    MsgId.SET_T3: "t3",
+    MsgId.SET_MIN_HEAT_SETP: "minsetp",
+    MsgId.SET_MAX_HEAT_SETP: "maxsetp",
+    MsgId.SET_UNITS: "units",
+    MsgId.SET_SEASON: "winter",
+    MsgId.SET_ADVANCE: "advance",
+    MsgId.SET_MODE: "mode",
+    MsgId.SET_SENSOR_INFLUENCE: "sensorinfluence",
+    MsgId.SET_CURVE: "tempcurve",
+}
+
 FAKEBOOST_TEMPERATURE_RISE = 6  # degC * 10
 FAKEBOOST_DURATION = 1800  # seconds
+FAKEBOOST_RETRY = 60  # seconds before another revert of an expired fake boost
+GET_PROG_INTERVAL = 1  # seconds between GET_PROG sent to the same device
+
+
+# Precompiled struct.Struct for each format string
+compiledStruct = lru_cache(maxsize=None)(struct.Struct)
 
 
 class Unpacker:
@@ -30,8 +84,9 @@ class Unpacker:
         self.offset: int = offset
 
     def __call__(self, fmt) -> tuple[Any, ...]:
-        rc = struct.unpack_from(fmt, self.buffer, self.offset)
-        self.offset += struct.calcsize(fmt)
+        compiled = compiledStruct(fmt)
+        rc = compiled.unpack_from(self.buffer, self.offset)
+        self.offset += compiled.size
         return rc
 
     def subbuf(self, length) -> bytes:
@@ -49,187 +104,6 @@ class Unpacker:
         self.offset = offset
 
 
-class HeatingMode(IntEnum):
-    AUTO = 0
-    MANUAL = 1
-    HOLIDAY = 2
-    PARTY = 3
-    OFF = 4
-    DHW = 5
-
-
-#
-# Note:
-#    Downlink (DL) is from cloud server to Besmart device.
-#    Uplink (UL) is from Besmart device to cloud server.
-#
-
-
-class MsgId(IntEnum):
-    #
-    # Set the thermostat mode: auto/holiday/party/off etc.
-    # DL initiated
-    #
-    SET_MODE = 0x02
-
-    # 0x03    Unknown (from test probe: deviceid) (invalid)
-    # 0x04    Unknown (from test probe: deviceid) (invalid)
-    # 0x05    Unknown (from test probe: deviceid) (invalid)
-    # 0x06    Unknown (from test probe: deviceid) (invalid)
-    # 0x07    Unknown (from test probe: deviceid) (invalid)
-    # 0x08    Unknown (from test probe: deviceid) (invalid)
-    # 0x09    Unknown (from test probe: deviceid) (invalid)
-
-    #
-    # The thermostat daily program (one message per day)
-    # UL/DL initiated
-    #
-    PROGRAM = 0x0A
-
-    #
-    # Set the T1/T2/T3 temperatures
-    # Values in degC * 10
-    # DL initiated
-    #
-    SET_T3 = 0x0B
-    SET_T2 = 0x0C
-    SET_T1 = 0x0D
-
-    # 0x0e    Unknown (from test probe: deviceid, roomid) (invalid)
-    # 0x0f    Unknown (from test probe: deviceid, long message with lots of 0x0
-    #   followed by lots of 0xff) Could this be OpenTherm parameters?
-    # 0x10    Unknown (from test probe: deviceid) (invalid)
-    # 0x11    Unknown (from test probe: deviceid,byte=0xff)
-
-    #
-    # Enable/Disable advance on the thermostat
-    # 1 = Advance
-    # DL initiated
-    #
-    SET_ADVANCE = 0x12
-
-    # 0x13    Unknown (from test probe: deviceid) (invalid)
-    # 0x14    Unknown (from test probe: deviceid, 4 bytes = 0x0)
-
-    #
-    # Get the device software version
-    # UL/DL initiated
-    #
-    SWVERSION = 0x15
-
-    #
-    # Set the Temperature Curve (OpenTherm only)
-    # Values in degC * 10
-    # DL initiated
-    #
-    SET_CURVE = 0x16
-
-    #
-    # Set the thermostat min/max heating setpoints (OpenTherm only)
-    # Values in degC * 10
-    # DL initiated
-    #
-    SET_MIN_HEAT_SETP = 0x17
-    SET_MAX_HEAT_SETP = 0x18
-
-    #
-    # Set the units degC/degF
-    # 0 = degC 1 = degF
-    # DL initiated
-    #
-    SET_UNITS = 0x19
-
-    #
-    # Set the season heating/cooling
-    # 1 = Winter
-    # DL initiated
-    #
-    SET_SEASON = 0x1A
-
-    #
-    # Set the sensor influence (OpenTherm only)
-    # Values in degC
-    # DL initiated
-    #
-    SET_SENSOR_INFLUENCE = 0x1B
-
-    # 0x1c    Unknown (from test probe: deviceid, roomid, byte=85)
-
-    #
-    # No idea what this message is!!
-    # DL initiated
-    #
-    REFRESH = 0x1D
-
-    # 0x1e    Unknown (from test probe: deviceid) (invalid)
-    # 0x1f    Unknown (from test probe: deviceid) (invalid)
-
-    #
-    # Where to obtain the outside temperature: web/boiler/none (OpenTherm only)
-    # 0 = none, 1 = boiler, 2 = web
-    # DL initiated
-    #
-    OUTSIDE_TEMP = 0x20
-
-    # 0x21    Unknown (from test probe: deviceid) (invalid)
-
-    #
-    # No idea what this message is!!!
-    # UL initiated
-    #
-    PING = 0x22
-
-    # 0x23    Unknown (from test probe: deviceid) (invalid)
-
-    #
-    # Periodic (every 40s) status from the device
-    # UL initiated
-    #
-    STATUS = 0x24
-
-    # 0x25    Unknown (from test probe: deviceid, byte=0x1)
-    # 0x26    Unknown (from test probe: deviceid) (invalid)
-    # 0x27    Unknown (from test probe: deviceid) (invalid)
-    # 0x28    Unknown (from test probe: deviceid) (invalid)
-
-    #
-    # Set the time on the device
-    # Looks like it only sets daylight savings time.
-    # No idea how the device gets the actual time.
-    # 1 = DST
-    # DL initiated
-    #
-    DEVICE_TIME = 0x29
-
-    #
-    # No idea what this message is!!!
-    # Sent by the device after it has sent all the daily programs
-    # UL initiated
-    #
-    PROG_END = 0x2A
-
-    #
-    # Not sure what this message is!!!
-    # But it triggers the device to send all the daily programs for the specified thermostat
-    # DL initiated
-    #
-    GET_PROG = 0x2B
-
-    # 0x2c    Unknown (from test probe: deviceid, short=0x1c2)
-    # 0x2d    Unknown (from test probe: deviceid) (invalid)
-    # 0x2e    Unknown (from test probe: deviceid) (invalid)
-    # 0x30    Unknown (from test probe: deviceid) (invalid)
-
-    #
-    #  Fake ID for unknown ids
-    #
-    UNKNOWN_ID = 0xFF
-
-    @classmethod
-    def _missing_(cls, number):
-        return cls(cls.UNKNOWN_ID)
-
-
 #
 # Hardcoded header/footer on all messages
 #
@@ -237,47 +111,28 @@ MAGIC_HEADER = 0xD4FA
 MAGIC_FOOTER = 0xDF2D
 
 #
-# Control plane sequence numbers
+# Control plane sequence numbers, see correlation.CSeqTable
 #
-UNUSED_CSEQ = 0xFF
-MAX_CSEQ = 0xFD
 
 
 def NextCSeq(device, wait=0):
-    current_cseq = device["cseq"]
-    cseq = current_cseq + 1
-    if cseq > MAX_CSEQ:
-        cseq = 0
-    device["cseq"] = cseq
-
-    device["results"].pop(current_cseq, None)  # delete any dangling entries
-    if wait:
-        device["results"][current_cseq] = {
-            "wait": wait,
-            "ev": threading.Event(),
-            "val": None,
-        }
-
-    return current_cseq
+    return device["cseq"].allocate(wait)
 
 
 def LastCSeq(device):
-    cseq = device["cseq"]
-    return 0 if cseq == MAX_CSEQ else cseq - 1
+    return device["cseq"].last
 
 
 def WaitCSeq(device, cseq):
-    if cseq in device["results"]:
-        results = device["results"][cseq]
-        results["ev"].wait(results["wait"])
-        del device["results"][cseq]
-        return results["val"]
+    return device["cseq"].wait(cseq)
+
+
+def SetResendCSeq(device, cseq, fn, *args):
+    device["cseq"].setResend(cseq, fn, *args)
 
 
 def SignalCSeq(device, cseq, val):
-    if cseq in device["results"]:
-        device["results"][cseq]["val"] = val
-        device["results"][cseq]["ev"].set()
+    return device["cseq"].signal(cseq, val)
 
 
 #
@@ -292,38 +147,57 @@ def SignalCSeq(device, cseq, val):
 #
 
 
+FRAME_HEADER = struct.Struct("<HHI")
+FRAME_FOOTER = struct.Struct("<HH")
+FRAME_OVERHEAD = FRAME_HEADER.size + FRAME_FOOTER.size
+
+
+def crc16_xmodem(data) -> int:
+    # CRC-16/XMODEM (poly 0x1021, init 0): binascii.crc_hqx is the table driven
+    # C implementation of it, bit-exact with crccheck's Crc16Xmodem.calc()
+    return binascii.crc_hqx(data, 0)
+
+
 class Frame:
-    def __init__(self, payload: bytes | None = None) -> None:
+    def __init__(self, payload: bytes | memoryview | None = None) -> None:
         self.seq = None
-        self.payload: bytes | None = payload
+        self.payload: bytes | memoryview | None = payload
 
-    def encode(self, seq=0xFFFFFFFF) -> bytes:
+    def encode(self, seq=0xFFFFFFFF) -> bytearray:
         if self.payload is None:
             raise ValueError("Frame without payload can't be encoded!")
         self.seq = seq
-        buf = struct.pack("<HHI", MAGIC_HEADER, len(self.payload), seq)
-        buf += self.payload
-        crc = Crc16Xmodem.calc(self.payload)
-        buf += struct.pack("<HH", crc, MAGIC_FOOTER)
+        length = len(self.payload)
+        buf = bytearray(length + FRAME_OVERHEAD)
+        FRAME_HEADER.pack_into(buf, 0, MAGIC_HEADER, length, seq)
+        end = FRAME_HEADER.size + length
+        buf[FRAME_HEADER.size : end] = self.payload
+        FRAME_FOOTER.pack_into(buf, end, crc16_xmodem(self.payload), MAGIC_FOOTER)
         return buf
 
-    def decode(self, data) -> bytes | None:
-        unpack = Unpacker(data)
-        hdr, length, self.seq = unpack("<HHI")
+    def decode(self, data) -> memoryview | None:
+        # The payload returned is a view on data, nothing is copied
+        view = memoryview(data)
+        if len(view) < FRAME_OVERHEAD:
+            logger.warn(f"Invalid Length {len(view)}")
+            return None
+
+        hdr, length, self.seq = FRAME_HEADER.unpack_from(view)
 
         if hdr != MAGIC_HEADER:
             logger.warn(f"Invalid Header {hdr=:x}")
             return None
 
-        if len(data) != length + 12:
-            logger.warn(f"Invalid Length {length=} {len(data)}")
+        if len(view) != length + FRAME_OVERHEAD:
+            logger.warn(f"Invalid Length {length=} {len(view)}")
             return None
 
-        self.payload = unpack.subbuf(length)
+        end = FRAME_HEADER.size + length
+        self.payload = view[FRAME_HEADER.size : end]
 
-        crc, ftr = unpack("<HH")
+        crc, ftr = FRAME_FOOTER.unpack_from(view, end)
 
-        crcCalc = Crc16Xmodem.calc(self.payload)
+        crcCalc = crc16_xmodem(self.payload)
         if crcCalc != crc:
             logger.warn(f"Invalid CRC got {crc=:x} {crcCalc=:x}")
             return None
@@ -335,6 +209,20 @@ class Frame:
         return self.payload
 
 
+def peekMsgType(data) -> int | None:
+    # msgType of the wrapper without decoding the frame
+    if len(data) < 9 or data[0] != 0xFA or data[1] != 0xD4:
+        return None
+    return data[8]
+
+
+def peekDeviceId(data) -> int | None:
+    # deviceid without decoding the frame: header(8) + wrapper(4) + cseq/flags/unk(4)
+    if len(data) < 20 or data[0] != 0xFA or data[1] != 0xD4:
+        return None
+    return int.from_bytes(data[16:20], "little")
+
+
 #
 # The payload in the frame (see Frame()) uses the following wrapper
 # for all the protocol messages
@@ -446,13 +334,44 @@ class UdpServer(threading.Thread):
     def __init__(
         self,
         addr,
-        datalog: Optional[io.TextIOWrapper] = None,
+        datalog: Optional[DatalogWriter] = None,
+        workers: int = 0,
+        downlink: Optional[DownlinkScheduler] = None,
+        temperatureFilter: Optional[TemperatureFilter] = None,
     ):
         threading.Thread.__init__(self)
         self.addr = addr
         self.stop = False
+        self.engine = None  # set by AsyncUdpServer when running on asyncio
         self.db = Database()
-        self.datalog: io.TextIOWrapper | None = datalog
+        self.datalog: DatalogWriter | None = datalog
+        self.local = threading.local()
+        # workers = 0 handles every message inline in the receive loop
+        self.dispatcher: DeviceDispatcher | None = (
+            DeviceDispatcher(self.handle, workers) if workers > 0 else None
+        )
+        # Paced downlinks the device didn't ask for, see schedule()
+        self.downlink: DownlinkScheduler = (
+            downlink if downlink is not None else DownlinkScheduler(GET_PROG_INTERVAL)
+        )
+        # Drops the unchanged temperatures before the database
+        self.temperatureFilter: TemperatureFilter = (
+            temperatureFilter if temperatureFilter is not None else TemperatureFilter()
+        )
+        # Fake boost deadlines on the timer wheel, see expireFakeBoost()
+        self.boosts: BoostTimers = BoostTimers(self.expireFakeBoost, self.db)
+
+    @property
+    def dbConn(self):
+        # sqlite connections can only be used by the thread which created them
+        conn = getattr(self.local, "dbConn", None)
+        if conn is None:
+            conn = self.local.dbConn = self.db.get_connection()
+        return conn
+
+    @dbConn.setter
+    def dbConn(self, conn):
+        self.local.dbConn = conn
 
     def run(self):
         logger.info("UDP server is running")
@@ -463,95 +382,127 @@ class UdpServer(threading.Thread):
 
         while not self.stop:
             data, addr = self.sock.recvfrom(self.MAX_DATA)
-            logger.info(f"From {addr} {len(data)} bytes : {hexdump.dump(data)}")
+            if tracer.active:
+                tracer.packet("From", addr, data, peekDeviceId(data), peekMsgType(data))
+            if self.dispatcher is not None:
+                self.dispatch(data, addr)
+                continue
             try:
                 self.handleMsg(data, addr)
             except Exception:
                 logger.error(traceback.format_exc())
                 time.sleep(1)
 
+    def dispatchKey(self, data, addr):
+        deviceid = peekDeviceId(data)
+        return deviceid if deviceid is not None else addr
+
+    def dispatch(self, data, addr) -> None:
+        # Called from the receive path only, queue the message on its device
+        self.dispatcher.dispatch(self.dispatchKey(data, addr), data, addr)  # type: ignore
+
+    def handle(self, data, addr) -> None:
+        try:
+            self.handleMsg(data, addr)
+        except Exception:
+            logger.error(traceback.format_exc())
+
     def sendto(self, data, address) -> int:
         if self.datalog is not None:
-            self.datalog.write(
-                f'"O","{address}","{hexdump.dump(data, sep='')}"\r\n'
-            )
-            self.datalog.flush()
-            os.fsync(self.datalog)
+            self.datalog.record("O", address, data)
         return self.sock.sendto(data, address)
 
-    def send_PING(self, addr, deviceid, response=0):
-        cseq = UNUSED_CSEQ
-        unk1 = 0x0  # Always zero in DL
-        unk2 = 0x0
-        unk3 = 0xF43C
-        payload = struct.pack("<BBHIH", cseq, unk1, unk2, deviceid, unk3)
+    def sendMsg(self, addr, msgType, payload, response, write) -> None:
         wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(MsgId.PING, response, write=1)
-        logger.info(f"Sending {wrapper}")
+        payload = wrapper.encodeDL(msgType, response, write=write)
         frame = Frame(payload=payload)
         buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
+        if tracer.active:
+            deviceid = peekDeviceId(buf)
+            if tracer.enabled(deviceid, msgType):
+                tracer.log("Sending %s", wrapper)
+            tracer.packet("To", addr, buf, deviceid, msgType)
         self.sendto(buf, addr)
 
+    def post(self, addr, device, cseq, msgType, payload, response, write):
+        # Sends a downlink with a cseq, retransmitted with the same cseq until
+        # answered when it waits for an answer (see CSeqTable)
+        SetResendCSeq(
+            device, cseq, self.sendMsg, addr, msgType, payload, response, write
+        )
+        self.sendMsg(addr, msgType, payload, response, write)
+        return cseq
+
+    def request(self, addr, device, cseq, msgType, payload, response, write):
+        # post() and return the answer
+        return WaitCSeq(
+            device, self.post(addr, device, cseq, msgType, payload, response, write)
+        )
+
+    def send_PING(self, addr, deviceid, response=0):
+        msg = PingMsg(
+            cseq=UNUSED_CSEQ,
+            unk1=0x0,  # Always zero in DL
+            unk2=0x0,
+            deviceid=deviceid,
+            unk3=0xF43C,
+        )
+        payload = DOWNLINK.get(MsgId.PING).encode(msg)  # type: ignore
+        self.sendMsg(addr, MsgId.PING, payload, response, write=1)
+
     def send_GET_PROG(self, addr, device, deviceid, room, response=0, wait=0):
         cseq = NextCSeq(device, wait)
-        unk1 = 0x0  # Always zero in DL
-        unk2 = 0x0
-        unk3 = 0x800FE0
-        payload = struct.pack("<BBHIII", cseq, unk1, unk2, deviceid, room, unk3)
-        wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(MsgId.GET_PROG, response, write=0)
-        logger.info(f"Sending {wrapper}")
-        frame = Frame(payload=payload)
-        buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
-        self.sendto(buf, addr)
-        return WaitCSeq(device, cseq)
+        msg = GetProgMsg(
+            cseq=cseq,
+            unk1=0x0,  # Always zero in DL
+            unk2=0x0,
+            deviceid=deviceid,
+            room=room,
+            unk3=0x800FE0,
+        )
+        payload = DOWNLINK.get(MsgId.GET_PROG).encode(msg)  # type: ignore
+        return self.request(
+            addr, device, cseq, MsgId.GET_PROG, payload, response, write=0
+        )
 
     def send_SWVERSION(self, addr, device, deviceid, response=0, wait=0):
         cseq = NextCSeq(device, wait)
-        unk1 = 0x0  # Always zero in DL
-        unk2 = 0x0
-        payload = struct.pack("<BBHI", cseq, unk1, unk2, deviceid)
-        wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(MsgId.SWVERSION, response, write=0)
-        logger.info(f"Sending {wrapper}")
-        frame = Frame(payload=payload)
-        buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
-        self.sendto(buf, addr)
-        return WaitCSeq(device, cseq)
+        msg = HeaderMsg(
+            cseq=cseq, unk1=0x0, unk2=0x0, deviceid=deviceid  # unk1 always zero in DL
+        )
+        payload = DOWNLINK.get(MsgId.SWVERSION).encode(msg)  # type: ignore
+        return self.request(
+            addr, device, cseq, MsgId.SWVERSION, payload, response, write=0
+        )
 
     def send_PROGRAM(
         self, addr, device, deviceid, room, day, prog, response=0, write=0, wait=0
     ):
         cseq = UNUSED_CSEQ
-        unk1 = 0x0  # Always zero in DL
-        unk2 = 0x0
-        payload = struct.pack(
-            "<BBHIIH24B", cseq, unk1, unk2, deviceid, room, day, *prog
+        msg = ProgramMsg(
+            cseq=cseq,
+            unk1=0x0,  # Always zero in DL
+            unk2=0x0,
+            deviceid=deviceid,
+            room=room,
+            day=day,
+            prog=tuple(prog),
+        )
+        payload = DOWNLINK.get(MsgId.PROGRAM).encode(msg)  # type: ignore
+        return self.request(
+            addr, device, cseq, MsgId.PROGRAM, payload, response, write=write
         )
-        wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(MsgId.PROGRAM, response, write=write)
-        logger.info(f"Sending {wrapper}")
-        frame = Frame(payload=payload)
-        buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
-        self.sendto(buf, addr)
-        return WaitCSeq(device, cseq)
 
     def send_STATUS(self, addr, deviceid, lastseen, response=0):
-        cseq = UNUSED_CSEQ
-        unk1 = 0x0  # Always zero in DL
-        unk2 = 0x0
-        payload = struct.pack("<BBHII", cseq, unk1, unk2, deviceid, lastseen)
-        wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(MsgId.STATUS, response, write=1)
-        logger.info(f"Sending {wrapper}")
-        frame = Frame(payload=payload)
-        buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
-        self.sendto(buf, addr)
+        msg = StatusReplyMsg(
+            cseq=UNUSED_CSEQ,
+            unk1=0x0,  # Always zero in DL
+            unk2=0x0,
+            deviceid=deviceid,
+            lastseen=lastseen,
+        )
+        payload = DOWNLINK.get(MsgId.STATUS).encode(msg)  # type: ignore
+        self.sendMsg(addr, MsgId.STATUS, payload, response, write=1)
 
     def send_SET(
         self,
@@ -566,98 +517,161 @@ class UdpServer(threading.Thread):
         wait=0,
         numBytes=None,
     ):
+        cseq = self.post_SET(
+            addr,
+            device,
+            deviceid,
+            room,
+            msgType,
+            value,
+            response,
+            write,
+            wait,
+            numBytes,
+        )
+        return WaitCSeq(device, cseq)
+
+    def post_SET(
+        self,
+        addr,
+        device,
+        deviceid,
+        room,
+        msgType,
+        value,
+        response=0,
+        write=0,
+        wait=0,
+        numBytes=None,
+    ):
+        # send_SET() without waiting for the answer, returns the cseq
         logger.info(
-            f"send_SET addr={addr} deviceid={deviceid} room={room} msgType={msgType} value={value}"
+            "send_SET addr=%s deviceid=%s room=%s msgType=%s value=%s",
+            addr,
+            deviceid,
+            room,
+            msgType,
+            value,
         )
-        cseq = NextCSeq(device, wait)
-        flags = 0x0  # Always zero in DL
-        unk2 = 0x0
-        payload = struct.pack("<BBHII", cseq, flags, unk2, deviceid, room)
-
-        if numBytes is None:
-            numBytes = self.set_messages_payload_size(msgType)
-
-        # @todo can any of the MsgId.SET_* values be negative?
-        if numBytes == 4:
-            payload += struct.pack("<I", value)
-        elif numBytes == 2:
-            payload += struct.pack("<H", value)
-        elif numBytes == 1:
-            payload += struct.pack("<B", value)
+        if numBytes is None and msgType in SET_PAYLOAD_SIZE:
+            schema = DOWNLINK.get(msgType)
         else:
-            raise ValueError("InternalError")
+            # Arbitrary size, only used to probe unknown messages
+            schema = setSchema(msgType, numBytes)
 
-        wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(msgType, response, write=write)
-        logger.info(f"Sending {wrapper}")
-        frame = Frame(payload=payload)
-        buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
-        self.sendto(buf, addr)
-        return WaitCSeq(device, cseq)
+        cseq = NextCSeq(device, wait)
+        msg = SetMsg(
+            cseq=cseq,
+            flags=0x0,  # Always zero in DL
+            unk2=0x0,
+            deviceid=deviceid,
+            room=room,
+            value=value,
+        )
+        payload = schema.encode(msg)
+        return self.post(addr, device, cseq, msgType, payload, response, write=write)
+
+    def send_SETS(
+        self,
+        addr,
+        device,
+        deviceid,
+        sets,
+        wait=1,
+        priority=PRIORITY_USER,
+        timeout=None,
+    ):
+        # Writes several parameters: sets is a list of (room, msgType, value).
+        # Every SET is a downlink command of its own, paced like the other
+        # commands of the device, posted without waiting for its answer so
+        # the answers overlap; then all the answers are awaited. Returns them
+        # in the order of sets. Not a downlink command itself, it would hold
+        # the queue of the device. Raises TimeoutError after timeout seconds
+        # in the queue.
+        futures = [
+            self.schedule(
+                deviceid,
+                self.post_SET,
+                addr,
+                device,
+                deviceid,
+                room,
+                msgType,
+                value,
+                priority=priority,
+                write=1,
+                wait=wait,
+            )
+            for room, msgType, value in sets
+        ]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            cseqs = [
+                future.result(
+                    None if deadline is None else max(deadline - time.monotonic(), 0)
+                )
+                for future in futures
+            ]
+        except FutureTimeoutError:
+            for future in futures:
+                future.cancel()  # not sent late if still queued
+            raise
+        return [WaitCSeq(device, cseq) for cseq in cseqs]
 
     def send_REFRESH(self, addr, device, deviceid, response=0, wait=0):
         cseq = NextCSeq(device, wait)
-        unk1 = 0x0  # Always zero in DL
-        unk2 = 0x0
-        payload = struct.pack("<BBHI", cseq, unk1, unk2, deviceid)
-        wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(MsgId.REFRESH, response, write=0)
-        logger.info(f"Sending {wrapper}")
-        frame = Frame(payload=payload)
-        buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
-        self.sendto(buf, addr)
-        return WaitCSeq(device, cseq)
+        msg = HeaderMsg(
+            cseq=cseq, unk1=0x0, unk2=0x0, deviceid=deviceid  # unk1 always zero in DL
+        )
+        payload = DOWNLINK.get(MsgId.REFRESH).encode(msg)  # type: ignore
+        return self.request(
+            addr, device, cseq, MsgId.REFRESH, payload, response, write=0
+        )
 
     def send_OUTSIDE_TEMP(
         self, addr, device, deviceid, val, response=0, write=0, wait=0
     ):
         cseq = NextCSeq(device, wait)
-        unk1 = 0x0  # Always zero in DL
-        unk2 = 0x0
-        unk3 = val  # External Temperature Management 0 = off 1 = boiler 2 = web
-        payload = struct.pack("<BBHIB", cseq, unk1, unk2, deviceid, unk3)
-        wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(MsgId.OUTSIDE_TEMP, response, write=write)
-        logger.info(f"Sending {wrapper}")
-        frame = Frame(payload=payload)
-        buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
-        self.sendto(buf, addr)
-        return WaitCSeq(device, cseq)
+        msg = OutsideTempMsg(
+            cseq=cseq,
+            unk1=0x0,  # Always zero in DL
+            unk2=0x0,
+            deviceid=deviceid,
+            val=val,  # External Temperature Management 0 = off 1 = boiler 2 = web
+        )
+        payload = DOWNLINK.get(MsgId.OUTSIDE_TEMP).encode(msg)  # type: ignore
+        return self.request(
+            addr, device, cseq, MsgId.OUTSIDE_TEMP, payload, response, write=write
+        )
 
     def send_DEVICE_TIME(
         self, addr, device, deviceid, val, response=0, write=0, wait=0
     ):
         cseq = NextCSeq(device, wait)
-        unk1 = 0x0  # Always zero in DL
-        unk2 = 0x0
-        unk3 = val  # 1 = DST?
-        unk4 = 0x0
-        payload = struct.pack("<BBHIII", cseq, unk1, unk2, deviceid, unk3, unk4)
-        wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(MsgId.DEVICE_TIME, response, write=write)
-        logger.info(f"Sending {wrapper}")
-        frame = Frame(payload=payload)
-        buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
-        self.sendto(buf, addr)
-        return WaitCSeq(device, cseq)
+        msg = DeviceTimeDLMsg(
+            cseq=cseq,
+            unk1=0x0,  # Always zero in DL
+            unk2=0x0,
+            deviceid=deviceid,
+            val=val,  # 1 = DST?
+            unk4=0x0,
+        )
+        payload = DOWNLINK.get(MsgId.DEVICE_TIME).encode(msg)  # type: ignore
+        return self.request(
+            addr, device, cseq, MsgId.DEVICE_TIME, payload, response, write=write
+        )
 
     def send_PROG_END(self, addr, deviceid, room, response=0):
-        cseq = UNUSED_CSEQ
-        unk1 = 0x0  # Always zero in DL
-        unk2 = 0x0
-        unk3 = 0xA14
-        payload = struct.pack("<BBHIIH", cseq, unk1, unk2, deviceid, room, unk3)
-        wrapper = Wrapper(payload=payload)
-        payload = wrapper.encodeDL(MsgId.PROG_END, response, write=0)
-        logger.info(f"Sending {wrapper}")
-        frame = Frame(payload=payload)
-        buf = frame.encode()
-        logger.info(f"To {addr} {len(buf)} bytes : {hexdump.dump(buf)}")
-        self.sendto(buf, addr)
+        msg = ProgEndMsg(
+            cseq=UNUSED_CSEQ,
+            unk1=0x0,  # Always zero in DL
+            unk2=0x0,
+            deviceid=deviceid,
+            room=room,
+            unk3=0xA14,
+        )
+        payload = DOWNLINK.get(MsgId.PROG_END).encode(msg)  # type: ignore
+        self.sendMsg(addr, MsgId.PROG_END, payload, response, write=0)
 
     def send_FAKE_BOOST(self, addr, device, deviceid, room, val):
         # I cannot see a way to control BOOST mode remotely. Instead we implement a fake boost mode
@@ -697,6 +711,7 @@ class UdpServer(threading.Thread):
                     )
                     if rc == 0:
                         roomStatus["fakeboost"] = 0
+                        self.boosts.cancel(deviceid, room)
                     return rc
             elif (
                 val == 1
@@ -732,48 +747,97 @@ class UdpServer(threading.Thread):
                     )
                     if rc != 3:
                         return 0
-                    roomStatus["fakeboost"] = time.time() + FAKEBOOST_DURATION
+                    deadline = time.time() + FAKEBOOST_DURATION
+                    roomStatus["fakeboost"] = deadline
+                    self.boosts.arm(deviceid, room, deadline)
                     return 1
         return 0
 
+    def expireFakeBoost(self, deviceid, room):
+        # BoostTimers callback on the wheel thread: queue the revert
+        addr = getPeerFromDeviceId(deviceid)
+        if addr is None:
+            # Not heard from since a restart
+            self.boosts.arm(deviceid, room, time.time() + FAKEBOOST_RETRY, False)
+            return
+        future = self.schedule(
+            deviceid,
+            self.send_FAKE_BOOST,
+            addr,
+            getDeviceStatus(deviceid),
+            deviceid,
+            room,
+            0,
+            priority=PRIORITY_TIMER,
+            tag=("fakeboost", room),
+        )
+        future.add_done_callback(lambda _: self.fakeBoostExpired(deviceid, room))
+
+    def fakeBoostExpired(self, deviceid, room):
+        # After the revert, try again later if the boost is still on
+        roomStatus = getRoomStatus(deviceid, room)
+        fakeboost = roomStatus.get("fakeboost")
+        if fakeboost == 0:
+            return
+        # None: no STATUS of the room since a restart yet
+        if fakeboost is not None and roomStatus.get("mode") != HeatingMode.PARTY:
+            # Left PARTY mode meanwhile, nothing to revert
+            roomStatus["fakeboost"] = 0
+            self.boosts.cancel(deviceid, room)
+            return
+        self.boosts.arm(deviceid, room, time.time() + FAKEBOOST_RETRY, False)
+
+    def schedule(
+        self,
+        deviceid,
+        fn,
+        *args,
+        priority=PRIORITY_USER,
+        tag=None,
+        replace=False,
+        **kwargs,
+    ) -> Future:
+        # Queue fn(*args, **kwargs), usually a send_* method, on the paced
+        # downlink queue of the device
+        return self.downlink.submit(
+            deviceid, priority, fn, *args, tag=tag, replace=replace, **kwargs
+        )
+
+    def fetch_programs(self, addr, device, deviceid, rooms):
+        # embedded device may not handle lots of messages in a short time: the
+        # GET_PROG are paced by the downlink scheduler, the caller isn't held
+        for room in rooms:
+            self.schedule(
+                deviceid,
+                self.send_GET_PROG,
+                addr,
+                device,
+                deviceid,
+                room,
+                response=0,
+                priority=PRIORITY_BACKGROUND,
+                tag=(MsgId.GET_PROG, room),
+            )
+
     def set_messages_payload_size(self, msgType):
-        if msgType in [
-            MsgId.SET_T3,
-            MsgId.SET_T2,
-            MsgId.SET_T1,
-            MsgId.SET_MIN_HEAT_SETP,
-            MsgId.SET_MAX_HEAT_SETP,
-        ]:
-            return 2
-        elif msgType in [
-            MsgId.SET_UNITS,
-            MsgId.SET_SEASON,
-            MsgId.SET_SENSOR_INFLUENCE,
-            MsgId.SET_CURVE,
-            MsgId.SET_ADVANCE,
-            MsgId.SET_MODE,
-        ]:
-            return 1
-        else:
-            return None
+        return SET_PAYLOAD_SIZE.get(msgType)
 
     def handleMsg(self, data, addr) -> str:
 
-       
         if self.datalog is not None:
-            self.datalog.write(f'"I","{addr}","{hexdump.dump(data, sep='')}"\r\n')
-            self.datalog.flush()
-            os.fsync(self.datalog)
+            self.datalog.record("I", addr, data)
 
         frame = Frame()
-        payload: bytes | None = frame.decode(data)
+        payload: memoryview | None = frame.decode(data)
         if payload is None:
             return ""
         seq = frame.seq
         length: int = len(payload)
 
         peerStatus = getPeerStatus(addr)
-        peerStatus["seq"] = seq  # @todo handle sequence number
+        with update(peerStatus):
+            peerStatus.seq = seq  # @todo handle sequence number
+            peerStatus.lastseen = int(time.time())
 
         # Now handle the payload
 
@@ -781,94 +845,90 @@ class UdpServer(threading.Thread):
         payload = wrapper.decodeUL(payload)
 
         msgLen = len(payload)
-        logger.info(f"{seq=} {wrapper} {length=} {msgLen=}")
+        trace = tracer.enabled(peekDeviceId(data), wrapper.msgType)
+        if trace:
+            tracer.log(f"{seq=} {wrapper} {length=} {msgLen=}")
+
+        schema = UPLINK.get(wrapper.msgType)
+        if schema is None:
+            logger.warn(f"Unhandled message {wrapper.msgType}")
+            return MsgId(wrapper.msgType).name
 
-        unpack = Unpacker(payload)
+        msg = schema.decode(payload)
 
         if wrapper.msgType == MsgId.STATUS:
-            cseq, unk1, unk2, deviceid = unpack("<BBHI")
-            logger.info(f"{cseq=:x} {unk1=:x} {unk2=:x} {deviceid=}")
+            if trace:
+                tracer.log(
+                    "msg.cseq=%x msg.unk1=%x msg.unk2=%x msg.deviceid=%r",
+                    msg.cseq,
+                    msg.unk1,
+                    msg.unk2,
+                    msg.deviceid,
+                )
+            deviceid = msg.deviceid
 
             deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
             rooms_to_get_prog = (
                 set()
             )  # Set of rooms for which we need to get the current program
+            temperatures = []  # rows for Database.log_temperatures
 
-            for _ in range(8):
-                room, byte1, byte2, temp, settemp, t3, t2, t1, maxsetp, minsetp = (
-                    unpack("<IBBhhhhhhh")
-                )
-
-                mode = byte2 >> 4
-                unk9 = byte2 & 0xF
-                byte3, byte4, unk13, tempcurve, heatingsetp = unpack("<BBHBB")
-                sensorinfluence = (byte3 >> 3) & 0xF
-                units = (byte3 >> 2) & 0x1
-                advance = (byte3 >> 1) & 0x1
-                boost = (byte4 >> 2) & 0x1
-                cmdissued = (byte4 >> 1) & 0x1
-                winter = byte4 & 0x1
-
-                # Assume that if room is zero, 0xffffffff or byte1 is zero, then no thermostat is connected for that room
-                if room != 0 and room != 0xFFFFFFFF and byte1 != 0:
-                    logger.info(
-                        f"{room=:x} {byte1=:x} {mode=} {unk9=} {temp=} {settemp=} {t3=} {t2=} {t1=} {maxsetp=} {minsetp=} {sensorinfluence=} {units=} {advance=} {boost=} {cmdissued=} {winter=} {tempcurve=} {heatingsetp=}"
-                    )
-                    if byte1 == 0x8F:
-                        heating = 1
-                    elif byte1 == 0x83:
-                        heating = 0
-                    else:
-                        logger.warn(f"Unexpected {byte1=:x}")
-                        heating = None
+            for r in msg.rooms:
+                if r.connected:
+                    if trace:
+                        tracer.log(
+                            f"{r.room=:x} {r.byte1=:x} {r.mode=} {r.unk9=} {r.temp=} {r.settemp=} {r.t3=} {r.t2=} {r.t1=} {r.maxsetp=} {r.minsetp=} {r.sensorinfluence=} {r.units=} {r.advance=} {r.boost=} {r.cmdissued=} {r.winter=} {r.tempcurve=} {r.heatingsetp=}"
+                        )
+                    room = r.room
+                    heating = r.heating
+                    if heating is None:
+                        logger.warn(f"Unexpected {r.byte1=:x}")
 
                     roomStatus = getRoomStatus(deviceid, room)
 
-                    roomStatus["heating"] = heating
-                    roomStatus["temp"] = temp
-                    roomStatus["settemp"] = settemp
-                    roomStatus["t3"] = t3
-                    roomStatus["t2"] = t2
-                    roomStatus["t1"] = t1
-                    roomStatus["maxsetp"] = maxsetp
-                    roomStatus["minsetp"] = maxsetp
-                    roomStatus["mode"] = mode
-                    roomStatus["tempcurve"] = tempcurve
-                    roomStatus["heatingsetp"] = heatingsetp
-                    roomStatus["sensorinfluence"] = sensorinfluence
-                    roomStatus["units"] = units
-                    roomStatus["advance"] = advance
-                    roomStatus["boost"] = boost
-                    roomStatus["cmdissued"] = cmdissued
-                    roomStatus["winter"] = winter
-                    roomStatus["lastseen"] = int(time.time())
-
-                    if self.db is not None:
-                        # @todo log other parameters..
-                        self.db.log_temperature(
-                            room, temp / 10.0, settemp / 10.0, heating, conn=self.dbConn
+                    with update(roomStatus):
+                        roomStatus.heating = heating
+                        roomStatus.temp = r.temp
+                        roomStatus.settemp = r.settemp
+                        roomStatus.t3 = r.t3
+                        roomStatus.t2 = r.t2
+                        roomStatus.t1 = r.t1
+                        roomStatus.maxsetp = r.maxsetp
+                        roomStatus.minsetp = r.maxsetp
+                        roomStatus.mode = r.mode
+                        roomStatus.tempcurve = r.tempcurve
+                        roomStatus.heatingsetp = r.heatingsetp
+                        roomStatus.sensorinfluence = r.sensorinfluence
+                        roomStatus.units = r.units
+                        roomStatus.advance = r.advance
+                        roomStatus.boost = r.boost
+                        roomStatus.cmdissued = r.cmdissued
+                        roomStatus.winter = r.winter
+                        roomStatus.lastseen = int(time.time())
+
+                    # @todo log other parameters..
+                    for sample in self.temperatureFilter.filter(
+                        room, r.temp / 10.0, r.settemp / 10.0, heating
+                    ):
+                        temperatures.append(
+                            (
+                                sample.ts,
+                                room,
+                                sample.temp,
+                                sample.settemp,
+                                sample.heating,
+                            )
                         )
-                        self.dbConn.commit()
 
-                    if len(roomStatus["days"]) != 7 or wrapper.cloudsynclost:
+                    if len(roomStatus.days) != 7 or wrapper.cloudsynclost:
                         rooms_to_get_prog.add(room)
 
-                    # Handle fake boost timer
-                    if "fakeboost" in roomStatus:
-                        if (
-                            roomStatus["fakeboost"] != 0
-                            and roomStatus["fakeboost"] < time.time()
-                        ):
-                            # Call send_FAKE_BOOST but this needs to be done from a new thread
-                            # because it is blocking.
-                            # self.send_FAKE_BOOST(addr,deviceStatus,deviceid,room,0)
-                            thread = threading.Thread(
-                                target=self.send_FAKE_BOOST,
-                                args=(addr, deviceStatus, deviceid, room, 0),
-                            )
-                            thread.start()
-                    else:
-                        roomStatus["fakeboost"] = 0
+                    # The fake boost expiry is on the timer wheel, see
+                    # expireFakeBoost(). A boost restored after a restart
+                    # shows up with the first STATUS of its room.
+                    if "fakeboost" not in roomStatus:
+                        deadline = self.boosts.deadline(deviceid, room)
+                        roomStatus["fakeboost"] = deadline or 0
 
             # OpenTherm parameters
             # From the manual we expect the following to be present somewhere:
@@ -885,310 +945,299 @@ class UdpServer(threading.Thread):
             # PrES = central heating system pressure.
             # tFL2 = reading of the heating flow sensor on second circuit
 
-            otFlags1, otFlags2 = unpack("<BB")
-
-            boilerHeating = (otFlags1 >> 5) & 0x1
-            dhwMode = (otFlags1 >> 6) & 0x1
+            if temperatures and self.db is not None:
+                # All the rooms in one transaction
+                self.db.log_temperatures(temperatures, conn=self.dbConn)
 
-            deviceStatus["boilerOn"] = boilerHeating
-            deviceStatus["dhwMode"] = dhwMode
+            with update(deviceStatus):
+                deviceStatus.boilerOn = msg.boilerHeating
+                deviceStatus.dhwMode = msg.dhwMode
 
-            otUnk1, otUnk2, tFLO, otUnk4, tdH, tESt, otUnk7, otUnk8, otUnk9, otUnk10 = (
-                unpack("<hhhhhhhhhh")
-            )
+                deviceStatus.tFLO = msg.tFLO
+                deviceStatus.tdH = msg.tdH
+                deviceStatus.tESt = msg.tESt
 
-            deviceStatus["tFLO"] = tFLO
-            deviceStatus["tdH"] = tdH
-            deviceStatus["tESt"] = tESt
+                # Other params
 
-            # Other params
+                deviceStatus.wifisignal = msg.wifisignal
+                deviceStatus.lastseen = int(time.time())
 
-            wifisignal, unk16, unk17, unk18, unk19, unk20 = unpack("<BBHHHH")
-
-            deviceStatus["wifisignal"] = wifisignal
-            deviceStatus["lastseen"] = int(time.time())
-
-            logger.info(getStatus())
+            if trace:
+                tracer.log("%s", getStatus())
 
             # Send a DL STATUS message
-            self.send_STATUS(addr, deviceid, deviceStatus["lastseen"], response=1)
+            self.send_STATUS(addr, deviceid, deviceStatus.lastseen, response=1)
 
             # Fetch updated program for any rooms in rooms_to_get_prog set
-            for room in rooms_to_get_prog:
-                time.sleep(
-                    1
-                )  # embedded device may not handle lots of messages in a short time
-                self.send_GET_PROG(addr, deviceStatus, deviceid, room, response=0)
+            self.fetch_programs(addr, deviceStatus, deviceid, rooms_to_get_prog)
 
         elif wrapper.msgType == MsgId.GET_PROG:
-            cseq, unk1, unk2, deviceid, room, unk3 = unpack("<BBHIII")
-
-            logger.info(f"{deviceid=} {room=}")
+            if trace:
+                tracer.log("msg.deviceid=%r msg.room=%r", msg.deviceid, msg.room)
 
-            deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
-            if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq=:x}")
+            deviceStatus = self._extracted_from_handleMsg_27(
+                msg.deviceid, peerStatus, addr
+            )
+            if msg.cseq != LastCSeq(deviceStatus):
+                logger.warn(f"Unexpected {msg.cseq=:x}")
 
-            if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+            if msg.unk1 != 0x2:
+                logger.warn(f"Unexpected {msg.unk1=:x}")
 
-            if unk2 != 1:
-                logger.warn(f"Unexpected {unk2=:x}")
+            if msg.unk2 != 1:
+                logger.warn(f"Unexpected {msg.unk2=:x}")
 
-            if unk3 != 0x800FE0:
-                logger.warn(f"Unexpected {unk3=:x}")
+            if msg.unk3 != 0x800FE0:
+                logger.warn(f"Unexpected {msg.unk3=:x}")
 
             if wrapper.response:
                 SignalCSeq(
-                    deviceStatus, cseq, unk3
+                    deviceStatus, msg.cseq, msg.unk3
                 )  # @todo Is there any meaningful data in the response?
 
         elif wrapper.msgType == MsgId.PING:
-            cseq, unk1, unk2, deviceid, unk3 = unpack("<BBHIH")
-
-            logger.info(f"{deviceid=}")
+            if trace:
+                tracer.log("msg.deviceid=%r", msg.deviceid)
 
-            deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
-            if cseq != UNUSED_CSEQ:
-                logger.warn(f"Unexpected {cseq=}")
+            deviceStatus = self._extracted_from_handleMsg_27(
+                msg.deviceid, peerStatus, addr
+            )
+            if msg.cseq != UNUSED_CSEQ:
+                logger.warn(f"Unexpected {msg.cseq=}")
 
-            if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+            if msg.unk1 != 0x2:
+                logger.warn(f"Unexpected {msg.unk1=:x}")
 
             # on uplink unk2 is usually 4, but can be zero (when out of sync?)
-            if unk2 not in [4, 0]:
-                logger.warn(f"Unexpected {unk2=:x}")
+            if msg.unk2 not in [4, 0]:
+                logger.warn(f"Unexpected {msg.unk2=:x}")
 
-            if unk3 != 1:
-                logger.warn(f"Unexpected {unk3=:x}")
+            if msg.unk3 != 1:
+                logger.warn(f"Unexpected {msg.unk3=:x}")
 
             # Send a DL PING message
-            self.send_PING(addr, deviceid, response=1)
+            self.send_PING(addr, msg.deviceid, response=1)
 
         elif wrapper.msgType == MsgId.REFRESH:
-            cseq, unk1, unk2, deviceid = unpack("<BBHI")
             # Padding at end ??
-            logger.info(f"{deviceid=}")
+            if trace:
+                tracer.log("msg.deviceid=%r", msg.deviceid)
 
-            deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
-            if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq}")
+            deviceStatus = self._extracted_from_handleMsg_27(
+                msg.deviceid, peerStatus, addr
+            )
+            if msg.cseq != LastCSeq(deviceStatus):
+                logger.warn(f"Unexpected {msg.cseq}")
 
-            if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+            if msg.unk1 != 0x2:
+                logger.warn(f"Unexpected {msg.unk1=:x}")
 
-            if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
+            if msg.unk2 != 0x1:
+                logger.warn(f"Unexpected {msg.unk2=:x}")
 
             if wrapper.response:
                 SignalCSeq(
-                    deviceStatus, cseq, unk2
+                    deviceStatus, msg.cseq, msg.unk2
                 )  # @todo Is there any meaninngful data in the response?
 
         elif wrapper.msgType == MsgId.DEVICE_TIME:
             # It looks like only the 1st byte in DEVICE_TIME is valid
             # 0 = no dst 1 = dst ?
             # The rest of the payload appears to be garbage?
-            cseq, unk1, unk2, deviceid, val, unk3, unk4, unk5 = unpack("<BBHIBBHI")
-            logger.info(f"{deviceid=} {val=}")
+            if trace:
+                tracer.log("msg.deviceid=%r msg.val=%r", msg.deviceid, msg.val)
 
-            deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
-            if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq=}")
+            deviceStatus = self._extracted_from_handleMsg_27(
+                msg.deviceid, peerStatus, addr
+            )
+            if msg.cseq != LastCSeq(deviceStatus):
+                logger.warn(f"Unexpected {msg.cseq=}")
 
-            if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+            if msg.unk1 != 0x2:
+                logger.warn(f"Unexpected {msg.unk1=:x}")
 
-            if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
+            if msg.unk2 != 0x1:
+                logger.warn(f"Unexpected {msg.unk2=:x}")
 
-            if unk3 != 0x0:
-                logger.warn(f"Unexpected {unk3=:x}")
+            if msg.unk3 != 0x0:
+                logger.warn(f"Unexpected {msg.unk3=:x}")
 
-            if unk4 != 0x0:
-                logger.warn(f"Unexpected {unk4=:x}")
+            if msg.unk4 != 0x0:
+                logger.warn(f"Unexpected {msg.unk4=:x}")
 
-            if unk5 != 0x0:
-                logger.warn(f"Unexpected {unk5=:x}")
+            if msg.unk5 != 0x0:
+                logger.warn(f"Unexpected {msg.unk5=:x}")
 
             if wrapper.response:
-                SignalCSeq(deviceStatus, cseq, val)
+                SignalCSeq(deviceStatus, msg.cseq, msg.val)
 
         elif wrapper.msgType == MsgId.OUTSIDE_TEMP:
-            cseq, unk1, unk2, deviceid, val = unpack("<BBHIB")
+            if trace:
+                tracer.log("msg.deviceid=%r msg.val=%r", msg.deviceid, msg.val)
 
-            logger.info(f"{deviceid=} {val=}")
-
-            deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
-            if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq=}")
+            deviceStatus = self._extracted_from_handleMsg_27(
+                msg.deviceid, peerStatus, addr
+            )
+            if msg.cseq != LastCSeq(deviceStatus):
+                logger.warn(f"Unexpected {msg.cseq=}")
 
-            if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+            if msg.unk1 != 0x2:
+                logger.warn(f"Unexpected {msg.unk1=:x}")
 
-            if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
+            if msg.unk2 != 0x1:
+                logger.warn(f"Unexpected {msg.unk2=:x}")
 
             # val  = 0x0 means no external temperature management
             #        0x1 means boiler external temperature management
             #      = 0x2 means web external temperature management
 
             if wrapper.response:
-                SignalCSeq(deviceStatus, cseq, val)
+                SignalCSeq(deviceStatus, msg.cseq, msg.val)
 
         elif wrapper.msgType == MsgId.PROG_END:
-            cseq, unk1, unk2, deviceid, room, unk3 = unpack("<BBHIIH")
-            logger.info(f"{deviceid=} {room=} {unk3=:x}")
+            if trace:
+                tracer.log(
+                    "msg.deviceid=%r msg.room=%r msg.unk3=%x",
+                    msg.deviceid,
+                    msg.room,
+                    msg.unk3,
+                )
 
-            deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
-            if cseq != UNUSED_CSEQ:
-                logger.warn(f"Unexpected {cseq=}")
+            deviceStatus = self._extracted_from_handleMsg_27(
+                msg.deviceid, peerStatus, addr
+            )
+            if msg.cseq != UNUSED_CSEQ:
+                logger.warn(f"Unexpected {msg.cseq=}")
 
-            if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+            if msg.unk1 != 0x2:
+                logger.warn(f"Unexpected {msg.unk1=:x}")
 
-            if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
+            if msg.unk2 != 0x1:
+                logger.warn(f"Unexpected {msg.unk2=:x}")
 
-            if unk3 != 0xA14:
-                logger.warn(f"Unexpected {unk3=:x}")
+            if msg.unk3 != 0xA14:
+                logger.warn(f"Unexpected {msg.unk3=:x}")
 
             # Send a PROG_END
             if wrapper.response != 1:
-                self.send_PROG_END(addr, deviceid, room, response=1)
+                self.send_PROG_END(addr, msg.deviceid, msg.room, response=1)
 
         elif wrapper.msgType == MsgId.SWVERSION:
-            cseq, unk1, unk2, deviceid, version = unpack("<BBHI13s")
-            logger.info(f"{deviceid=} {version=}")
-            deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
-            deviceStatus["version"] = str(version)
+            if trace:
+                tracer.log("msg.deviceid=%r msg.version=%r", msg.deviceid, msg.version)
+            deviceStatus = self._extracted_from_handleMsg_27(
+                msg.deviceid, peerStatus, addr
+            )
+            deviceStatus["version"] = str(msg.version)
 
-            if cseq != LastCSeq(deviceStatus):
-                logger.warn(f"Unexpected {cseq=}")
+            if msg.cseq != LastCSeq(deviceStatus):
+                logger.warn(f"Unexpected {msg.cseq=}")
 
-            if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+            if msg.unk1 != 0x2:
+                logger.warn(f"Unexpected {msg.unk1=:x}")
 
-            if unk2 != 1:
-                logger.warn(f"Unexpected {unk2=:x}")
+            if msg.unk2 != 1:
+                logger.warn(f"Unexpected {msg.unk2=:x}")
 
             if wrapper.response != 1:
-                self.send_SWVERSION(addr, deviceStatus, deviceid, response=1)
+                self.send_SWVERSION(addr, deviceStatus, msg.deviceid, response=1)
             else:
-                SignalCSeq(deviceStatus, cseq, str(version))
+                SignalCSeq(deviceStatus, msg.cseq, str(msg.version))
 
         elif wrapper.msgType == MsgId.PROGRAM:
-            cseq, unk1, unk2, deviceid, room, day = unpack("<BBHIIH")
-            prog = []
-            for _ in range(24):
-                (p,) = unpack("<B")
-                prog.append(p)
-            logger.info(f"{deviceid=} {room=} {day=} prog={ [ hex(l) for l in prog ] }")
+            prog = list(msg.prog)
+            if trace:
+                tracer.log(
+                    "msg.deviceid=%r msg.room=%r msg.day=%r prog=%s",
+                    msg.deviceid,
+                    msg.room,
+                    msg.day,
+                    [hex(p) for p in prog],
+                )
 
-            deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
-            roomStatus = getRoomStatus(deviceid, room)
-            roomStatus["days"][day] = prog
-            logger.info(getStatus())
+            deviceStatus = self._extracted_from_handleMsg_27(
+                msg.deviceid, peerStatus, addr
+            )
+            roomStatus = getRoomStatus(msg.deviceid, msg.room)
+            roomStatus["days"][msg.day] = prog
+            if trace:
+                tracer.log("%s", getStatus())
 
-            if cseq != UNUSED_CSEQ:
-                logger.warn(f"Unexpected {cseq=}")
+            if msg.cseq != UNUSED_CSEQ:
+                logger.warn(f"Unexpected {msg.cseq=}")
 
-            if unk1 != 0x2:
-                logger.warn(f"Unexpected {unk1=:x}")
+            if msg.unk1 != 0x2:
+                logger.warn(f"Unexpected {msg.unk1=:x}")
 
-            if unk2 != 1:
-                logger.warn(f"Unexpected {unk2=:x}")
+            if msg.unk2 != 1:
+                logger.warn(f"Unexpected {msg.unk2=:x}")
 
             # Send a DL PROGRAM message
             if wrapper.response != 1:
                 self.send_PROGRAM(
-                    addr, deviceStatus, deviceid, room, day, prog, response=1
+                    addr,
+                    deviceStatus,
+                    msg.deviceid,
+                    msg.room,
+                    msg.day,
+                    prog,
+                    response=1,
                 )
 
-        elif self.set_messages_payload_size(wrapper.msgType) is not None:
+        elif wrapper.msgType in SET_PAYLOAD_SIZE:
             # Handles generic MsgId.SET_* messages
-            # @todo can any of the MsgId.SET_* values be negative?
-            cseq, flags, unk2, deviceid, room = unpack("<BBHII")
-
-            numBytes = self.set_messages_payload_size(wrapper.msgType)
+            deviceStatus = self._extracted_from_handleMsg_27(
+                msg.deviceid, peerStatus, addr
+            )
+            roomStatus = getRoomStatus(msg.deviceid, msg.room)
+
+            if trace:
+                tracer.log(
+                    "msg.cseq=%r msg.deviceid=%r msg.room=%r msg.value=%r",
+                    msg.cseq,
+                    msg.deviceid,
+                    msg.room,
+                    msg.value,
+                )
 
-            if numBytes == 4:
-                (value,) = unpack("<I")
-            elif numBytes == 2:
-                (value,) = unpack("<H")
-            elif numBytes == 1:
-                (value,) = unpack("<B")
-            else:
-                logger.warn(f"Unrecognised MsgType {wrapper.msgType:x}")
-                value = None
+            # Update the device status with the updated value
+            roomStatus[SET_PARAMS[wrapper.msgType]] = msg.value
 
-            deviceStatus = self._extracted_from_handleMsg_27(deviceid, peerStatus, addr)
-            roomStatus = getRoomStatus(deviceid, room)
+            if msg.unk2 != 0x1:
+                logger.warn(f"Unexpected {msg.unk2=:x}")
 
-            logger.info(f"{cseq=} {deviceid=} {room=} {value=}")
+            if wrapper.downlink and msg.flags != 0x0:
+                logger.warn(f"Unexpected {msg.flags=:x} for downlink")
 
-            # Update the device status with the updated value
-            if wrapper.msgType == MsgId.SET_T1:
-                roomStatus["t1"] = value
-            elif wrapper.msgType == MsgId.SET_T2:
-                roomStatus["t2"] = value
-            elif wrapper.msgType == MsgId.SET_T3:
-                roomStatus["t3"] = value
-            elif wrapper.msgType == MsgId.SET_MIN_HEAT_SETP:
-                roomStatus["minsetp"] = value
-            elif wrapper.msgType == MsgId.SET_MAX_HEAT_SETP:
-                roomStatus["maxsetp"] = value
-            elif wrapper.msgType == MsgId.SET_UNITS:
-                roomStatus["units"] = value
-            elif wrapper.msgType == MsgId.SET_SEASON:
-                roomStatus["winter"] = value
-            elif wrapper.msgType == MsgId.SET_ADVANCE:
-                roomStatus["advance"] = value
-            elif wrapper.msgType == MsgId.SET_MODE:
-                roomStatus["mode"] = value
-            elif wrapper.msgType == MsgId.SET_SENSOR_INFLUENCE:
-                roomStatus["sensorinfluence"] = value
-            elif wrapper.msgType == MsgId.SET_CURVE:
-                roomStatus["tempcurve"] = value
-
-            if unk2 != 0x1:
-                logger.warn(f"Unexpected {unk2=:x}")
-
-            if wrapper.downlink and flags != 0x0:
-                logger.warn(f"Unexpected {flags=:x} for downlink")
-
-            if not wrapper.downlink and flags not in [0x0, 0x2]:
-                logger.warn(f"Unexpected {flags=:x} for uplink")
+            if not wrapper.downlink and msg.flags not in [0x0, 0x2]:
+                logger.warn(f"Unexpected {msg.flags=:x} for uplink")
 
             # Send a DL SET message if this was initiated by the device
-            if value is not None:
-                if wrapper.response != 1:
-                    self.send_SET(
-                        addr,
-                        deviceStatus,
-                        deviceid,
-                        room,
-                        wrapper.msgType,
-                        value,
-                        response=1,
-                    )
-                else:
-                    SignalCSeq(deviceStatus, cseq, value)
-
-        else:
-            logger.warn(f"Unhandled message {wrapper.msgType}")
+            if wrapper.response != 1:
+                self.send_SET(
+                    addr,
+                    deviceStatus,
+                    msg.deviceid,
+                    msg.room,
+                    wrapper.msgType,
+                    msg.value,
+                    response=1,
+                )
+            else:
+                SignalCSeq(deviceStatus, msg.cseq, msg.value)
 
-        if unpack.getOffset() != msgLen:
+        if schema.size != msgLen:
             # Check we have consumed the complete message we received
-            logger.warn(f"Internal error offset={unpack.getOffset()} {msgLen=}")
+            logger.warn(f"Internal error offset={schema.size} {msgLen=}")
 
         return MsgId(wrapper.msgType).name
 
     # TODO Rename this here and in `handleMsg`
     def _extracted_from_handleMsg_27(self, deviceid, peerStatus, addr):
         result = getDeviceStatus(deviceid)
-        peerStatus["devices"].add(deviceid)
-        result["addr"] = addr
+        setPeerDevice(addr, deviceid)
+        if result.get("addr") != addr:
+            result["addr"] = addr
 
         return result
 